@@ -0,0 +1,53 @@
+import asyncio
+
+_DONE = object()
+
+
+async def run_concurrent(jobs, worker, concurrency=16):
+    """Await worker(payload) for every (key, payload) in jobs, keeping at most
+    `concurrency` calls in flight, and yield (key, result) as each one finishes.
+
+    Results arrive in completion order, not submission order, so callers must
+    use the key to put them back in place. If a worker raises, the remaining
+    workers are cancelled and the exception is re-raised to the caller.
+    """
+    pending = asyncio.Queue(maxsize=concurrency * 2)
+    finished = asyncio.Queue()
+
+    async def feed():
+        for job in jobs:
+            await pending.put(job)
+        for _ in range(concurrency):
+            await pending.put(_DONE)
+
+    async def work():
+        while True:
+            job = await pending.get()
+            if job is _DONE:
+                break
+            key, payload = job
+            try:
+                result = await worker(payload)
+            except Exception as e:
+                await finished.put(e)
+                return
+            await finished.put((key, result))
+        await finished.put(_DONE)
+
+    tasks = [asyncio.create_task(feed())]
+    tasks += [asyncio.create_task(work()) for _ in range(concurrency)]
+
+    try:
+        running = concurrency
+        while running:
+            item = await finished.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import urllib.request
+
+# Offline submission through the providers' batch endpoints: write one JSONL
+# request per row, submit the file, poll until the job finishes, then read the
+# result JSONL back. Rows are joined on a custom id of the form "row-<id>".
+# Both providers bill batch jobs at roughly half the interactive price.
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+TERMINAL_STATES = ("completed", "failed", "expired", "cancelled",
+                   "SUCCEEDED", "FAILED", "EXPIRED", "CANCELLED")
+
+
+def row_key(row_id):
+    if hasattr(row_id, "item"):
+        row_id = row_id.item()
+    return f"row-{row_id}"
+
+
+def key_to_row_id(key):
+    value = key[len("row-"):]
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return path
+
+
+def load_job(state_path):
+    """Batch job submitted by an earlier run, so a restarted run polls it instead of resubmitting."""
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+
+def save_job(state_path, job):
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+
+
+def is_terminal(state):
+    return any(state.endswith(s) for s in TERMINAL_STATES)
+
+
+# --- OpenAI -----------------------------------------------------------------
+
+def openai_requests(items, model, temperature, system_prompt, response_format=None, budget=None):
+    """`response_format` defaults to a plain JSON object; `budget(sentence)`
+    optionally sets each request's max_tokens."""
+    for row_id, sentence in items:
+        body = {
+            "model": model,
+            "temperature": temperature,
+            "response_format": response_format or {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": sentence},
+            ],
+        }
+        if budget is not None:
+            body["max_tokens"] = budget(sentence)
+        yield {
+            "custom_id": row_key(row_id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        }
+
+
+def submit_openai_batch(client, requests_path):
+    with open(requests_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return {"provider": "openai", "id": batch.id}
+
+
+def wait_for_openai_batch(client, batch_id, poll_interval=30):
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        done = f"{counts.completed}/{counts.total}" if counts else "?"
+        print(f"batch {batch_id}: {batch.status} ({done} requests done)")
+        if is_terminal(batch.status):
+            return batch
+        time.sleep(poll_interval)
+
+
+def read_openai_results(client, batch, parse, usage=None):
+    """Return {row_id: parsed answer}. `parse` turns the message content into
+    the answer tuple; rows whose request or parse failed map to an error tuple.
+    If `usage` is a dict it is filled with
+    {row_id: {"input_tokens": ..., "output_tokens": ...}}."""
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            row_id = key_to_row_id(record["custom_id"])
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                results[row_id] = ("Error: Batch request failed", "Error: Batch request failed")
+                continue
+            if usage is not None:
+                counts = response["body"].get("usage") or {}
+                usage[row_id] = {"input_tokens": counts.get("prompt_tokens"),
+                                 "output_tokens": counts.get("completion_tokens")}
+            try:
+                results[row_id] = parse(response["body"]["choices"][0]["message"]["content"])
+            except (KeyError, ValueError, TypeError):
+                results[row_id] = ("Error: Malformed response", "Error: Malformed response")
+    return results
+
+
+# --- Gemini -----------------------------------------------------------------
+
+def gemini_requests(items, build_prompt, temperature, response_schema=None, budget=None,
+                    system_instruction=None):
+    """`response_schema` constrains the JSON answer; `budget(sentence)`
+    optionally sets each request's max_output_tokens. `system_instruction`
+    is sent ahead of every `build_prompt(sentence)`."""
+    for row_id, sentence in items:
+        generation_config = {
+            "response_mime_type": "application/json",
+            "temperature": temperature,
+        }
+        if response_schema is not None:
+            generation_config["response_schema"] = response_schema
+        if budget is not None:
+            generation_config["max_output_tokens"] = budget(sentence)
+        request = {
+            "contents": [{"role": "user", "parts": [{"text": build_prompt(sentence)}]}],
+            "generation_config": generation_config,
+        }
+        if system_instruction is not None:
+            request["system_instruction"] = {"parts": [{"text": system_instruction}]}
+        yield {"key": row_key(row_id), "request": request}
+
+
+def _gemini_call(api_key, url, method="GET", body=None, headers=None, raw=False):
+    request = urllib.request.Request(url, data=body, method=method)
+    request.add_header("x-goog-api-key", api_key)
+    for name, value in (headers or {}).items():
+        request.add_header(name, value)
+    with urllib.request.urlopen(request) as response:
+        data = response.read()
+        if raw:
+            return data, response.headers
+        return json.loads(data)
+
+
+def submit_gemini_batch(api_key, model_name, requests_path, base_url=GEMINI_BASE_URL):
+    with open(requests_path, "rb") as f:
+        data = f.read()
+
+    # Resumable upload: open a session, then send the bytes in one go.
+    _, headers = _gemini_call(
+        api_key, f"{base_url}/upload/v1beta/files", "POST",
+        json.dumps({"file": {"display_name": os.path.basename(requests_path)}}).encode("utf-8"),
+        {
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(len(data)),
+            "X-Goog-Upload-Header-Content-Type": "application/jsonl",
+            "Content-Type": "application/json",
+        },
+        raw=True,
+    )
+    uploaded = _gemini_call(
+        api_key, headers["X-Goog-Upload-URL"], "POST", data,
+        {"X-Goog-Upload-Command": "upload, finalize", "X-Goog-Upload-Offset": "0"},
+    )
+
+    model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+    operation = _gemini_call(
+        api_key, f"{base_url}/v1beta/{model_name}:batchGenerateContent", "POST",
+        json.dumps({"batch": {
+            "display_name": os.path.basename(requests_path),
+            "input_config": {"file_name": uploaded["file"]["name"]},
+        }}).encode("utf-8"),
+        {"Content-Type": "application/json"},
+    )
+    return {"provider": "gemini", "id": operation["name"]}
+
+
+def wait_for_gemini_batch(api_key, batch_name, poll_interval=30, base_url=GEMINI_BASE_URL):
+    while True:
+        batch = _gemini_call(api_key, f"{base_url}/v1beta/{batch_name}")
+        state = batch.get("metadata", {}).get("state", "UNKNOWN")
+        print(f"batch {batch_name}: {state}")
+        if is_terminal(state):
+            return batch
+        time.sleep(poll_interval)
+
+
+def read_gemini_results(api_key, batch, parse, base_url=GEMINI_BASE_URL, usage=None):
+    """Return {row_id: parsed answer}, like read_openai_results."""
+    responses_file = (batch.get("response") or {}).get("responsesFile")
+    if not responses_file:
+        return {}
+    data, _ = _gemini_call(
+        api_key, f"{base_url}/download/v1beta/{responses_file}:download?alt=media", raw=True
+    )
+    results = {}
+    for line in data.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        row_id = key_to_row_id(record["key"])
+        if "error" in record:
+            results[row_id] = ("Error: Batch request failed", "Error: Batch request failed")
+            continue
+        if usage is not None:
+            counts = (record.get("response") or {}).get("usageMetadata") or {}
+            usage[row_id] = {"input_tokens": counts.get("promptTokenCount"),
+                             "output_tokens": counts.get("candidatesTokenCount")}
+        try:
+            text = record["response"]["candidates"][0]["content"]["parts"][0]["text"]
+            results[row_id] = parse(text)
+        except (KeyError, IndexError, ValueError, TypeError):
+            results[row_id] = ("Error: Malformed response", "Error: Malformed response")
+    return results
@@ -0,0 +1,60 @@
+import json
+
+
+def chunked(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def build_batch_input(sentences):
+    """Number the sentences 0..N-1 and render them as the JSON array sent to the model.
+    Short positional ids keep the prompt small; callers map them back to row ids."""
+    return json.dumps(
+        [{"id": i, "sentence": sentence} for i, sentence in enumerate(sentences)],
+        ensure_ascii=False,
+    )
+
+
+def parse_batch_response(text, count):
+    """Parse a batched answer for `count` sentences.
+
+    Accepts either a bare JSON array or an object wrapping it under "results".
+    Returns ({id: (label, correction)}, missing_ids). Items with an unknown id,
+    a duplicate id or a missing/non-string field count as missing, so the
+    caller can retry exactly those sentences on their own.
+    """
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return {}, list(range(count))
+    if isinstance(data, dict):
+        data = data.get("results", [])
+    if not isinstance(data, list):
+        return {}, list(range(count))
+
+    results = {}
+    duplicated = set()
+    seen = set()
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        item_id = item.get("id")
+        if isinstance(item_id, str) and item_id.isdigit():
+            item_id = int(item_id)
+        if isinstance(item_id, bool) or not isinstance(item_id, int) or not 0 <= item_id < count:
+            continue
+        if item_id in seen:
+            duplicated.add(item_id)
+            continue
+        seen.add(item_id)
+        label = item.get("label")
+        correction = item.get("correction")
+        if not isinstance(label, str) or not isinstance(correction, str):
+            continue
+        results[item_id] = (label, correction)
+    for item_id in duplicated:
+        results.pop(item_id, None)
+
+    missing = [i for i in range(count) if i not in results]
+    return results, missing
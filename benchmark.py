@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from mock_llm_server import LATENCY_DISTS, start_server
+from telemetry import percentiles
+
+# Offline throughput benchmark for the labeling pipelines.
+#
+#   python benchmark.py --sizes 2000 20000 --latency 0.05 --latency-dist lognormal
+#
+# Every run gets a fresh mock_llm_server.py and a scratch directory holding
+# `rows` synthetic input rows (sentences from SOURCE_PATH, numbered so that
+# dedup and the response cache do not collapse them), and runs script.py's
+# or geminiApi.py's main path in a child process pointed at the mock. The child
+# reports its own wall time, peak RSS and bytes written to disk; tail
+# latency comes from the metrics file telemetry.py writes in the scratch
+# directory, and the token counts from the mock.
+#
+# Each result is appended to RESULTS_PATH with the git version, and the
+# table printed at the end compares it with the previous result for the
+# same pipeline, size and settings.
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+SOURCE_PATH = os.path.join(REPO, "Grammar_Correction.csv")
+RESULTS_PATH = "bench_results.jsonl"
+SIZES = (2000, 20000, 200000)
+PIPELINES = ("gpt", "gemini")
+CHILD_RESULT = "bench_child.json"
+# Input file names the two pipelines read from their working directory.
+INPUT_NAMES = {"gpt": "Grammar_Correction.csv", "gemini": "Grammar Correction.csv"}
+
+
+def synthetic_rows(n, duplicate_share=0.0, seed=0):
+    """`n` rows shaped like SOURCE_PATH. A `duplicate_share` of them repeat
+    the sentence of an earlier row, for measuring dedup."""
+    source = pd.read_csv(SOURCE_PATH)
+    rng = np.random.default_rng(seed)
+    df = source.iloc[rng.integers(0, len(source), n)].reset_index(drop=True)
+    df["Serial Number"] = np.arange(1, n + 1)
+    sentences = [f"{sentence} ({i})" for i, sentence in enumerate(df["Ungrammatical Statement"])]
+    repeats = np.flatnonzero(rng.random(n) < duplicate_share)
+    for i in repeats[repeats > 0]:
+        sentences[i] = sentences[rng.integers(0, i)]
+    df["Ungrammatical Statement"] = sentences
+    return df
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def disk_write_bytes():
+    """Bytes this process caused to be written to storage (Linux), else None."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def run_child(pipeline, concurrency, rpm):
+    """Run one pipeline in the current directory and write CHILD_RESULT."""
+    sys.path.insert(0, REPO)
+    started = time.perf_counter()
+    if pipeline == "gpt":
+        import script
+        script.main()
+    else:
+        sys.path.insert(0, os.path.join(REPO, "gemini"))
+        import geminiApi
+        geminiApi.MAX_WORKERS = concurrency
+        geminiApi.MAX_RPM = rpm
+        geminiApi.MAX_TPM = rpm * 10000
+        geminiApi.main_batch_process()
+    seconds = time.perf_counter() - started
+    with open(CHILD_RESULT, "w") as f:
+        json.dump({
+            "seconds": seconds,
+            # ru_maxrss is in KiB on Linux.
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "disk_write_bytes": disk_write_bytes(),
+        }, f)
+
+
+def request_latencies(path):
+    latencies, errors = [], 0
+    if not os.path.exists(path):
+        return latencies, errors
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if "summary" in record:
+                continue
+            if record["error"] is None:
+                latencies.append(record["seconds"])
+            else:
+                errors += 1
+    return latencies, errors
+
+
+def output_bytes(workdir, skip):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(workdir)
+        for name in names if name not in skip
+    )
+
+
+def run_one(pipeline, rows, settings, keep=False, verbose=False):
+    server = start_server(
+        latency=settings["latency"], latency_dist=settings["latency_dist"],
+        throttle_rate=settings["throttle_rate"], error_rate=settings["error_rate"], seed=settings["seed"],
+    )
+    host, port = server.server_address[:2]
+    workdir = tempfile.mkdtemp(prefix=f"bench_{pipeline}_{rows}_")
+    try:
+        input_name = INPUT_NAMES[pipeline]
+        synthetic_rows(rows, settings["duplicates"], settings["seed"]).to_csv(
+            os.path.join(workdir, input_name), index=False)
+        env = dict(
+            os.environ,
+            OPENAI_BASE_URL=f"http://{host}:{port}/v1", API_KEY="bench",
+            GEMINI_BASE_URL=f"http://{host}:{port}", GOOGLE_API_KEY="bench",
+            LLM_CACHE_PATH=os.path.join(workdir, "llm_cache.sqlite"),
+            GPT_CONCURRENCY=str(settings["concurrency"]), GPT_MAX_RPM=str(settings["rpm"]),
+            GPT_MAX_TPM=str(settings["rpm"] * 10000),
+        )
+        command = [sys.executable, os.path.abspath(__file__), "--child", pipeline,
+                   "--concurrency", str(settings["concurrency"]), "--rpm", str(settings["rpm"])]
+        log_path = os.path.join(workdir, "bench.log")
+        with open(log_path, "w") as log:
+            subprocess.run(command, cwd=workdir, env=env, check=True,
+                           stdout=None if verbose else log, stderr=subprocess.STDOUT)
+        with open(os.path.join(workdir, CHILD_RESULT)) as f:
+            child = json.load(f)
+        latencies, errors = request_latencies(os.path.join(workdir, "metrics.jsonl"))
+        served = server.state.snapshot()
+        return {
+            "version": git_version(),
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "pipeline": pipeline,
+            "rows": rows,
+            "settings": settings,
+            "seconds": round(child["seconds"], 3),
+            "rows_per_s": round(rows / child["seconds"], 1),
+            "latency_s": percentiles(latencies),
+            "client_errors": errors,
+            "peak_rss_mb": child["peak_rss_mb"],
+            "disk_write_bytes": child["disk_write_bytes"],
+            "output_bytes": output_bytes(workdir, {input_name, CHILD_RESULT, "bench.log"}),
+            "server": served,
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+        if keep:
+            print(f"kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def load_results(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(history, result):
+    for old in reversed(history):
+        if (old["pipeline"], old["rows"], old["settings"]) == (result["pipeline"], result["rows"], result["settings"]):
+            return old
+    return None
+
+
+def _change(new, old):
+    if new is None or not old:
+        return ""
+    return f" ({(new - old) / old:+.0%})"
+
+
+def format_results(results, history):
+    lines = [f"{'pipeline':<9}{'rows':>8}{'rows/s':>16}{'p50 s':>8}{'p99 s':>16}"
+             f"{'peak MB':>9}{'written MB':>12}{'errors':>8}  vs"]
+    for result in results:
+        old = previous_result(history, result) or {}
+        p99, old_p99 = result["latency_s"][99], (old.get("latency_s") or {}).get("99")
+        written = result["disk_write_bytes"] if result["disk_write_bytes"] is not None else result["output_bytes"]
+        lines.append(
+            f"{result['pipeline']:<9}{result['rows']:>8}"
+            f"{str(result['rows_per_s']) + _change(result['rows_per_s'], old.get('rows_per_s')):>16}"
+            f"{result['latency_s'][50] if result['latency_s'][50] is not None else '-':>8}"
+            f"{str(p99) + _change(p99, old_p99):>16}"
+            f"{result['peak_rss_mb']:>9}{written / 1e6:>12.1f}{result['client_errors']:>8}"
+            f"  {old.get('version', '-')}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the labeling pipelines against a local mock provider.")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES))
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds per request (mean, or median for lognormal)")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTS, default="lognormal")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="share of rows repeating an earlier sentence")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rpm", type=int, default=1000000, help="rate limit given to the pipelines")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directories")
+    parser.add_argument("--verbose", action="store_true", help="show the pipelines' output")
+    parser.add_argument("--child", choices=PIPELINES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.concurrency, args.rpm)
+        return
+
+    settings = {
+        "latency": args.latency, "latency_dist": args.latency_dist, "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate, "duplicates": args.duplicates, "concurrency": args.concurrency,
+        "rpm": args.rpm, "seed": args.seed,
+    }
+    history = load_results(args.results)
+    results = []
+    for pipeline in args.pipelines:
+        for rows in args.sizes:
+            print(f"{pipeline}: {rows} rows...", flush=True)
+            result = run_one(pipeline, rows, settings, args.keep, args.verbose)
+            with open(args.results, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+            results.append(result)
+    print(format_results(results, history))
+
+
+if __name__ == "__main__":
+    main()
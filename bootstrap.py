@@ -0,0 +1,332 @@
+import math
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from evaluation import SIMILARITY_THRESHOLD
+
+# Bootstrap confidence intervals and paired significance tests for the
+# metrics evaluation.evaluate() reports.
+#
+# Every metric is a function of column sums over the rows: correct labels,
+# exact matches, rows per type, per-class support / predictions / hits for the
+# mapped macro F1, ERRANT tp/fp/fn. score_table() lays those per-row counts
+# out as one (rows x columns) matrix. A block of resamples is drawn as an
+# index matrix (one resample per row), turned into a matrix of how often each
+# distinct count row was drawn, and multiplied with the distinct rows, so the
+# column sums of all resamples in the block come out of one matrix product;
+# the metrics are then computed column-wise over the resamples. Nothing loops
+# over rows or resamples in Python.
+#
+# A paired comparison aligns two results files on row id and scores both with
+# the same resamples, so the interval is for the difference itself.
+
+RESAMPLES = 10000
+CONFIDENCE = 0.95
+SEED = 0
+
+# Index matrix cells per block (resamples x rows); 2**24 int64 indices are 128MB.
+BLOCK_CELLS = 1 << 24
+
+# Same as gemini/errant_score.py.
+BETA = 0.5
+
+BINARY_METRICS = {
+    "strict_accuracy": "correct",
+    "mapped_accuracy": "mapped_correct",
+    "exact_match": "exact",
+    "high_quality_ratio": "high_quality",
+}
+
+
+class ScoreTable:
+    """Per-row counts of one results file. `values` has one row per scored
+    row and the column blocks named in `layout`; `types` and `classes` name
+    the columns of the per-type and per-class blocks."""
+
+    def __init__(self, row_ids, blocks, types, classes):
+        self.row_ids = np.asarray(row_ids)
+        self.types = list(types)
+        self.classes = list(classes)
+        self.layout = {}
+        parts, start = [], 0
+        for name, block in blocks.items():
+            block = np.asarray(block, dtype=float).reshape(len(self.row_ids), -1)
+            self.layout[name] = slice(start, start + block.shape[1])
+            parts.append(block)
+            start += block.shape[1]
+        self.values = np.hstack(parts) if parts else np.zeros((len(self.row_ids), 0))
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    @property
+    def errant(self):
+        return "tp" in self.layout
+
+    def take(self, positions):
+        table = ScoreTable.__new__(ScoreTable)
+        table.row_ids = self.row_ids[positions]
+        table.types, table.classes, table.layout = self.types, self.classes, self.layout
+        table.values = self.values[positions]
+        return table
+
+    def statistics(self, sums, rows):
+        """{metric: array over resamples} from column sums of shape
+        (resamples, columns) over `rows` drawn rows; "per_type" is
+        (resamples, types)."""
+        block = lambda name: sums[:, self.layout[name]]
+        out = {metric: block(column)[:, 0] / rows for metric, column in BINARY_METRICS.items()}
+        support, predicted, hits = block("support"), block("predicted"), block("hits")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # LabelIndex.report's F1 is 2tp / (support + predicted) for the
+            # classes that occur as a true or a predicted label.
+            present = (support + predicted) > 0
+            f1 = np.where(present, 2 * hits / (support + predicted), 0.0)
+            out["mapped_macro_f1"] = f1.sum(axis=1) / present.sum(axis=1)
+            out["per_type"] = block("type_correct") / block("type_rows")
+        if self.errant:
+            out[f"errant_f{BETA}"] = f_beta(block("tp")[:, 0], block("fp")[:, 0], block("fn")[:, 0])
+        return out
+
+
+def f_beta(tp, fp, fn, beta=BETA):
+    """errant_score.f_score() over arrays, unrounded."""
+    tp, fp, fn = (np.asarray(x, dtype=float) for x in (tp, fp, fn))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.where(fp > 0, tp / (tp + fp), 1.0)
+        r = np.where(fn > 0, tp / (tp + fn), 1.0)
+        return np.where(p + r > 0, (1 + beta ** 2) * p * r / (beta ** 2 * p + r), 0.0)
+
+
+def score_table(metrics, threshold=SIMILARITY_THRESHOLD, errant_counts=None):
+    """ScoreTable for the row_metrics of an evaluate() result. `errant_counts`
+    (see errant_counts()) adds ERRANT F0.5."""
+    rows = metrics["row_metrics"]
+    types = pd.get_dummies(rows["true_label"], dtype=float)
+    classes = sorted(set(rows["true_coarse"]) | set(rows["pred_coarse"]))
+    support = pd.get_dummies(pd.Categorical(rows["true_coarse"], categories=classes), dtype=float)
+    predicted = pd.get_dummies(pd.Categorical(rows["pred_coarse"], categories=classes), dtype=float)
+    blocks = {
+        "correct": rows["correct"],
+        "mapped_correct": rows["mapped_correct"],
+        "exact": rows["exact"],
+        "high_quality": rows["sim"] >= threshold,
+        "type_rows": types,
+        "type_correct": types.mul(rows["correct"].to_numpy(), axis=0),
+        "support": support,
+        "predicted": predicted,
+        "hits": support.mul(rows["mapped_correct"].to_numpy(), axis=0),
+    }
+    if errant_counts is not None:
+        counts = errant_counts.reindex(rows.index)
+        if counts.isna().any().any():
+            raise ValueError("errant_counts has no counts for some scored rows")
+        blocks.update(tp=counts["tp"], fp=counts["fp"], fn=counts["fn"])
+    return ScoreTable(rows["row_id"], {name: np.asarray(block) for name, block in blocks.items()},
+                      types.columns, classes)
+
+
+def errant_counts(df, loaded=None):
+    """Per-row ERRANT tp/fp/fn for the rows evaluate() scores in a
+    load_results() frame. Needs spaCy and errant; `loaded` is an
+    errant_score.load_annotator() pair to reuse."""
+    from gemini.errant_score import edit_counts
+
+    df = df[df["true_label"].notna()]
+    return edit_counts(df["source"], df["prediction"].fillna(""), df["reference"], loaded=loaded)
+
+
+def row_patterns(values):
+    """(distinct rows of `values`, pattern number of each row)."""
+    pattern = np.zeros(len(values), dtype=np.int64)
+    for column in values.T:
+        codes, uniques = pd.factorize(column)
+        pattern = pd.factorize(pattern * len(uniques) + codes)[0]
+    first = np.unique(pattern, return_index=True)[1]
+    return values[first], pattern
+
+
+def resampled_sums(values, resamples=RESAMPLES, seed=SEED, block_cells=BLOCK_CELLS):
+    """(resamples, columns) column sums of `values` over bootstrap resamples
+    of its rows.
+
+    Each block of resamples is an index matrix of row draws. Rows with the
+    same counts are interchangeable, so the draws are counted per distinct
+    row (pattern) rather than per row, which keeps the counting array small
+    and the final product cheap; the sums are exactly those of the drawn rows."""
+    n = len(values)
+    rng = np.random.default_rng(seed)
+    out = np.zeros((resamples, values.shape[1]))
+    if n == 0:
+        return out
+    patterns, pattern = row_patterns(values)
+    count = len(patterns)
+    block = max(1, block_cells // n)
+    for start in range(0, resamples, block):
+        size = min(block, resamples - start)
+        index = rng.integers(0, n, size=(size, n))
+        drawn = pattern[index]
+        drawn += (np.arange(size) * count)[:, None]
+        counts = np.bincount(drawn.ravel(), minlength=size * count).reshape(size, count)
+        out[start:start + size] = counts @ patterns
+    return out
+
+
+def _interval(samples, confidence):
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # A type can be missing from some resamples (or, when aligned, from all).
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+
+
+class Intervals:
+    """Point estimates with percentile bootstrap intervals: `overall` has one
+    row per metric, `per_type` one row per error type."""
+
+    def __init__(self, overall, per_type, rows, resamples, confidence):
+        self.overall = overall
+        self.per_type = per_type
+        self.rows = rows
+        self.resamples = resamples
+        self.confidence = confidence
+
+    def format(self):
+        lines = [f"{self.resamples} bootstrap resamples of {self.rows} rows, {self.confidence:.0%} intervals"]
+        for metric, row in self.overall.iterrows():
+            lines.append(f"{metric:<24}{row['estimate']:>8.4f}   [{row['low']:.4f}, {row['high']:.4f}]")
+        lines.append("")
+        lines.append(f"{'Error Type':<45}{'rows':>6}{'accuracy':>10}   interval")
+        for label, row in self.per_type.sort_values("estimate", ascending=False).iterrows():
+            lines.append(f"{str(label)[:44]:<45}{int(row['rows']):>6}{row['estimate']:>10.3f}"
+                         f"   [{row['low']:.3f}, {row['high']:.3f}]")
+        return "\n".join(lines)
+
+
+def bootstrap(table, resamples=RESAMPLES, confidence=CONFIDENCE, seed=SEED):
+    """Intervals for every metric of a ScoreTable."""
+    n = len(table)
+    point = table.statistics(table.values.sum(axis=0, keepdims=True), n)
+    samples = table.statistics(resampled_sums(table.values, resamples, seed), n)
+
+    overall = {}
+    for metric, values in samples.items():
+        if metric == "per_type":
+            continue
+        low, high = _interval(values, confidence)
+        overall[metric] = {"estimate": point[metric][0], "low": low, "high": high}
+    low, high = _interval(samples["per_type"], confidence)
+    per_type = pd.DataFrame({
+        "rows": table.values[:, table.layout["type_rows"]].sum(axis=0).astype(int),
+        "estimate": point["per_type"][0], "low": low, "high": high,
+    }, index=pd.Index(table.types, name="Error Type"))
+    return Intervals(pd.DataFrame.from_dict(overall, orient="index"), per_type, n, resamples, confidence)
+
+
+def bootstrap_metrics(metrics, threshold=SIMILARITY_THRESHOLD, errant_counts=None,
+                      resamples=RESAMPLES, confidence=CONFIDENCE, seed=SEED):
+    return bootstrap(score_table(metrics, threshold, errant_counts), resamples, confidence, seed)
+
+
+def mcnemar(a, b):
+    """(rows only a got right, rows only b got right, two-sided p) for two
+    aligned boolean arrays: the exact binomial test below 25 discordant rows,
+    else the continuity-corrected chi-square."""
+    a, b = np.asarray(a, dtype=bool), np.asarray(b, dtype=bool)
+    only_a, only_b = int((a & ~b).sum()), int((~a & b).sum())
+    discordant = only_a + only_b
+    if discordant == 0:
+        return only_a, only_b, 1.0
+    if discordant < 25:
+        tail = sum(math.comb(discordant, k) for k in range(min(only_a, only_b) + 1)) / 2 ** discordant
+        return only_a, only_b, min(1.0, 2 * tail)
+    chi2 = (abs(only_a - only_b) - 1) ** 2 / discordant
+    return only_a, only_b, math.erfc(math.sqrt(chi2 / 2))
+
+
+def align(table_a, table_b):
+    """Positions into two ScoreTables of the row ids both contain (the last
+    occurrence where a file repeats a row id), in table_a's order."""
+    a = pd.Series(np.arange(len(table_a)), index=table_a.row_ids)
+    b = pd.Series(np.arange(len(table_b)), index=table_b.row_ids)
+    a, b = a[~a.index.duplicated(keep="last")], b[~b.index.duplicated(keep="last")]
+    common = a.index[a.index.isin(b.index)]
+    return a[common].to_numpy(), b[common].to_numpy()
+
+
+class Comparison:
+    """Paired differences (a - b) per metric with their bootstrap interval
+    and p-value, and McNemar's test for the per-row binary metrics."""
+
+    def __init__(self, names, table, rows, unmatched, resamples, confidence):
+        self.names = names
+        self.table = table
+        self.rows = rows
+        self.unmatched = unmatched
+        self.resamples = resamples
+        self.confidence = confidence
+
+    def format(self):
+        a, b = self.names
+        lines = [f"{a} vs {b}: {self.rows} rows aligned on row id "
+                 f"({self.unmatched[0]} only in {a}, {self.unmatched[1]} only in {b}); "
+                 f"{self.resamples} paired resamples, {self.confidence:.0%} intervals"]
+        lines.append(f"{'metric':<24}{a[:10]:>10}{b[:10]:>10}{'a - b':>10}{'interval':>22}{'p boot':>9}"
+                     f"{'only a':>8}{'only b':>8}{'p McNemar':>11}")
+        for metric, row in self.table.iterrows():
+            mcnemar_cells = (f"{int(row['only_a']):>8}{int(row['only_b']):>8}{row['p_mcnemar']:>11.4f}"
+                             if not np.isnan(row["p_mcnemar"]) else f"{'-':>8}{'-':>8}{'-':>11}")
+            lines.append(f"{metric:<24}{row['a']:>10.4f}{row['b']:>10.4f}{row['difference']:>+10.4f}"
+                         f"{f'[{row.low:+.4f}, {row.high:+.4f}]':>22}{row['p_bootstrap']:>9.4f}"
+                         + mcnemar_cells)
+        return "\n".join(lines)
+
+
+def paired_bootstrap(table_a, table_b, names=("a", "b"), resamples=RESAMPLES, confidence=CONFIDENCE, seed=SEED):
+    """Comparison of two ScoreTables over the row ids both contain.
+
+    Both tables are resampled with the same index matrix. The p-value is
+    twice the share of resamples on the smaller side of zero, i.e. how often
+    the sign of the difference flips."""
+    positions_a, positions_b = align(table_a, table_b)
+    if len(positions_a) == 0:
+        raise ValueError(f"{names[0]} and {names[1]} have no row ids in common")
+    a, b = table_a.take(positions_a), table_b.take(positions_b)
+    n, width = len(a), a.values.shape[1]
+    sums = resampled_sums(np.hstack([a.values, b.values]), resamples, seed)
+    point_a = a.statistics(a.values.sum(axis=0, keepdims=True), n)
+    point_b = b.statistics(b.values.sum(axis=0, keepdims=True), n)
+    samples_a, samples_b = a.statistics(sums[:, :width], n), b.statistics(sums[:, width:], n)
+
+    rows = {}
+    for metric in samples_a:
+        if metric == "per_type" or metric not in samples_b:
+            continue
+        difference = samples_a[metric] - samples_b[metric]
+        low, high = _interval(difference, confidence)
+        flips = min((difference <= 0).mean(), (difference >= 0).mean())
+        row = {
+            "a": point_a[metric][0], "b": point_b[metric][0],
+            "difference": point_a[metric][0] - point_b[metric][0],
+            "low": low, "high": high, "p_bootstrap": min(1.0, 2 * flips),
+            "only_a": np.nan, "only_b": np.nan, "p_mcnemar": np.nan,
+        }
+        if metric in BINARY_METRICS:
+            column = BINARY_METRICS[metric]
+            row["only_a"], row["only_b"], row["p_mcnemar"] = mcnemar(
+                a.values[:, a.layout[column]][:, 0], b.values[:, b.layout[column]][:, 0])
+        rows[metric] = row
+    unmatched = (len(set(table_a.row_ids)) - n, len(set(table_b.row_ids)) - n)
+    return Comparison(names, pd.DataFrame.from_dict(rows, orient="index"), n, unmatched, resamples, confidence)
+
+
+def compare_metrics(metrics_a, metrics_b, threshold=SIMILARITY_THRESHOLD, errant_a=None, errant_b=None,
+                    resamples=RESAMPLES, confidence=CONFIDENCE, seed=SEED):
+    """paired_bootstrap() of two evaluate() results."""
+    names = (metrics_a["model"] or "a", metrics_b["model"] or "b")
+    if names[0] == names[1]:
+        names = (f"{names[0]} (a)", f"{names[1]} (b)")
+    return paired_bootstrap(score_table(metrics_a, threshold, errant_a), score_table(metrics_b, threshold, errant_b),
+                            names, resamples, confidence, seed)
@@ -0,0 +1,77 @@
+import json
+
+from labels import OFFICIAL_ERROR_TYPES, NONE_LABEL
+from rate_limiter import estimate_tokens
+
+# Compact answers: {"i": <label number>, "c": "<correction>"}.
+#
+# The verbose prompts make the model spell out a label such as "Lack of
+# Parallelism in Lists or Series" on every row. Here it answers with the
+# label's position in COMPACT_LABELS, and each provider's structured-output
+# mode (OpenAI json_schema with strict=True, Gemini response_schema)
+# restricts "i" to the valid numbers, so the answer never needs a label repair.
+# The output is also capped per row with output_budget(), so a rambling
+# answer is cut off instead of billed in full; a cut-off answer fails
+# parse_compact() and is treated like any other malformed response.
+
+COMPACT_LABELS = OFFICIAL_ERROR_TYPES + [NONE_LABEL]
+
+# Room for the braces, keys and label number around the correction.
+ANSWER_OVERHEAD_TOKENS = 16
+
+OPENAI_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "grammar_label",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "i": {"type": "integer", "enum": list(range(len(COMPACT_LABELS)))},
+                "c": {"type": "string"},
+            },
+            "required": ["i", "c"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Gemini only accepts enums of strings, so the label number is sent as text.
+GEMINI_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "i": {"type": "STRING", "enum": [str(i) for i in range(len(COMPACT_LABELS))]},
+        "c": {"type": "STRING"},
+    },
+    "required": ["i", "c"],
+}
+
+
+def numbered_labels():
+    return "\n".join(f"{i}: {label}" for i, label in enumerate(COMPACT_LABELS))
+
+
+def output_budget(sentence):
+    """max_output_tokens for one answer: the correction may grow to twice the
+    sentence (e.g. expanded abbreviations) plus the JSON around it."""
+    return 2 * estimate_tokens(str(sentence)) + ANSWER_OVERHEAD_TOKENS
+
+
+def parse_compact(text):
+    """(official label, correction) from a compact answer.
+
+    Parsing is strict: the text must be exactly the JSON object the schema
+    describes (no code fences, no extra keys). Raises ValueError otherwise,
+    including for answers truncated by the output budget.
+    """
+    data = json.loads(text)
+    if not isinstance(data, dict) or set(data) != {"i", "c"}:
+        raise ValueError(f"expected keys 'i' and 'c', got {text!r}")
+    index, correction = data["i"], data["c"]
+    if isinstance(index, str) and index.isdigit():
+        index = int(index)
+    if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(COMPACT_LABELS):
+        raise ValueError(f"label number out of range: {data['i']!r}")
+    if not isinstance(correction, str):
+        raise ValueError(f"correction is not a string: {correction!r}")
+    return COMPACT_LABELS[index], correction
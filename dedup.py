@@ -0,0 +1,124 @@
+import re
+import zlib
+
+import numpy as np
+
+# Send one request per group of duplicate sentences and copy the answer to
+# every row of the group.
+#
+# Rows are grouped by a normalized key (whitespace collapsed, case folded,
+# trailing punctuation dropped). With near=True, keys whose character
+# shingles overlap by at least `threshold` (Jaccard) are merged as well;
+# candidates come from MinHash signatures bucketed with LSH, so only likely
+# pairs are compared. Row ids are kept, so metrics are still computed per
+# original row.
+
+DEDUP_MODES = ("off", "normalized", "near")
+NEAR_THRESHOLD = 0.8
+NUM_PERM = 64
+BANDS = 16
+SHINGLE = 5
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+
+
+def sentence_key(sentence):
+    text = " ".join(str(sentence).split()).lower()
+    return re.sub(r"[\s.!?]+$", "", text)
+
+
+def _shingles(key):
+    if len(key) <= SHINGLE:
+        return {key}
+    return {key[i:i + SHINGLE] for i in range(len(key) - SHINGLE + 1)}
+
+
+def _minhash(shingle_sets, num_perm=NUM_PERM, seed=0):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+    for i, shingles in enumerate(shingle_sets):
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+        signatures[i] = ((np.outer(hashes, a) + b) % _MERSENNE).min(axis=0)
+    return signatures
+
+
+def _near_groups(keys, threshold, num_perm=NUM_PERM, bands=BANDS):
+    """Union-find parent of each key index after merging LSH candidates
+    whose shingle Jaccard similarity reaches `threshold`."""
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    shingle_sets = [_shingles(k) for k in keys]
+    signatures = _minhash(shingle_sets, num_perm)
+    rows = num_perm // bands
+    for band in range(bands):
+        buckets = {}
+        for i, sig in enumerate(signatures[:, band * rows:(band + 1) * rows]):
+            buckets.setdefault(sig.tobytes(), []).append(i)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                if find(first) == find(other):
+                    continue
+                a, b = shingle_sets[first], shingle_sets[other]
+                if len(a & b) / len(a | b) >= threshold:
+                    parent[find(other)] = find(first)
+    return [find(i) for i in range(len(keys))]
+
+
+class DedupPlan:
+    """Groups of row ids that share one request. `groups` maps the
+    representative row id (the first row of the group) to all its member
+    row ids, representative included."""
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.rows = sum(len(members) for members in groups.values())
+
+    @property
+    def representatives(self):
+        return list(self.groups)
+
+    @property
+    def calls_saved(self):
+        return self.rows - len(self.groups)
+
+    def expand(self, rep_id, value):
+        """[(row_id, value)] for every row that shares rep_id's answer."""
+        return [(row_id, value) for row_id in self.groups.get(rep_id, [rep_id])]
+
+    def summary(self):
+        ratio = len(self.groups) / self.rows if self.rows else 1.0
+        return (
+            f"dedup: {self.rows} rows -> {len(self.groups)} requests "
+            f"(ratio {ratio:.3f}, {self.calls_saved} calls saved)"
+        )
+
+
+def plan_dedup(row_ids, sentences, mode="normalized", threshold=NEAR_THRESHOLD):
+    """Group rows for `mode` ("off", "normalized" or "near")."""
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"unknown dedup mode {mode!r}, expected one of {DEDUP_MODES}")
+    row_ids = list(row_ids)
+    if mode == "off":
+        return DedupPlan({row_id: [row_id] for row_id in row_ids})
+
+    keys = [sentence_key(s) for s in sentences]
+    distinct = list(dict.fromkeys(keys))
+    if mode == "near" and len(distinct) > 1:
+        roots = _near_groups(distinct, threshold)
+        canonical = {key: distinct[root] for key, root in zip(distinct, roots)}
+    else:
+        canonical = {key: key for key in distinct}
+
+    by_key = {}
+    for row_id, key in zip(row_ids, keys):
+        by_key.setdefault(canonical[key], []).append(row_id)
+    return DedupPlan({members[0]: members for members in by_key.values()})
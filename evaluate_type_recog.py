@@ -1,12 +1,8 @@
-import pandas as pd
+from evaluation import load_results, evaluate
+from bootstrap import bootstrap_metrics
 
-df = pd.read_csv("Grammar_Correction_with_GPT.csv")
-strict_acc = (df["Error Type"] == df["GPT_Error_Type"]).mean()
-print("Strict label accuracy:", strict_acc)
-per_type_acc = (
-    df.assign(correct = df["Error Type"] == df["GPT_Error_Type"])
-      .groupby("Error Type")["correct"]
-      .mean()
-      .sort_values(ascending=False)
-)
-print(per_type_acc)
+metrics = evaluate(load_results("Grammar_Correction_with_GPT.csv"))
+intervals = bootstrap_metrics(metrics)
+low, high = intervals.overall.loc["strict_accuracy", ["low", "high"]]
+print("Strict label accuracy:", metrics["strict_accuracy"], f"(95% CI {low:.4f}-{high:.4f})")
+print(intervals.per_type.sort_values("estimate", ascending=False).rename(columns={"estimate": "accuracy"}).to_string())
@@ -0,0 +1,358 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import similarity
+from labels import LabelIndex
+from label_matcher import LabelMatcher
+
+# One loader and one pass of metrics for every results file the pipelines
+# produce: script.py's Grammar_Correction_with_GPT.csv and geminiApi.py's
+# output, with or without a header row.
+#
+# Every row with a ground-truth label is scored. Failed requests ("Error: ...")
+# and "None" answers count as wrong predictions rather than being dropped.
+
+RESULT_COLUMNS = ["row_id", "true_label", "source", "reference", "pred_label", "prediction"]
+
+# Which cascade stage answered the row ("rules:<detector>" or "llm"), and the
+# tokens and latency of its requests (empty when no request was made for the
+# row); only present in files written since these were recorded.
+OPTIONAL_RESULT_COLUMNS = ["tier", "output_tokens", "input_tokens", "latency_s"]
+
+GPT_COLUMNS = {
+    "Serial Number": "row_id",
+    "Error Type": "true_label",
+    "Ungrammatical Statement": "source",
+    "Standard English": "reference",
+    "GPT_Error_Type": "pred_label",
+    "GPT_Correction": "prediction",
+    "GPT_Tier": "tier",
+    "GPT_Output_Tokens": "output_tokens",
+    "GPT_Input_Tokens": "input_tokens",
+    "GPT_Latency_S": "latency_s",
+}
+
+GEMINI_COLUMNS = {
+    "Serial Number": "row_id",
+    "Error Type": "true_label",
+    "Ungrammatical Statement": "source",
+    "Standard English": "reference",
+    "api_label": "pred_label",
+    "api_correction": "prediction",
+    "api_tier": "tier",
+    "api_output_tokens": "output_tokens",
+    "api_input_tokens": "input_tokens",
+    "api_latency_s": "latency_s",
+}
+
+# gemini_evaluation_results_full.csv was written without a header.
+HEADERLESS_GEMINI_COLUMNS = [
+    "Serial Number", "Error Type", "Ungrammatical Statement", "Standard English",
+    "original_index", "api_label", "api_correction",
+]
+
+SIMILARITY_THRESHOLD = 0.9
+
+LABEL_INDEX = LabelIndex(matcher=LabelMatcher())
+
+
+def _open_results(path, chunksize=None):
+    """(DataFrame or chunk iterator, column mapping, model name) for a results file."""
+    # "None" is a real answer ("no error"), so only empty cells become NaN.
+    read_kwargs = dict(keep_default_na=False, na_values=[""], encoding="utf-8", chunksize=chunksize)
+    header = pd.read_csv(path, nrows=0, keep_default_na=False, encoding="utf-8").columns
+    if "GPT_Error_Type" in header:
+        return pd.read_csv(path, **read_kwargs), GPT_COLUMNS, "GPT"
+    if "api_label" in header:
+        return pd.read_csv(path, **read_kwargs), GEMINI_COLUMNS, "Gemini"
+    return pd.read_csv(path, header=None, names=HEADERLESS_GEMINI_COLUMNS, **read_kwargs), GEMINI_COLUMNS, "Gemini"
+
+
+def _canonical(df, columns, model, path):
+    # Appended runs can leave repeated header rows inside the file.
+    df = df[df["Error Type"] != "Error Type"]
+    df = df.rename(columns=columns)
+    df = df[RESULT_COLUMNS + [c for c in OPTIONAL_RESULT_COLUMNS if c in df.columns]].reset_index(drop=True)
+    df.attrs["model"] = model
+    df.attrs["path"] = path
+    return df
+
+
+def load_results(path):
+    """Read a results file into the canonical RESULT_COLUMNS layout.
+    The model name ("GPT" or "Gemini") is kept in df.attrs["model"]."""
+    df, columns, model = _open_results(path)
+    return _canonical(df, columns, model, path)
+
+
+def iter_results(path, chunksize):
+    """load_results() in chunks of up to `chunksize` file rows."""
+    reader, columns, model = _open_results(path, chunksize)
+    with reader:
+        for chunk in reader:
+            yield _canonical(chunk, columns, model, path)
+
+
+def normalize_text(s):
+    s = str(s).strip().lower()
+    return " ".join(s.split())
+
+
+def format_classification_report(report):
+    lines = [f"{'':>40}{'precision':>10}{'recall':>10}{'f1-score':>10}{'support':>10}", ""]
+    for label, row in report.iterrows():
+        lines.append(
+            f"{label:>40}{row['precision']:>10.2f}{row['recall']:>10.2f}"
+            f"{row['f1-score']:>10.2f}{int(row['support']):>10}"
+        )
+    total = report["support"].sum()
+    weights = report["support"] / total if total else report["support"]
+    lines.append("")
+    for name, values in (("macro avg", report.mean()), ("weighted avg", report.mul(weights, axis=0).sum())):
+        lines.append(
+            f"{name:>40}{values['precision']:>10.2f}{values['recall']:>10.2f}"
+            f"{values['f1-score']:>10.2f}{int(total):>10}"
+        )
+    return "\n".join(lines)
+
+
+def row_scores(df, workers=None):
+    """Per-row label and correction scores for the rows of `df` that have a
+    ground-truth label, indexed like `df`. `workers` is passed to similarity.ratio()."""
+    df = df[df["true_label"].notna()]
+    true = df["true_label"]
+    pred = df["pred_label"].fillna("")
+
+    index = LABEL_INDEX
+    true_codes, pred_codes = index.encode(true), index.encode(pred)
+    coarse_names = np.array(index.coarse, dtype=object)
+    true_coarse = pd.Series(coarse_names[index.at_level(true_codes, "coarse")], index=df.index)
+    pred_coarse = pd.Series(coarse_names[index.at_level(pred_codes, "coarse")], index=df.index)
+
+    reference_norm = df["reference"].map(normalize_text)
+    prediction_norm = df["prediction"].map(normalize_text)
+    sources = df["source"].astype(str)
+    sim_source_reference = similarity.ratio(sources, df["reference"].astype(str), workers)
+    sim_source_prediction = similarity.ratio(sources, df["prediction"].astype(str), workers)
+    return pd.DataFrame({
+        "row_id": df["row_id"],
+        "true_label": true,
+        "failed": pred.eq("") | pred.str.startswith("Error:"),
+        "correct": true == pred,
+        "true_code": true_codes,
+        "pred_code": pred_codes,
+        "mapped_correct": true_coarse == pred_coarse,
+        "true_coarse": true_coarse,
+        "pred_coarse": pred_coarse,
+        "exact": reference_norm == prediction_norm,
+        "sim": similarity.ratio(reference_norm, prediction_norm, workers),
+        "change_mag_reference": 1 - sim_source_reference,
+        "change_mag_prediction": 1 - sim_source_prediction,
+        "sent_length": sources.str.split().str.len(),
+    }, index=df.index)
+
+
+def evaluate(df, threshold=SIMILARITY_THRESHOLD):
+    """Compute every label and correction metric in one pass over `df`."""
+    model = df.attrs.get("model", "")
+    df = df[df["true_label"].notna()]
+    rows = row_scores(df)
+    correct, sim = rows["correct"], rows["sim"].rename(None)
+
+    index = LABEL_INDEX
+    fine_cm = index.confusion(rows["true_code"].to_numpy(), rows["pred_code"].to_numpy())
+    coarse_cm = index.roll_up(fine_cm)
+
+    metrics = {
+        "model": model,
+        "rows": len(df),
+        "failed": int(rows["failed"].sum()),
+        "strict_accuracy": correct.mean(),
+        "mapped_accuracy": rows["mapped_correct"].mean(),
+        "per_type_accuracy": (
+            correct.groupby(rows["true_label"].rename("Error Type")).mean().sort_values(ascending=False)
+        ),
+        "classification_report": index.report(coarse_cm, "coarse").sort_index(),
+        "confusion_matrix": index.frame(coarse_cm, "coarse"),
+        "fine_classification_report": index.report(fine_cm, "fine").sort_index(),
+        "fine_confusion_matrix": index.frame(fine_cm, "fine"),
+        "exact_match": rows["exact"].mean(),
+        "high_quality_ratio": (sim >= threshold).mean(),
+        "similarity": sim.describe(),
+        "row_metrics": rows,
+    }
+    if "output_tokens" in df.columns and df["output_tokens"].notna().any():
+        metrics["output_tokens_per_request"] = pd.to_numeric(df["output_tokens"]).mean()
+    if "tier" in df.columns and df["tier"].notna().any():
+        metrics["tiers"] = tier_report(df)
+    return metrics
+
+
+def tier_report(df, errant=False):
+    """Label accuracy and correction quality per answering tier, with each
+    tier's share of the rows; the "rules" total is the share of API calls saved.
+    errant=True adds ERRANT F0.5 per tier (needs spaCy and errant)."""
+    df = df[df["true_label"].notna()]
+    tiers = df["tier"].fillna("llm")
+    groups = {tier: part for tier, part in df.groupby(tiers)}
+    rules = df[tiers.str.startswith("rules")]
+    if len(rules) and len(groups) > 2:
+        groups["rules (all)"] = rules
+    groups["total"] = df
+
+    rows = {}
+    for tier, part in groups.items():
+        metrics = evaluate(part.drop(columns="tier"))
+        rows[tier] = {
+            "rows": len(part),
+            "share": len(part) / len(df),
+            "strict_accuracy": metrics["strict_accuracy"],
+            "mapped_accuracy": metrics["mapped_accuracy"],
+            "exact_match": metrics["exact_match"],
+            "mean_similarity": metrics["similarity"]["mean"],
+        }
+        if errant:
+            from gemini.errant_score import score_corrections
+            scores = score_corrections(part["source"], part["prediction"].fillna(""), part["reference"])
+            rows[tier]["f0.5"] = scores.loc["Total", "f0.5"]
+    return pd.DataFrame.from_dict(rows, orient="index").rename_axis("tier")
+
+
+def summarize_runs(df, by="run_id"):
+    """Label accuracy per run (or per `by` column) for a long table of many
+    runs, e.g. results_store.read_results(), from one confusion-matrix pass.
+    fine_accuracy counts alias spellings of the true label as correct."""
+    index = LABEL_INDEX
+    df = df[df["true_label"].notna()]
+    group_codes, names = pd.factorize(df[by])
+    fine = index.confusion(
+        index.encode(df["true_label"]), index.encode(df["pred_label"]), groups=group_codes
+    )
+    coarse = index.roll_up(fine)
+    rows = []
+    for name, fine_cm, coarse_cm in zip(names, fine, coarse):
+        total = fine_cm.sum()
+        rows.append({
+            by: name,
+            "rows": total,
+            "fine_accuracy": np.trace(fine_cm) / total,
+            "mapped_accuracy": np.trace(coarse_cm) / total,
+            "mapped_macro_f1": index.report(coarse_cm, "coarse")["f1-score"].mean(),
+            "failed": fine_cm[:, index.failed].sum(),
+            "unknown": fine_cm[:, index.unknown].sum(),
+        })
+    return pd.DataFrame(rows)
+
+
+def print_metrics(metrics, threshold=SIMILARITY_THRESHOLD):
+    print(f"=== {metrics['model']} ({metrics['rows']} rows, {metrics['failed']} failed) ===")
+    print("Strict label accuracy:", metrics["strict_accuracy"])
+    print("Mapped label accuracy:", metrics["mapped_accuracy"])
+    print("Exact correction match accuracy:", metrics["exact_match"])
+    print(f"High-quality corrections (similarity >= {threshold}):", metrics["high_quality_ratio"])
+    if "output_tokens_per_request" in metrics:
+        print("Output tokens per requested row:", metrics["output_tokens_per_request"])
+    print("\n--- Per-type accuracy (strict) ---")
+    print(metrics["per_type_accuracy"].to_string())
+    print("\n--- Classification Report (mapped) ---")
+    print(format_classification_report(metrics["classification_report"]))
+    print("\n--- Correction similarity ---")
+    print(metrics["similarity"].to_string())
+    if "tiers" in metrics:
+        print("\n--- Per tier (share of rules rows = API calls saved) ---")
+        print(metrics["tiers"].to_string())
+
+
+def save_plots(metrics, out_dir):
+    """Render the analysis figures (report.py) into out_dir."""
+    from report import figure_data, render_figures
+
+    prefix = metrics["model"].lower() or "results"
+    jobs = [(f"{prefix}_{name}.png", name, data) for name, data in figure_data(metrics).items()]
+    rendered, skipped = render_figures(jobs, out_dir)
+    for path in rendered:
+        print(f"Saved {path}")
+    for path in skipped:
+        print(f"Unchanged {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate GPT/Gemini labeling results.")
+    parser.add_argument("files", nargs="*", help="results CSV files")
+    parser.add_argument("--store", metavar="DIR", help="also evaluate every run in this results store")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD,
+                        help="similarity counted as a high-quality correction")
+    parser.add_argument("--plots", metavar="DIR", help="also render figures into DIR")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="print bootstrap confidence intervals for every metric (bootstrap.py)")
+    parser.add_argument("--compare", action="store_true",
+                        help="paired bootstrap and McNemar tests between the first two results, aligned on row id")
+    parser.add_argument("--resamples", type=int, help="bootstrap resamples (default 10000)")
+    parser.add_argument("--errant", action="store_true",
+                        help="include ERRANT F0.5 in the intervals and tests (needs spaCy and errant)")
+    parser.add_argument("--stream", action="store_true",
+                        help="evaluate the files chunk by chunk in constant memory (streaming_eval.py)")
+    parser.add_argument("--chunksize", type=int, default=10000, help="rows per chunk with --stream")
+    parser.add_argument("--workers", type=int, help="processes scoring chunks with --stream (default: all cores)")
+    args = parser.parse_args(argv)
+    if args.stream and (args.plots or args.bootstrap or args.compare):
+        parser.error("--stream keeps no per-row metrics, so it cannot be combined with --plots/--bootstrap/--compare")
+
+    results = []
+    for path in args.files:
+        if not os.path.exists(path):
+            print(f"Error: File not found {path}")
+            continue
+        if args.stream:
+            from streaming_eval import evaluate_stream
+            print_metrics(evaluate_stream(path, args.threshold, args.chunksize, args.workers), args.threshold)
+            print()
+            continue
+        results.append(lambda path=path: load_results(path))
+    if args.store:
+        from results_store import list_runs, load_run, read_results
+        print(summarize_runs(read_results(args.store, columns=["run_id", "true_label", "pred_label"])).to_string(index=False))
+        print()
+        for run_id in list_runs(args.store)["run_id"]:
+            results.append(lambda run_id=run_id: load_run(run_id, args.store))
+
+    statistics = args.bootstrap or args.compare
+    if statistics:
+        import bootstrap
+        resamples = args.resamples or bootstrap.RESAMPLES
+        loaded = None
+        if args.errant:
+            from gemini.errant_score import load_annotator
+            loaded = load_annotator()
+
+    compared = []
+    for load in results:
+        df = load()
+        metrics = evaluate(df, args.threshold)
+        print_metrics(metrics, args.threshold)
+        if args.plots:
+            save_plots(metrics, args.plots)
+        if statistics:
+            counts = bootstrap.errant_counts(df, loaded) if args.errant else None
+            if args.bootstrap:
+                print("\n--- Bootstrap intervals ---")
+                print(bootstrap.bootstrap_metrics(metrics, args.threshold, counts, resamples).format())
+            if args.compare and len(compared) < 2:
+                compared.append((metrics, counts))
+        print()
+
+    if args.compare:
+        if len(compared) < 2:
+            print("Error: --compare needs two results")
+            return 1
+        (metrics_a, counts_a), (metrics_b, counts_b) = compared
+        print("--- Paired comparison ---")
+        print(bootstrap.compare_metrics(metrics_a, metrics_b, args.threshold, counts_a, counts_b, resamples).format())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
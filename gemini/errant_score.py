@@ -0,0 +1,218 @@
+import os
+import sys
+import sqlite3
+import argparse
+from collections import defaultdict
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation import load_results
+
+# ERRANT F0.5 for a results file, in one process.
+#
+# This does what `errant_parallel` (run twice) followed by `errant_compare`
+# did, without the temporary .txt/.m2 files:
+#   * spaCy is loaded once and every distinct sentence is parsed once, in
+#     batches with nlp.pipe(n_process=...);
+#   * sentences are tokenized on whitespace, as errant_parallel does
+#     without -tok;
+#   * parsed docs are cached on disk keyed by sentence text, so scoring a
+#     second model only parses that model's hypotheses;
+#   * edits are compared the way errant_compare does by default (span-based
+#     correction, UNK edits ignored) and returned as a DataFrame.
+
+SPACY_MODEL = 'en_core_web_sm'
+DOC_CACHE_FILE = os.getenv("ERRANT_DOC_CACHE", "errant_docs.sqlite")
+BETA = 0.5
+N_PROCESS = max(1, (os.cpu_count() or 1) - 1)
+BATCH_SIZE = 256
+
+
+class DocCache:
+    """Serialized spaCy docs keyed by (model, model version, sentence)."""
+
+    def __init__(self, path, nlp):
+        from spacy.tokens import Doc
+
+        self.Doc = Doc
+        self.nlp = nlp
+        self.namespace = f"{nlp.meta['lang']}_{nlp.meta['name']}@{nlp.meta['version']}"
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS docs (namespace TEXT, text TEXT, doc BLOB, PRIMARY KEY (namespace, text))"
+        )
+        self.db.commit()
+
+    def get_many(self, texts):
+        found = {}
+        for text in texts:
+            row = self.db.execute(
+                "SELECT doc FROM docs WHERE namespace = ? AND text = ?", (self.namespace, text)
+            ).fetchone()
+            if row is not None:
+                found[text] = self.Doc(self.nlp.vocab).from_bytes(row[0])
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, docs):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO docs (namespace, text, doc) VALUES (?, ?, ?)",
+            [(self.namespace, text, doc.to_bytes(exclude=["tensor", "user_data"])) for text, doc in docs.items()],
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def load_annotator():
+    import spacy
+    import errant
+
+    # errant.load() would load the same model with the same components.
+    nlp = spacy.load(SPACY_MODEL, disable=["ner"])
+    return nlp, errant.load("en", nlp)
+
+
+def parse_sentences(nlp, texts, cache=None, n_process=N_PROCESS, batch_size=BATCH_SIZE):
+    """{text: Doc} for every distinct text, parsing only the ones not cached."""
+    from spacy.tokens import Doc
+
+    texts = list(dict.fromkeys(texts))
+    docs = cache.get_many(texts) if cache else {}
+    missing = [t for t in texts if t not in docs]
+    if missing:
+        words = (Doc(nlp.vocab, words=t.split()) for t in missing)
+        parsed = dict(zip(missing, nlp.pipe(words, n_process=n_process, batch_size=batch_size)))
+        if cache:
+            cache.put_many(parsed)
+        docs.update(parsed)
+    return docs
+
+
+def extract_edits(annotator, orig, cor):
+    """{(start, end, correction): [category]} as errant_compare reads an M2 block."""
+    edits = {}
+    if orig.text.split() == cor.text.split():
+        return edits
+    for e in annotator.annotate(orig, cor):
+        if e.type == "UNK":
+            continue
+        edits.setdefault((e.o_start, e.o_end, e.c_str), []).append(e.type)
+    return edits
+
+
+def category(edit_type, level):
+    # errant_compare -cat 1: operation (M/R/U), 2: main type, 3: both.
+    if level == 1:
+        return edit_type[0]
+    if level == 2:
+        return edit_type[2:]
+    return edit_type
+
+
+def compare_edits(hyp, ref, counts, level):
+    for edit, cats in hyp.items():
+        # Hypothesis edits that match the reference are credited to the reference's categories.
+        field = "tp" if edit in ref else "fp"
+        for cat in ref.get(edit, cats):
+            counts[category(cat, level)][field] += 1
+    for edit, cats in ref.items():
+        if edit not in hyp:
+            for cat in cats:
+                counts[category(cat, level)]["fn"] += 1
+
+
+def f_score(tp, fp, fn, beta=BETA):
+    p = tp / (tp + fp) if fp else 1.0
+    r = tp / (tp + fn) if fn else 1.0
+    f = (1 + beta ** 2) * p * r / (beta ** 2 * p + r) if p + r else 0.0
+    return round(p, 4), round(r, 4), round(f, 4)
+
+
+def _row_edits(sources, hypotheses, references, cache_path, n_process, batch_size, loaded):
+    """(hypothesis edits, reference edits) for each row, parsing every distinct sentence once."""
+    clean = lambda values: [" ".join(str(v).split()) for v in values]
+    sources, hypotheses, references = clean(sources), clean(hypotheses), clean(references)
+
+    nlp, annotator = loaded or load_annotator()
+    cache = DocCache(cache_path, nlp) if cache_path else None
+    try:
+        docs = parse_sentences(nlp, sources + hypotheses + references, cache, n_process, batch_size)
+    finally:
+        if cache:
+            cache.close()
+
+    for src, hyp, ref in zip(sources, hypotheses, references):
+        orig = docs[src]
+        yield extract_edits(annotator, orig, docs[hyp]), extract_edits(annotator, orig, docs[ref])
+
+
+def score_corrections(sources, hypotheses, references, level=3, cache_path=DOC_CACHE_FILE,
+                      n_process=N_PROCESS, batch_size=BATCH_SIZE, loaded=None):
+    """ERRANT scores of `hypotheses` against `references` as a DataFrame with
+    one row per edit category plus a "Total" row (tp, fp, fn, precision, recall, f0.5).
+    `loaded` is an (nlp, annotator) pair from load_annotator() to reuse across calls."""
+    counts = defaultdict(lambda: {"tp": 0, "fp": 0, "fn": 0})
+    for hyp, ref in _row_edits(sources, hypotheses, references, cache_path, n_process, batch_size, loaded):
+        compare_edits(hyp, ref, counts, level)
+
+    table = pd.DataFrame.from_dict(counts, orient="index", columns=["tp", "fp", "fn"]).sort_index()
+    table.loc["Total"] = table.sum() if len(table) else 0
+    scores = [f_score(*row) for row in table[["tp", "fp", "fn"]].itertuples(index=False)]
+    table[["precision", "recall", f"f{BETA}"]] = pd.DataFrame(scores, index=table.index)
+    table.index.name = "category"
+    return table
+
+
+def edit_counts(sources, hypotheses, references, cache_path=DOC_CACHE_FILE,
+                n_process=N_PROCESS, batch_size=BATCH_SIZE, loaded=None):
+    """Total tp, fp and fn of each row as a DataFrame indexed like `sources`.
+    Summing a subset of rows gives that subset's "Total" row of
+    score_corrections(), which is what bootstrap.py resamples."""
+    rows = []
+    for hyp, ref in _row_edits(sources, hypotheses, references, cache_path, n_process, batch_size, loaded):
+        counts = defaultdict(lambda: {"tp": 0, "fp": 0, "fn": 0})
+        compare_edits(hyp, ref, counts, 3)
+        rows.append([sum(c[field] for c in counts.values()) for field in ("tp", "fp", "fn")])
+    index = sources.index if isinstance(sources, pd.Series) else None
+    return pd.DataFrame(rows, columns=["tp", "fp", "fn"], index=index, dtype="int64")
+
+
+def score_results_file(path, **kwargs):
+    """Score a results file's corrections, skipping rows whose request failed."""
+    df = load_results(path)
+    df = df[df["prediction"].notna() & ~df["prediction"].astype(str).str.contains("Error:")]
+    print(f"{path}: {len(df)} valid rows for ERRANT evaluation.")
+    return score_corrections(df["source"], df["prediction"], df["reference"], **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ERRANT F0.5 of model corrections against the references.")
+    parser.add_argument("files", nargs="*", default=["gemini_evaluation_results_full.csv"])
+    parser.add_argument("--cat", type=int, choices=[1, 2, 3], default=3,
+                        help="edit category granularity, as errant_compare -cat")
+    parser.add_argument("--processes", type=int, default=N_PROCESS, help="spaCy worker processes")
+    parser.add_argument("--cache", default=DOC_CACHE_FILE, help="parsed doc cache ('' to disable)")
+    parser.add_argument("--out", metavar="DIR", help="also save each table as DIR/<file>_errant.csv")
+    args = parser.parse_args(argv)
+
+    loaded = load_annotator()
+    for path in args.files:
+        table = score_results_file(path, level=args.cat, cache_path=args.cache,
+                                   n_process=args.processes, loaded=loaded)
+        print(table.to_string())
+        total = table.loc["Total"]
+        print(f"\nF{BETA}: {total[f'f{BETA}']}  (P {total['precision']}, R {total['recall']})\n")
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(path))[0]
+            table.to_csv(os.path.join(args.out, f"{stem}_errant.csv"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,68 +3,132 @@ import os
 import time
 import json
 import re 
+import argparse
 from tqdm import tqdm
 import pandas as pd
 import sys
+import datetime
+import functools
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from labels import OFFICIAL_ERROR_TYPES
+from compact_output import GEMINI_RESPONSE_SCHEMA, numbered_labels, output_budget, parse_compact
+from label_matcher import LabelMatcher
+from rule_cascade import split_rows, LLM_TIER
+from dedup import plan_dedup
+from response_cache import ResponseCache
+from batching import chunked, build_batch_input, parse_batch_response
+from run_stats import save_run, load_runs, format_comparison, phase
+from telemetry import Telemetry
+from results_store import write_run, DEFAULT_STORE
+from result_journal import ResultJournal, load_journal
+from sharding import parse_shard, in_shard, shard_path, merge_shards, write_merged
+from sampling import stratified_order, estimate_accuracy
+from evaluation import GEMINI_COLUMNS
+from rate_limiter import AdaptiveRateLimiter, estimate_tokens, is_rate_limit_error, retry_after_from_error
+from batch_api import (
+    write_jsonl, load_job, save_job, gemini_requests,
+    submit_gemini_batch, wait_for_gemini_batch, read_gemini_results,
+)
 
 api_key = os.getenv("GOOGLE_API_KEY")
 if not api_key:
     print("Warning: Environment variable GOOGLE_API_KEY not found. Please check settings or hardcode it.")
 
-if api_key:
+# GEMINI_BASE_URL points the client at another endpoint, e.g.
+# http://127.0.0.1:8000 for mock_llm_server.py.
+if api_key and os.getenv("GEMINI_BASE_URL"):
+    genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": os.getenv("GEMINI_BASE_URL")})
+elif api_key:
     genai.configure(api_key=api_key)
 
 INPUT_FILE = 'Grammar Correction.csv'
 OUTPUT_FILE = 'gemini_evaluation_results_v2.csv'
+MODEL_NAME = 'models/gemini-2.5-flash'
 COL_INCORRECT = 'Ungrammatical Statement'
 COL_ERROR_TYPE = 'Error Type'
 COL_CORRECT = 'Standard English'
 
+# 0 labels every row, 1 the first 100 rows (a smoke test), 2 a sample
+# stratified by error type, labeled SAMPLE_ROUND_SIZE rows at a time until the
+# 95% interval of the accuracy estimate is within +/- SAMPLE_TARGET_HALF_WIDTH
+# (see sampling.py) or SAMPLE_MAX_ROWS rows are labeled (None: no limit).
 RUN_MODE = 0
+SAMPLE_ROUND_SIZE = 200
+SAMPLE_TARGET_HALF_WIDTH = 0.02
+SAMPLE_MAX_ROWS = None
+SAMPLE_SEED = 0
 
-OFFICIAL_ERROR_TYPES = [
-    "Capitalization Errors",
-    "Preposition Usage",
-    "Infinitive Errors",
-    "Faulty Comparisons",
-    "Mixed Conditionals",
-    "Contractions Errors",
-    "Incorrect Auxiliaries",
-    "Clichés",
-    "Ambiguity",
-    "Relative Clause Errors",
-    "Conjunction Misuse",
-    "Verb Tense Errors",
-    "Ellipsis Errors",
-    "Quantifier Errors",
-    "Spelling Mistakes",
-    "Passive Voice Overuse",
-    "Agreement in Comparative and Superlative Forms",
-    "Lack of Parallelism in Lists or Series",
-    "Abbreviation Errors",
-    "Modifiers Misplacement",
-    "Punctuation Errors",
-    "Tautology",
-    "Parallelism Errors",
-    "Run-on Sentences",
-    "Negation Errors",
-    "Word Choice/Usage",
-    "Pronoun Errors",
-    "Inappropriate Register",
-    "Sentence Fragments",
-    "Article Usage",
-    "Subject-Verb Agreement",
-    "Mixed Metaphors/Idioms",
-    "Redundancy/Repetition",
-    "Sentence Structure Errors",
-    "Slang, Jargon, and Colloquialisms",
-    "Gerund and Participle Errors"
-]
-
-def get_gemini_evaluation(sentence, model):
-    categories_str = "\n".join([f"- {cat}" for cat in OFFICIAL_ERROR_TYPES])
-    
-    system_prompt = f"""
+# Rows already written to OUTPUT_FILE, one JSON line per row id, so a resume
+# reads this instead of the whole output CSV.
+progress_journal = None
+
+# Set by --shard i/N (sharding.py): this process only labels the rows whose
+# id hashes to shard i, into its own output, progress and batch job files.
+# --merge N checks the N shard files and writes the canonical OUTPUT_FILE.
+SHARD = None
+
+# Sentences packed into one request. 1 keeps the original one-sentence prompt.
+BATCH_SIZE = 1
+
+# Requests in flight at once. They all share one rate limiter, which starts at
+# half of MAX_RPM, speeds up while calls succeed and backs off on 429s.
+MAX_WORKERS = 8
+MAX_RPM = 1000
+MAX_TPM = 1000000
+
+# Send the remaining rows as one Gemini Batch API job (about half the price,
+# results within 24h) instead of calling generate_content row by row.
+USE_BATCH_API = False
+BATCH_REQUESTS_FILE = 'gemini_batch_requests.jsonl'
+BATCH_JOB_FILE = 'gemini_batch_job.json'
+BATCH_POLL_INTERVAL = 30
+
+# Answer rows the local rule detectors are sure about (rule_cascade.py)
+# without calling the API. Every row records the tier that answered it.
+USE_RULES = True
+
+# Rows whose sentences match after normalization share one request and the
+# answer is copied to each of them. 'near' also merges MinHash near-duplicates;
+# 'off' sends every row.
+DEDUP_MODE = 'normalized'
+
+TEMPERATURE = 0.1
+
+# Ask for {"i": "<label number>", "c": "<correction>"} constrained by a
+# response schema, with max_output_tokens capped per row (compact_output.py),
+# instead of the verbose JSON with the label text. Applies to one-sentence
+# requests and to the Batch API; batched prompts keep their format.
+# Gemini 2.5 models count their thinking against max_output_tokens, so the
+# budget gets COMPACT_THINKING_TOKENS of headroom on top of the answer's.
+COMPACT_OUTPUT = False
+COMPACT_THINKING_TOKENS = 1024
+
+# Store each system instruction once as Gemini cached content and reference it
+# from every request, which bills the cached prefix at the reduced rate. The
+# instruction must reach the model's minimum cacheable size; if the cache
+# cannot be created the run falls back to sending the instruction each time
+# (where 2.5 models still apply implicit prefix caching).
+USE_CONTEXT_CACHE = False
+CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)
+context_caches = []
+
+# Near-miss labels ("Spelling", "Article Errors") are mapped to the official
+# ones locally; only answers whose label cannot be matched are asked again,
+# at most MAX_LABEL_RETRIES times.
+MAX_LABEL_RETRIES = 1
+label_matcher = LabelMatcher()
+
+# Every request starts with one of these fixed system instructions, built
+# once at import, followed by a short suffix holding only the sentence(s).
+# Identical prefixes let Gemini reuse its cached prefix (implicitly on 2.5
+# models, or explicitly with USE_CONTEXT_CACHE) instead of reprocessing the
+# 36-label block on every call.
+CATEGORIES_STR = "\n".join(f"- {cat}" for cat in OFFICIAL_ERROR_TYPES)
+
+SYSTEM_INSTRUCTION = """
     You are an expert English grammar evaluator.
     
     Your task is to analyze the user's sentence for grammatical errors.
@@ -75,8 +139,6 @@ def get_gemini_evaluation(sentence, model):
     
     Step 2: Provide the grammatically correct version of the sentence. Maintain the original meaning.
 
-    Input Sentence: "{sentence}"
-
     You MUST respond ONLY with a valid JSON object in the following format. Do NOT include markdown formatting like ```json.
     {{
         "label": "<The exact error label from the list above>",
@@ -84,59 +146,438 @@ def get_gemini_evaluation(sentence, model):
     }}
 
     If the sentence is completely correct (which is rare), set "label" to "None" and "correction" to the original sentence.
-    """
+    """.format(categories_str=CATEGORIES_STR)
+
+COMPACT_SYSTEM_INSTRUCTION = """
+    You are an expert English grammar evaluator.
+
+    Step 1: Identify the SINGLE most appropriate error type of the user's sentence and answer with its number:
+    {categories_str}
+
+    Step 2: Provide the grammatically correct version of the sentence. Maintain the original meaning.
+
+    Respond ONLY with {{"i": "<number>", "c": "<corrected sentence>"}}.
+    """.format(categories_str=numbered_labels())
+
+BATCH_SYSTEM_INSTRUCTION = """
+    You are an expert English grammar evaluator.
     
-    generation_config = genai.types.GenerationConfig(
+    Your task is to analyze each of the user's sentences for grammatical errors, independently of the others.
+    The sentences are given as a JSON array of objects with "id" and "sentence".
+    
+    Step 1: For every sentence, identify the SINGLE most appropriate error type from the following list of 36 labels. 
+    You must copy the label text EXACTLY as shown below:
+    {categories_str}
+    
+    Step 2: Provide the grammatically correct version of every sentence. Maintain the original meaning.
+
+    You MUST respond ONLY with a valid JSON array containing one object per input id, in the following format. Do NOT include markdown formatting like ```json.
+    [
+        {{"id": <the input id>, "label": "<The exact error label from the list above>", "correction": "<The corrected sentence>"}}
+    ]
+
+    If a sentence is completely correct (which is rare), set its "label" to "None" and its "correction" to the original sentence.
+    """.format(categories_str=CATEGORIES_STR)
+
+SENTENCE_TEMPLATE = 'Input Sentence: "{sentence}"'
+BATCH_SENTENCES_TEMPLATE = 'Input Sentences:\n{sentences_json}'
+
+def clean_json_text(raw_text):
+    cleaned_text = re.sub(r"^```json\s*", "", raw_text.strip())
+    cleaned_text = re.sub(r"^```\s*", "", cleaned_text)
+    cleaned_text = re.sub(r"\s*```$", "", cleaned_text)
+    return cleaned_text.strip()
+
+def record_usage(stats, response, limiter=None, reserved_tokens=0, seconds=None, attempt=0):
+    # The SDK does not expose the HTTP response, so there is no ttfb here.
+    usage = getattr(response, "usage_metadata", None)
+    if limiter is not None:
+        limiter.on_success(usage.total_token_count if usage is not None else None, reserved_tokens)
+    if stats is not None and usage is not None:
+        stats.record_request(usage.prompt_token_count, usage.candidates_token_count,
+                             getattr(usage, "cached_content_token_count", 0), seconds, attempt=attempt)
+
+def record_backoff(stats, seconds):
+    if stats is not None:
+        stats.add_time("sleep", seconds)
+    time.sleep(seconds)
+
+def output_tokens(response):
+    # Thinking tokens are billed as output as well.
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0
+    return (usage.candidates_token_count or 0) + (getattr(usage, "thoughts_token_count", 0) or 0)
+
+# Per-row usage record: latency and tokens of the requests behind an answer,
+# written to the api_<field> columns.
+USAGE_FIELDS = ('output_tokens', 'input_tokens', 'latency_s')
+
+def new_usage():
+    return {'latency_s': 0.0, 'input_tokens': 0, 'output_tokens': 0}
+
+def add_usage(usage, response, seconds):
+    metadata = getattr(response, "usage_metadata", None)
+    usage['latency_s'] += seconds
+    usage['input_tokens'] += (metadata.prompt_token_count or 0) if metadata is not None else 0
+    usage['output_tokens'] += output_tokens(response)
+
+def share_usage(usage, count):
+    # A batch's tokens are split evenly over its answers; the latency is the request's.
+    return {'latency_s': usage['latency_s'], 'input_tokens': round(usage['input_tokens'] / count),
+            'output_tokens': round(usage['output_tokens'] / count)}
+
+def set_usage_columns(out_df, usages):
+    """Fill the api_<field> usage columns; None usages (no request) stay empty."""
+    for field in USAGE_FIELDS:
+        out_df[f'api_{field}'] = [usage.get(field) if usage else None for usage in usages]
+
+def compact_budget(sentence):
+    return output_budget(sentence) + COMPACT_THINKING_TOKENS
+
+def compact_config(max_output_tokens):
+    return genai.types.GenerationConfig(
         response_mime_type="application/json",
-        temperature=0.1
+        response_schema=GEMINI_RESPONSE_SCHEMA,
+        max_output_tokens=max_output_tokens,
+        temperature=TEMPERATURE
     )
+
+def finish_reason(response):
+    """The first candidate's finish reason by name ("STOP", "MAX_TOKENS", ...)."""
+    candidates = getattr(response, "candidates", None) or []
+    reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    return getattr(reason, "name", reason)
+
+def single_instruction():
+    return COMPACT_SYSTEM_INSTRUCTION if COMPACT_OUTPUT else SYSTEM_INSTRUCTION
+
+def build_prompt(sentence):
+    """The per-sentence part of a request; the instruction goes in front of it."""
+    return SENTENCE_TEMPLATE.format(sentence=sentence)
+
+def build_model(system_instruction):
+    if USE_CONTEXT_CACHE:
+        try:
+            cached_content = genai.caching.CachedContent.create(
+                model=MODEL_NAME, system_instruction=system_instruction, ttl=CONTEXT_CACHE_TTL
+            )
+            context_caches.append(cached_content)
+            print(f"Created context cache {cached_content.name}.")
+            return genai.GenerativeModel.from_cached_content(cached_content)
+        except Exception as e:
+            print(f"Warning: Context cache not created ({e}); sending the instruction with every request.")
+    return genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction)
+
+def delete_context_caches():
+    # Cached content is billed for storage until it expires.
+    while context_caches:
+        context_caches.pop().delete()
+
+def parse_answer(text):
+    # Batch API answers cannot be re-asked, so an unresolved label is kept as returned.
+    result_json = json.loads(clean_json_text(text))
+    label = result_json['label']
+    return label_matcher.resolve(label) or label, result_json['correction']
+
+def get_gemini_evaluation(sentence, model, cache=None, stats=None, limiter=None):
+    """(label, correction, usage) for one sentence. The usage record covers
+    every attempt and is None when the answer came from the cache."""
+    instruction = single_instruction()
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key("gemini", model.model_name, instruction, TEMPERATURE, sentence)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached[0], cached[1], None
+
+    contents = build_prompt(sentence)
+    
+    budget = compact_budget(sentence)
+    if COMPACT_OUTPUT:
+        generation_config = compact_config(budget)
+    else:
+        generation_config = genai.types.GenerationConfig(
+            response_mime_type="application/json",
+            temperature=TEMPERATURE
+        )
     
     max_retries = 8
-    base_wait_time = 8 
+    label_retries = 0
+    usage = new_usage()
+    reserved_tokens = estimate_tokens(instruction + contents) + (budget if COMPACT_OUTPUT else 100)
     
     for attempt in range(max_retries):
+        granted_at = limiter.acquire(reserved_tokens) if limiter is not None else None
+        response = None
         try:
+            started = time.perf_counter()
             response = model.generate_content(
-                system_prompt,
+                contents,
                 generation_config=generation_config
             )
             
-            raw_text = response.text.strip()
-            cleaned_text = re.sub(r"^```json\s*", "", raw_text)
-            cleaned_text = re.sub(r"^```\s*", "", cleaned_text)
-            cleaned_text = re.sub(r"\s*```$", "", cleaned_text)
-            cleaned_text = cleaned_text.strip()
+            seconds = time.perf_counter() - started
+            record_usage(stats, response, limiter, reserved_tokens, seconds, attempt)
+            add_usage(usage, response, seconds)
+
+            if COMPACT_OUTPUT:
+                # Strict: the schema leaves no room for fences or label spellings.
+                try:
+                    with phase(stats, "parse"):
+                        label, correction = parse_compact(response.text)
+                except ValueError as e:
+                    if finish_reason(response) == "MAX_TOKENS":
+                        # At temperature 0 the same budget would be cut off again.
+                        budget *= 2
+                        generation_config = compact_config(budget)
+                        if stats is not None:
+                            stats.record_truncation()
+                        print(f"Warning: Answer truncated, retrying with max_output_tokens={budget} (Attempt {attempt+1}/{max_retries})")
+                    else:
+                        print(f"Warning: Malformed compact answer: {e} (Attempt {attempt+1}/{max_retries})")
+                    continue
+                if cache is not None:
+                    cache.put(cache_key, [label, correction])
+                return label, correction, usage
 
-            result_json = json.loads(cleaned_text)
+            with phase(stats, "parse"):
+                cleaned_text = clean_json_text(response.text)
+
+                result_json = json.loads(cleaned_text)
             
             if "label" in result_json and "correction" in result_json:
-                return result_json['label'], result_json['correction']
+                with phase(stats, "parse"):
+                    label = label_matcher.resolve(result_json['label'])
+                if label is None and label_retries < MAX_LABEL_RETRIES:
+                    label_retries += 1
+                    print(f"Warning: Unknown label {result_json['label']!r} (Attempt {attempt+1}/{max_retries})")
+                    continue
+                label = label or result_json['label']
+                if cache is not None:
+                    cache.put(cache_key, [label, result_json['correction']])
+                return label, result_json['correction'], usage
             else:
                 print(f"Warning: JSON missing fields (Attempt {attempt+1}/{max_retries})")
                 continue
                 
         except Exception as e:
+            if stats is not None and response is None:
+                stats.record_error(e, time.perf_counter() - started, attempt)
             error_str = str(e)
-            if "429" in error_str:
-                wait_time = base_wait_time * (2 ** attempt)
-                print(f"\n!!! Rate Limit Triggered (429). Pausing for {wait_time} seconds before retrying... (Attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
+            if is_rate_limit_error(e):
+                retry_after = retry_after_from_error(e)
+                print(f"\n!!! Rate Limit Triggered (429). Backing off{f' for {retry_after:.0f} seconds' if retry_after else ''}... (Attempt {attempt+1}/{max_retries})")
+                if limiter is not None:
+                    limiter.on_throttle(retry_after, granted_at)
+                else:
+                    record_backoff(stats, retry_after or 8)
             elif "400" in error_str:
                 print(f"\n!!! 400 Error (Bad Request): {e}")
-                return "Error: Bad Request", "Error: Bad Request"
+                return "Error: Bad Request", "Error: Bad Request", usage if usage['latency_s'] else None
             else:
                 print(f"\n!!! Unknown API Error: {e}. Pausing for 5 seconds... (Attempt {attempt+1}/{max_retries})")
-                time.sleep(5)
+                record_backoff(stats, 5)
     
-    return "Error: Failed after max retries", "Error: Failed after max retries"
+    return "Error: Failed after max retries", "Error: Failed after max retries", usage if usage['latency_s'] else None
 
-def main_batch_process():
-    
+def get_gemini_batch_evaluation(sentences, model, cache=None, stats=None, limiter=None,
+                                single_model=None):
+    """Label several sentences with one request. `model` carries
+    BATCH_SYSTEM_INSTRUCTION; `single_model` (default `model`) is used for
+    the one-sentence retries.
+
+    Returns (label, correction, usage) triples aligned with `sentences`;
+    the batch's tokens are split evenly over the answers it produced. Sentences the model leaves out or answers malformed are re-asked
+    one at a time through get_gemini_evaluation; the rest of the batch is not
+    resent.
+    """
+    results = [None] * len(sentences)
+    todo = []
+    for i, sentence in enumerate(sentences):
+        cached = None
+        if cache is not None:
+            cached = cache.get(cache.make_key("gemini", model.model_name, BATCH_SYSTEM_INSTRUCTION, TEMPERATURE, sentence))
+        if cached is not None:
+            results[i] = (cached[0], cached[1], None)
+        else:
+            todo.append(i)
+
+    if not todo:
+        return results
+
+    batch_prompt = BATCH_SENTENCES_TEMPLATE.format(
+        sentences_json=build_batch_input([sentences[i] for i in todo])
+    )
+    generation_config = genai.types.GenerationConfig(
+        response_mime_type="application/json",
+        temperature=TEMPERATURE
+    )
+
+    parsed, missing = {}, list(range(len(todo)))
+    batch_usage = new_usage()
+    max_retries = 3
+    reserved_tokens = estimate_tokens(BATCH_SYSTEM_INSTRUCTION + batch_prompt) + 100 * len(todo)
+    for attempt in range(max_retries):
+        granted_at = limiter.acquire(reserved_tokens) if limiter is not None else None
+        response = None
+        try:
+            started = time.perf_counter()
+            response = model.generate_content(batch_prompt, generation_config=generation_config)
+            seconds = time.perf_counter() - started
+            record_usage(stats, response, limiter, reserved_tokens, seconds, attempt)
+            add_usage(batch_usage, response, seconds)
+            with phase(stats, "parse"):
+                parsed, missing = parse_batch_response(clean_json_text(response.text), len(todo))
+            break
+        except Exception as e:
+            if stats is not None and response is None:
+                stats.record_error(e, time.perf_counter() - started, attempt)
+            if is_rate_limit_error(e):
+                retry_after = retry_after_from_error(e)
+                print(f"\n!!! Rate Limit Triggered (429) on batch. Backing off... (Attempt {attempt+1}/{max_retries})")
+                if limiter is not None:
+                    limiter.on_throttle(retry_after, granted_at)
+                else:
+                    record_backoff(stats, retry_after or 8)
+            else:
+                print(f"\n!!! Batch request failed: {e}. Falling back to single requests.")
+                break
+
+    for j, (raw_label, correction) in parsed.items():
+        with phase(stats, "parse"):
+            label = label_matcher.resolve(raw_label)
+        if label is None:
+            missing.append(j)
+            continue
+        sentence = sentences[todo[j]]
+        results[todo[j]] = (label, correction, share_usage(batch_usage, len(parsed)))
+        if cache is not None:
+            cache.put(cache.make_key("gemini", model.model_name, BATCH_SYSTEM_INSTRUCTION, TEMPERATURE, sentence), [label, correction])
+
+    if missing:
+        print(f"\nRetrying {len(missing)} of {len(todo)} batch items individually.")
+    for j in missing:
+        results[todo[j]] = get_gemini_evaluation(sentences[todo[j]], single_model or model, cache, stats, limiter)
+
+    return results
+
+def progress_path():
+    return os.path.splitext(OUTPUT_FILE)[0] + '.progress.jsonl'
+
+def load_processed():
+    """Row ids already in OUTPUT_FILE. Output files written before the
+    progress file existed are read once and their ids copied into it."""
+    if not os.path.exists(OUTPUT_FILE):
+        if os.path.exists(progress_path()):
+            os.remove(progress_path())
+        return set()
+    if os.path.exists(progress_path()):
+        return set(load_journal(progress_path()))
+    processed = set(pd.read_csv(OUTPUT_FILE, usecols=['original_index'])['original_index'])
+    with ResultJournal(progress_path()) as journal:
+        for row_id in sorted(processed):
+            journal.append(row_id)
+    return processed
+
+@functools.lru_cache(maxsize=None)
+def output_columns(path):
+    return pd.read_csv(path, nrows=0).columns
+
+def append_results(out_df):
+    global progress_journal
+    # Follow the header of an existing output file, so files started before
+    # a column was added (e.g. api_tier) stay readable. The header is read
+    # once per run, not once per chunk.
+    if os.path.exists(OUTPUT_FILE):
+        columns = output_columns(OUTPUT_FILE)
+        out_df.reindex(columns=columns).to_csv(OUTPUT_FILE, mode='a', header=False, index=False)
+    else:
+        out_df.to_csv(OUTPUT_FILE, index=False)
+    if progress_journal is None:
+        progress_journal = ResultJournal(progress_path())
+    for row_id in out_df['original_index']:
+        progress_journal.append(row_id)
+
+def use_shard(index, count):
+    """Point this process at shard `index` of `count`."""
+    global SHARD, OUTPUT_FILE, BATCH_REQUESTS_FILE, BATCH_JOB_FILE
+    SHARD = (index, count)
+    OUTPUT_FILE = shard_path(OUTPUT_FILE, index, count)
+    BATCH_REQUESTS_FILE = shard_path(BATCH_REQUESTS_FILE, index, count)
+    BATCH_JOB_FILE = shard_path(BATCH_JOB_FILE, index, count)
+
+def answer_locally(df_queue):
+    answered, _ = split_rows(zip(df_queue['original_index'], df_queue[COL_INCORRECT]))
+    out_df = df_queue[df_queue['original_index'].isin(answered.keys())].copy()
+    out_df['api_label'] = [answered[i][1] for i in out_df['original_index']]
+    out_df['api_correction'] = [answered[i][2] for i in out_df['original_index']]
+    out_df['api_tier'] = [answered[i][0] for i in out_df['original_index']]
+    set_usage_columns(out_df, [None] * len(out_df))
+    if len(out_df):
+        append_results(out_df)
+    print(f"Answered {len(out_df)}/{len(df_queue)} rows locally ({len(out_df) / len(df_queue):.1%} of API calls saved).")
+    return out_df, df_queue[~df_queue['original_index'].isin(answered.keys())]
+
+def fan_out(out_df, members_by_id, plan):
+    """Rows of every group member, each carrying its representative's answer.
+    `members_by_id` holds the member rows indexed by original_index, built
+    once per run so each chunk only looks up its own rows."""
+    reps = [rep for rep in out_df['original_index'] for _ in plan.groups[rep]]
+    members = [m for rep in out_df['original_index'] for m in plan.groups[rep]]
+    usage_cols = [f'api_{field}' for field in USAGE_FIELDS]
+    answer_cols = ['api_label', 'api_correction', 'api_tier'] + usage_cols
+    expanded = members_by_id.loc[members].copy()
+    expanded[answer_cols] = out_df.set_index('original_index').loc[reps, answer_cols].to_numpy()
+    # Duplicates ride on the representative's request; only it is charged.
+    expanded.loc[[m != r for m, r in zip(members, reps)], usage_cols] = None
+    return expanded
+
+def store_run(out_df):
+    # A shard only holds part of the run; --merge stores the whole of it.
+    if len(out_df) and SHARD is None:
+        run_id = write_run(out_df, MODEL_NAME.split('/')[-1], GEMINI_COLUMNS)
+        print(f"Stored run {run_id} in {DEFAULT_STORE}.")
+
+def run_batch_api(df_queue, df_members, plan):
+    job = load_job(BATCH_JOB_FILE)
+    if job is None:
+        items = zip(df_queue['original_index'], df_queue[COL_INCORRECT])
+        if COMPACT_OUTPUT:
+            requests = gemini_requests(items, build_prompt, TEMPERATURE, GEMINI_RESPONSE_SCHEMA, compact_budget,
+                                       system_instruction=single_instruction())
+        else:
+            requests = gemini_requests(items, build_prompt, TEMPERATURE, system_instruction=single_instruction())
+        write_jsonl(BATCH_REQUESTS_FILE, requests)
+        job = submit_gemini_batch(api_key, MODEL_NAME, BATCH_REQUESTS_FILE)
+        save_job(BATCH_JOB_FILE, job)
+        print(f"Submitted {len(df_queue)} rows as {job['id']}.")
+    else:
+        print(f"Resuming {job['id']} from {BATCH_JOB_FILE}.")
+
+    batch = wait_for_gemini_batch(api_key, job["id"], BATCH_POLL_INTERVAL)
+    usage = {}
+    results = read_gemini_results(api_key, batch, parse_compact if COMPACT_OUTPUT else parse_answer, usage=usage)
+
+    out_df = df_queue[df_queue['original_index'].isin(results.keys())].copy()
+    out_df['api_label'] = [results[i][0] for i in out_df['original_index']]
+    out_df['api_correction'] = [results[i][1] for i in out_df['original_index']]
+    out_df['api_tier'] = LLM_TIER
+    # The Batch API reports tokens per row but no latency.
+    set_usage_columns(out_df, [usage.get(i) for i in out_df['original_index']])
+    out_df = fan_out(out_df, df_members.set_index('original_index', drop=False), plan)
+    append_results(out_df)
+    os.remove(BATCH_JOB_FILE)
+    print(f"\n{job['id']} finished ({batch.get('metadata', {}).get('state')}): {len(out_df)} rows saved to {OUTPUT_FILE}")
+    return out_df
+
+def load_rows():
+    """The input rows this run has to label, or None if INPUT_FILE is missing."""
     try:
         df = pd.read_csv(INPUT_FILE)
     except FileNotFoundError:
         print(f"Error: File '{INPUT_FILE}' not found.")
-        return
+        return None
     
     df['original_index'] = df.index
 
@@ -148,19 +589,201 @@ def main_batch_process():
     if RUN_MODE == 1:
         df_to_process_master = df.head(100).copy()
         print("Test Mode: Processing first 100 rows.")
+    elif RUN_MODE == 2:
+        df_to_process_master = df.copy()
+        print(f"Sample Mode: Labeling a stratified sample of {len(df)} rows until ±{SAMPLE_TARGET_HALF_WIDTH}.")
     else:
         df_to_process_master = df.copy()
         print(f"Full Mode: Processing all {len(df)} rows.")
+    return df_to_process_master
+
+def merge_results(count):
+    """Merge the output files of shards 0..count-1 into OUTPUT_FILE.
+    Nothing is written unless every row is covered exactly once."""
+    df_to_process_master = load_rows()
+    if df_to_process_master is None:
+        return
+    paths = [shard_path(OUTPUT_FILE, i, count) for i in range(count)]
+    try:
+        merged, report = merge_shards(paths, 'original_index', ['api_label', 'api_correction'],
+                                      expected=df_to_process_master['original_index'])
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return
+    print(report.summary())
+    if not report.ok:
+        print(f"Not writing {OUTPUT_FILE}: finish or re-run the shards listed above and merge again.")
+        return
+    write_merged(merged, OUTPUT_FILE)
+    if os.path.exists(progress_path()):
+        os.remove(progress_path())
+    print(f"Merged {len(merged)} rows into {OUTPUT_FILE}")
+    store_run(merged)
+
+def open_session():
+    """Model, cache, stats and limiter shared by every queue labeled in this
+    run; None when rows go to the Batch API instead."""
+    if USE_BATCH_API:
+        return None
+    print("Initializing Gemini Model...")
+    model = build_model(single_instruction())
+    batch_model = build_model(BATCH_SYSTEM_INSTRUCTION) if BATCH_SIZE > 1 else None
+
+    cache = ResponseCache()
+    mode = "single" if BATCH_SIZE <= 1 else f"batch={BATCH_SIZE}"
+    if COMPACT_OUTPUT and BATCH_SIZE <= 1:
+        mode = "compact"
+    if SHARD is not None:
+        mode += f" shard={SHARD[0]}/{SHARD[1]}"
+    stats = Telemetry("gemini", mode, MODEL_NAME)
+
+    print("Starting evaluation...")
+
+    limiter = AdaptiveRateLimiter(rpm=MAX_RPM / 2, max_rpm=MAX_RPM, tpm=MAX_TPM)
+    return SimpleNamespace(model=model, batch_model=batch_model, cache=cache, stats=stats,
+                           limiter=limiter)
+
+def label_queue(df_queue, session):
+    """Label every row of df_queue (rules, dedup, then the API), append the
+    rows to OUTPUT_FILE and return them as a list of DataFrames."""
+    run_rows = []
+    if USE_RULES:
+        rule_rows, df_queue = answer_locally(df_queue)
+        run_rows.append(rule_rows)
+
+    df_members = df_queue
+    plan = plan_dedup(df_members['original_index'], df_members[COL_INCORRECT], DEDUP_MODE)
+    print(plan.summary())
+    df_queue = df_members[df_members['original_index'].isin(plan.representatives)]
+
+    if USE_BATCH_API:
+        if len(df_queue):
+            run_rows.append(run_batch_api(df_queue, df_members, plan))
+        return run_rows
+
+    members_by_id = df_members.set_index('original_index', drop=False)
+    stats = session.stats
+
+    def process_chunk(df_chunk):
+        sentences = df_chunk[COL_INCORRECT].tolist()
+        if BATCH_SIZE > 1:
+            return get_gemini_batch_evaluation(sentences, session.batch_model, session.cache,
+                                               stats, session.limiter, session.model)
+        return [get_gemini_evaluation(sentences[0], session.model, session.cache,
+                                      stats, session.limiter)]
+
+    progress = tqdm(total=plan.rows, desc="Processing")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(process_chunk, df_queue.iloc[chunk]): chunk
+            for chunk in chunked(range(len(df_queue)), BATCH_SIZE)
+        }
+        for future in as_completed(futures):
+            df_chunk = df_queue.iloc[futures[future]]
+            answers = future.result()
+
+            out_df = df_chunk.copy()
+            out_df['api_label'] = [label for label, _, _ in answers]
+            out_df['api_correction'] = [correction for _, correction, _ in answers]
+            out_df['api_tier'] = LLM_TIER
+            set_usage_columns(out_df, [usage for _, _, usage in answers])
+            out_df = fan_out(out_df, members_by_id, plan)
+            with stats.phase("io"):
+                append_results(out_df)
+            run_rows.append(out_df)
+
+            stats.add_rows(len(out_df))
+            progress.update(len(out_df))
+    progress.close()
+    return run_rows
+
+def close_session(session, run_rows):
+    if session is not None:
+        delete_context_caches()
+
+        stats, limiter, cache = session.stats, session.limiter, session.cache
+        stats.add_time("sleep", limiter.waited)
+        print(limiter.summary())
+        print(label_matcher.summary())
+        print(cache.summary())
+        cache.close()
+
+        save_run(stats.finish())
+        print(format_comparison(load_runs(), "gemini"))
+        print(stats.report())
+        stats.close()
+    if progress_journal is not None:
+        progress_journal.close()
+    print(f"\nDone! Results saved to {OUTPUT_FILE}")
+    if run_rows:
+        store_run(pd.concat(run_rows))
+
+def label_sample(df_to_process_master, processed_indices, session):
+    """RUN_MODE 2: label a stratified sample round by round until the
+    accuracy interval is within SAMPLE_TARGET_HALF_WIDTH (sampling.py).
+    Rows labeled by earlier runs count towards the sample."""
+    order = stratified_order(df_to_process_master[COL_ERROR_TYPE], SAMPLE_SEED)
+    ordered = df_to_process_master.iloc[order]
+    population = df_to_process_master[COL_ERROR_TYPE].value_counts()
+    limit = min(len(ordered), SAMPLE_MAX_ROWS if SAMPLE_MAX_ROWS is not None else len(ordered))
+    run_rows = []
+    if limit <= 0 or SAMPLE_ROUND_SIZE <= 0:
+        print(f"Nothing to sample: {len(ordered)} rows, SAMPLE_MAX_ROWS={SAMPLE_MAX_ROWS}, "
+              f"SAMPLE_ROUND_SIZE={SAMPLE_ROUND_SIZE}.")
+        return run_rows
+    processed_indices = set(processed_indices)
+    estimate = None
+    taken, round_number = 0, 0
+    while taken < limit:
+        round_number += 1
+        taken = min(limit, taken + SAMPLE_ROUND_SIZE)
+        df_sample = ordered.iloc[:taken]
+        df_queue = df_sample[~df_sample['original_index'].isin(processed_indices)]
+        if len(df_queue):
+            run_rows += label_queue(df_queue, session)
+            processed_indices.update(df_queue['original_index'])
+
+        if not os.path.exists(OUTPUT_FILE):
+            print(f"\nRound {round_number}: no rows labeled yet.")
+            continue
+        done = pd.read_csv(OUTPUT_FILE, usecols=['original_index', COL_ERROR_TYPE, 'api_label'])
+        done = done[done['original_index'].isin(df_sample['original_index'])].drop_duplicates('original_index', keep='last')
+        if done.empty:
+            # An empty sample would estimate with a zero-width interval.
+            print(f"\nRound {round_number}: no rows labeled yet.")
+            continue
+        estimate = estimate_accuracy(done[COL_ERROR_TYPE], done['api_label'] == done[COL_ERROR_TYPE], population)
+        print(f"\nRound {round_number}: {estimate.summary()}")
+        if estimate.half_width <= SAMPLE_TARGET_HALF_WIDTH:
+            print(f"Target precision ±{SAMPLE_TARGET_HALF_WIDTH} reached; stopping.")
+            break
+    else:
+        print(f"Sample limit of {limit} rows reached before ±{SAMPLE_TARGET_HALF_WIDTH}.")
+    if estimate is not None:
+        print(estimate.format_per_type())
+    return run_rows
+
+def main_batch_process():
+    df_to_process_master = load_rows()
+    if df_to_process_master is None:
+        return
+
+    if SHARD is not None:
+        df_to_process_master = df_to_process_master[in_shard(df_to_process_master['original_index'], *SHARD)]
+        print(f"Shard {SHARD[0]}/{SHARD[1]}: {len(df_to_process_master)} rows, output {OUTPUT_FILE}")
 
     processed_indices = set()
-    if os.path.exists(OUTPUT_FILE):
-        try:
-            df_done = pd.read_csv(OUTPUT_FILE)
-            if 'original_index' in df_done.columns:
-                processed_indices = set(df_done['original_index'].unique())
+    try:
+        processed_indices = load_processed()
+        if processed_indices:
             print(f"Found processed file, skipping {len(processed_indices)} rows.")
-        except:
-            print("Failed to read old file, starting over.")
+    except (OSError, ValueError) as e:
+        print(f"Failed to read old file ({e}), starting over.")
+
+    if RUN_MODE == 2:
+        session = open_session()
+        close_session(session, label_sample(df_to_process_master, processed_indices, session))
+        return
 
     df_queue = df_to_process_master[~df_to_process_master['original_index'].isin(processed_indices)]
     
@@ -168,30 +791,24 @@ def main_batch_process():
         print("All data processed!")
         return
 
-    print("Initializing Gemini Model...")
-    model = genai.GenerativeModel('models/gemini-2.5-flash')
-
-    print("Starting evaluation...")
-    write_header = not os.path.exists(OUTPUT_FILE)
-
-    for index, row in tqdm(df_queue.iterrows(), total=len(df_queue), desc="Processing"):
-        
-        sentence = row[COL_INCORRECT]
-        
-        api_label, api_correction = get_gemini_evaluation(sentence, model)
-        
-        result_row = row.to_dict()
-        result_row['api_label'] = api_label
-        result_row['api_correction'] = api_correction
-        
-        out_df = pd.DataFrame([result_row])
-        out_df.to_csv(OUTPUT_FILE, mode='a', header=write_header, index=False)
-        
-        write_header = False
-        
-        time.sleep(1.0) 
-
-    print(f"\nDone! Results saved to {OUTPUT_FILE}")
+    session = open_session()
+    close_session(session, label_queue(df_queue, session))
 
 if __name__ == "__main__":
-    main_batch_process()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=f"Label {INPUT_FILE} with {MODEL_NAME}.")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="only label the rows of shard i of N (0 <= i < N), into their own output file")
+    parser.add_argument("--merge", type=int, metavar="N",
+                        help="check the output files of shards 0..N-1 and merge them into the output file")
+    parser.add_argument("--sample", type=float, nargs="?", const=SAMPLE_TARGET_HALF_WIDTH, metavar="HALF_WIDTH",
+                        help="label a stratified sample until the accuracy is known within +/- HALF_WIDTH "
+                             f"(RUN_MODE 2, default {SAMPLE_TARGET_HALF_WIDTH})")
+    args = parser.parse_args()
+    if args.sample is not None:
+        RUN_MODE, SAMPLE_TARGET_HALF_WIDTH = 2, args.sample
+    if args.merge:
+        merge_results(args.merge)
+    else:
+        if args.shard:
+            use_shard(*args.shard)
+        main_batch_process()
\ No newline at end of file
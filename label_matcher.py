@@ -0,0 +1,118 @@
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from labels import OFFICIAL_ERROR_TYPES, LABEL_ALIASES, NONE_LABEL
+
+# Words that carry no meaning in a label name: "Spelling", "Spelling Errors"
+# and "Spelling Mistakes" all normalize to "spelling".
+GENERIC_WORDS = {"error", "errors", "mistake", "mistakes", "usage", "issue", "issues", "misuse", "problem", "problems"}
+
+
+def normalize_label(label):
+    text = unicodedata.normalize("NFKD", str(label)).encode("ascii", "ignore").decode("ascii")
+    words = re.sub(r"[^a-z0-9]+", " ", text.lower()).split()
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words if w not in GENERIC_WORDS]
+    return " ".join(words)
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_distance(a, b, bound):
+    """Levenshtein distance of a and b, or bound + 1 as soon as it must exceed `bound`."""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        cur = [i]
+        for j, y in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (x != y)))
+        if min(cur) > bound:
+            return bound + 1
+        prev = cur
+    return prev[-1]
+
+
+class LabelMatcher:
+    """Resolves a model's label to an entry of OFFICIAL_ERROR_TYPES.
+
+    Three tiers, cheapest first:
+      1. exact lookup of the normalized label among the official labels and
+         LABEL_ALIASES (confidence 1.0);
+      2. a character-trigram index that shortlists the closest known names;
+      3. a bounded edit distance against that shortlist.
+    match() returns (official label, confidence), or (None, confidence) when
+    nothing scores at least `min_confidence`. Answers are memoized, so each
+    distinct string is resolved once per run.
+
+    Callers retry a request only for unresolved labels; every label that
+    needed tier 2/3 or an alias is counted as a retry avoided.
+    """
+
+    def __init__(self, labels=OFFICIAL_ERROR_TYPES, aliases=LABEL_ALIASES,
+                 min_confidence=0.8, shortlist=5):
+        self.official = set(labels) | {NONE_LABEL}
+        self.min_confidence = min_confidence
+        self.shortlist = shortlist
+        self.exact = {}
+        for name, target in [(l, l) for l in self.official] + list(aliases.items()):
+            self.exact.setdefault(normalize_label(name), target)
+        self.keys = list(self.exact)
+        self.index = {}
+        for i, key in enumerate(self.keys):
+            for gram in _trigrams(key):
+                self.index.setdefault(gram, []).append(i)
+        self.memo = {}
+        self.lock = threading.Lock()
+        self.verbatim = 0
+        self.repaired = 0
+        self.unresolved = 0
+
+    def _resolve(self, label):
+        if label in self.official:
+            return label, 1.0
+        key = normalize_label(label)
+        if key in self.exact:
+            return self.exact[key], 1.0
+        if not key:
+            return None, 0.0
+
+        grams = _trigrams(key)
+        shared = Counter(i for gram in grams for i in self.index.get(gram, ()))
+        best, confidence = None, 0.0
+        for i, _ in shared.most_common(self.shortlist):
+            candidate = self.keys[i]
+            longest = max(len(key), len(candidate))
+            bound = int(longest * (1 - self.min_confidence))
+            distance = bounded_distance(key, candidate, bound)
+            score = 1 - distance / longest
+            if distance <= bound and score > confidence:
+                best, confidence = self.exact[candidate], score
+        return (best, confidence) if best is not None else (None, confidence)
+
+    def match(self, label):
+        with self.lock:
+            if label not in self.memo:
+                self.memo[label] = self._resolve(label)
+            canonical, confidence = self.memo[label]
+            if canonical is None:
+                self.unresolved += 1
+            elif canonical == label:
+                self.verbatim += 1
+            else:
+                self.repaired += 1
+        return canonical, confidence
+
+    def resolve(self, label):
+        """The official label, or None when a retry is warranted."""
+        return self.match(label)[0]
+
+    def summary(self):
+        return (
+            f"label matcher: {self.verbatim} verbatim, {self.repaired} repaired "
+            f"(API retries avoided), {self.unresolved} unresolved"
+        )
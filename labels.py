@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+
+# The 36 error types used by the Kaggle Grammar Correction dataset. Both
+# labeling pipelines ask the model to answer with one of these verbatim.
+OFFICIAL_ERROR_TYPES = [
+    "Capitalization Errors",
+    "Preposition Usage",
+    "Infinitive Errors",
+    "Faulty Comparisons",
+    "Mixed Conditionals",
+    "Contractions Errors",
+    "Incorrect Auxiliaries",
+    "Clichés",
+    "Ambiguity",
+    "Relative Clause Errors",
+    "Conjunction Misuse",
+    "Verb Tense Errors",
+    "Ellipsis Errors",
+    "Quantifier Errors",
+    "Spelling Mistakes",
+    "Passive Voice Overuse",
+    "Agreement in Comparative and Superlative Forms",
+    "Lack of Parallelism in Lists or Series",
+    "Abbreviation Errors",
+    "Modifiers Misplacement",
+    "Punctuation Errors",
+    "Tautology",
+    "Parallelism Errors",
+    "Run-on Sentences",
+    "Negation Errors",
+    "Word Choice/Usage",
+    "Pronoun Errors",
+    "Inappropriate Register",
+    "Sentence Fragments",
+    "Article Usage",
+    "Subject-Verb Agreement",
+    "Mixed Metaphors/Idioms",
+    "Redundancy/Repetition",
+    "Sentence Structure Errors",
+    "Slang, Jargon, and Colloquialisms",
+    "Gerund and Participle Errors"
+]
+
+# Coarse error groups used for "mapped" accuracy. Official labels that are not
+# listed form a group of their own (e.g. "Article Usage").
+LABEL_HIERARCHY = {
+    "Subject-Verb Agreement": "Verb/Tense Issues",
+    "Verb Tense Errors": "Verb/Tense Issues",
+    "Incorrect Auxiliaries": "Verb/Tense Issues",
+    "Passive Voice Overuse": "Verb/Tense Issues",
+
+    "Gerund and Participle Errors": "Verb Form Errors",
+    "Infinitive Errors": "Verb Form Errors",
+
+    "Punctuation Errors": "Mechanics/Punctuation",
+    "Contractions Errors": "Mechanics/Punctuation",
+    "Ellipsis Errors": "Mechanics/Punctuation",
+    "Capitalization Errors": "Mechanics/Punctuation",
+    "Abbreviation Errors": "Mechanics/Punctuation",
+
+    "Sentence Structure Errors": "Sentence Structure",
+    "Sentence Fragments": "Sentence Structure",
+    "Run-on Sentences": "Sentence Structure",
+    "Conjunction Misuse": "Sentence Structure",
+    "Ambiguity": "Sentence Structure",
+
+    "Parallelism Errors": "Parallelism Issues",
+    "Lack of Parallelism in Lists or Series": "Parallelism Issues",
+
+    "Inappropriate Register": "Style/Register",
+    "Slang, Jargon, and Colloquialisms": "Style/Register",
+    "Clichés": "Style/Register",
+
+    "Redundancy/Repetition": "Redundancy/Word Choice",
+    "Tautology": "Redundancy/Word Choice",
+    "Word Choice/Usage": "Redundancy/Word Choice",
+    "Mixed Metaphors/Idioms": "Redundancy/Word Choice",
+
+    "Faulty Comparisons": "Comparison Errors",
+    "Agreement in Comparative and Superlative Forms": "Comparison Errors",
+
+    "Pronoun Errors": "Pronoun/Relative Clause",
+    "Relative Clause Errors": "Pronoun/Relative Clause",
+}
+
+# Labels models return that are not in OFFICIAL_ERROR_TYPES, mapped to the
+# official label they stand for.
+LABEL_ALIASES = {
+    "Spelling": "Spelling Mistakes",
+    "Typographical Errors": "Spelling Mistakes",
+    "Article Errors": "Article Usage",
+    "Preposition Errors": "Preposition Usage",
+    "Redundancy": "Redundancy/Repetition",
+    "Word Choice Errors": "Word Choice/Usage",
+    "Wrong Word Usage": "Word Choice/Usage",
+    "Dangling Modifiers": "Modifiers Misplacement",
+    "Misplaced Modifiers": "Modifiers Misplacement",
+    "Adverb Placement Errors": "Modifiers Misplacement",
+    "Pronoun-Antecedent Agreement": "Pronoun Errors",
+    "Pronoun Case Errors": "Pronoun Errors",
+    "Vague Pronoun Reference": "Pronoun Errors",
+    "Double Negatives": "Negation Errors",
+    "Incorrect Negative Forms": "Negation Errors",
+    "Colloquialisms or Slang": "Slang, Jargon, and Colloquialisms",
+    "Idiom Errors": "Mixed Metaphors/Idioms",
+    "Word Order Errors": "Sentence Structure Errors",
+    "Comma Splices": "Run-on Sentences",
+    "Conditional Sentence Errors": "Mixed Conditionals",
+    "Subjunctive Mood Errors": "Mixed Conditionals",
+    "Comparatives and Superlatives": "Agreement in Comparative and Superlative Forms",
+    "Countable and Uncountable Noun Errors": "Quantifier Errors",
+    "Conjunction Errors": "Conjunction Misuse",
+    "Apostrophe Usage": "Punctuation Errors",
+    "Quotation Mark Usage": "Punctuation Errors",
+}
+
+
+def canonical_label(label):
+    return LABEL_ALIASES.get(label, label)
+
+
+def coarse_label(label):
+    label = canonical_label(label)
+    return LABEL_HIERARCHY.get(label, label)
+
+
+# Buckets that complete the fine label set: answers that are empty or an
+# "Error: ..." marker, and labels that are neither official nor an alias.
+NONE_LABEL = "None"
+FAILED_LABEL = "(failed)"
+UNKNOWN_LABEL = "(unknown)"
+
+
+class LabelIndex:
+    """Integer codes for the fine (official) and coarse label levels.
+
+    Fine codes follow OFFICIAL_ERROR_TYPES, then "None", FAILED_LABEL and
+    UNKNOWN_LABEL, so every answer a model gives lands in some class. A
+    confusion matrix is one bincount over true * n + pred; the coarse matrix
+    is rolled up from the fine one instead of being recounted. With a
+    label_matcher.LabelMatcher, near-miss labels are resolved before falling
+    into UNKNOWN_LABEL.
+    """
+
+    def __init__(self, labels=OFFICIAL_ERROR_TYPES, hierarchy=LABEL_HIERARCHY, aliases=LABEL_ALIASES,
+                 matcher=None):
+        self.fine = list(labels) + [NONE_LABEL, FAILED_LABEL, UNKNOWN_LABEL]
+        self.coarse = list(dict.fromkeys(hierarchy.get(l, l) for l in self.fine))
+        self.aliases = aliases
+        self.matcher = matcher
+        self.codes = {label: i for i, label in enumerate(self.fine)}
+        coarse_codes = {label: i for i, label in enumerate(self.coarse)}
+        self.fine_to_coarse = np.array([coarse_codes[hierarchy.get(l, l)] for l in self.fine])
+        self.failed = self.codes[FAILED_LABEL]
+        self.unknown = self.codes[UNKNOWN_LABEL]
+
+    def code(self, label):
+        if label is None or label != label or label == "" or str(label).startswith("Error:"):
+            return self.failed
+        code = self.codes.get(self.aliases.get(label, label))
+        if code is None and self.matcher is not None:
+            code = self.codes.get(self.matcher.resolve(label))
+        return self.unknown if code is None else code
+
+    def encode(self, labels):
+        """Fine codes for a column of label strings; each distinct string is looked up once."""
+        labels = pd.Series(labels)
+        if isinstance(labels.dtype, pd.CategoricalDtype):
+            inverse, uniques = labels.cat.codes.to_numpy(), labels.cat.categories
+        else:
+            inverse, uniques = pd.factorize(labels.astype(object))
+        lookup = np.array([self.code(u) for u in uniques] + [self.failed], dtype=np.int64)
+        return lookup[inverse]
+
+    def names(self, level="fine"):
+        return self.fine if level == "fine" else self.coarse
+
+    def at_level(self, codes, level="fine"):
+        return codes if level == "fine" else self.fine_to_coarse[codes]
+
+    def confusion(self, true, pred, level="fine", groups=None):
+        """Confusion counts (rows = true) from fine codes. With `groups`, an
+        array of run/model codes 0..g-1, returns one matrix per group, shape (g, n, n)."""
+        n = len(self.names(level))
+        flat = self.at_level(true, level) * n + self.at_level(pred, level)
+        if groups is None:
+            return np.bincount(flat, minlength=n * n).reshape(n, n)
+        groups = np.asarray(groups)
+        g = int(groups.max()) + 1 if len(groups) else 0
+        return np.bincount(groups * n * n + flat, minlength=g * n * n).reshape(g, n, n)
+
+    def roll_up(self, fine_cm):
+        """Coarse confusion matrix (or stack of matrices) from fine ones."""
+        member = np.zeros((len(self.fine), len(self.coarse)), dtype=fine_cm.dtype)
+        member[np.arange(len(self.fine)), self.fine_to_coarse] = 1
+        return member.T @ fine_cm @ member
+
+    def report(self, cm, level="fine"):
+        """Per-class precision/recall/F1/support from a confusion matrix, for
+        the classes that occur as a true or a predicted label."""
+        tp = np.diag(cm).astype(float)
+        support = cm.sum(axis=1)
+        predicted = cm.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.nan_to_num(tp / predicted)
+            recall = np.nan_to_num(tp / support)
+            f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+        report = pd.DataFrame(
+            {"precision": precision, "recall": recall, "f1-score": f1, "support": support},
+            index=self.names(level),
+        )
+        return report[(support > 0) | (predicted > 0)]
+
+    def frame(self, cm, level="fine"):
+        """A confusion matrix as a labeled DataFrame, limited to the classes that occur."""
+        names = self.names(level)
+        used = (cm.sum(axis=0) > 0) | (cm.sum(axis=1) > 0)
+        labels = [name for name, keep in zip(names, used) if keep]
+        return pd.DataFrame(cm[np.ix_(used, used)], index=labels, columns=labels)
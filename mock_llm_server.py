@@ -0,0 +1,526 @@
+import re
+import json
+import time
+import math
+import random
+import argparse
+import itertools
+from email.parser import BytesParser
+from urllib.parse import urlparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from compact_output import COMPACT_LABELS
+
+# Local stand-in for the OpenAI chat completions endpoint. It answers every
+# request with a canned JSON label after an artificial delay, so the labeling
+# scripts can be exercised without an API key:
+#
+#   python mock_llm_server.py --port 8000 --latency 0.5
+#   OPENAI_BASE_URL=http://127.0.0.1:8000/v1 API_KEY=test python script.py
+#   GEMINI_BASE_URL=http://127.0.0.1:8000 GOOGLE_API_KEY=test python gemini/geminiApi.py
+#
+# Gemini's models/*:generateContent is answered the same way.
+# It also mimics the OpenAI (/v1/files, /v1/batches) and Gemini (upload,
+# batchGenerateContent, batches/*, download) batch endpoints; jobs report
+# as running for --batch-delay seconds and then complete.
+#
+# Requests with a JSON schema (compact_output.py) get the compact
+# {"i", "c"} answer, and answers longer than the request's max_tokens /
+# max_output_tokens are cut off there, as the real endpoints do.
+# Chat requests whose system prompt was seen before report it as cached
+# input (prompt_tokens_details.cached_tokens) once it reaches
+# --cache-min-tokens, like OpenAI's automatic prompt caching.
+#
+# For benchmarks (benchmark.py) the delay can be drawn from a distribution
+# (--latency-dist, with --latency as its mean or median), a share of
+# requests can be failed with a 429 (--throttle-rate) or a 500
+# (--error-rate), and GET /stats returns the request and token counters.
+# The same rates fail individual lines of batch jobs.
+
+CANNED_LABEL = "Verb Tense Errors"
+LATENCY_DISTS = ("constant", "uniform", "exponential", "lognormal")
+
+
+class MockState:
+    def __init__(self, latency=0.2, label=CANNED_LABEL, drop_rate=0.0, seed=0,
+                 quota=None, quota_window=60.0, batch_delay=1.0, cache_min_tokens=1024,
+                 latency_dist="constant", latency_sigma=0.5, throttle_rate=0.0, error_rate=0.0):
+        if latency_dist not in LATENCY_DISTS:
+            raise ValueError(f"unknown latency distribution {latency_dist!r}, expected one of {LATENCY_DISTS}")
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        # Shares of requests answered with a 429 (Retry-After: 1) or a 500.
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.label = label
+        # Fraction of items silently left out of batched answers.
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        # At most `quota` accepted requests per `quota_window` seconds; the
+        # rest get a 429 with a Retry-After header, like the real providers.
+        self.quota = quota
+        self.quota_window = quota_window
+        self.accepted = deque()
+        self.throttled = 0
+        self.batch_delay = batch_delay
+        self.cache_min_tokens = cache_min_tokens
+        self.prefixes = set()
+        self.files = {}
+        self.batches = {}
+        self.uploads = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def enter(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def admit(self):
+        """Return None if the request fits the quota, else seconds until it would."""
+        if self.quota is None:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            while self.accepted and now - self.accepted[0] >= self.quota_window:
+                self.accepted.popleft()
+            if len(self.accepted) < self.quota:
+                self.accepted.append(now)
+                return None
+            self.throttled += 1
+            return self.quota_window - (now - self.accepted[0])
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def delay(self):
+        """Seconds to wait before answering: `latency` is the mean of the
+        uniform and exponential draws and the median of the lognormal one."""
+        with self.lock:
+            if self.latency_dist == "uniform":
+                return self.random.uniform(0, 2 * self.latency)
+            if self.latency_dist == "exponential":
+                return self.random.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+            if self.latency_dist == "lognormal":
+                return self.random.lognormvariate(math.log(self.latency), self.latency_sigma) if self.latency > 0 else 0.0
+        return self.latency
+
+    def fault(self):
+        """429, 500 or None for an injected failure of the next request."""
+        with self.lock:
+            draw = self.random.random()
+            if draw < self.throttle_rate:
+                self.throttled += 1
+                return 429
+            if draw < self.throttle_rate + self.error_rate:
+                self.errors += 1
+                return 500
+        return None
+
+    def count_usage(self, prompt_tokens, completion_tokens):
+        with self.lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests, "max_in_flight": self.max_in_flight,
+                "throttled": self.throttled, "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+            }
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def cached_prefix_tokens(state, messages):
+    """Tokens of the system prompt served from the mock prompt cache:
+    the first cache_min_tokens and then whole blocks of 128, as OpenAI does."""
+    if not messages or messages[0].get("role") != "system":
+        return 0
+    system = messages[0].get("content", "")
+    tokens = count_tokens(system)
+    with state.lock:
+        seen = system in state.prefixes
+        state.prefixes.add(system)
+    if not seen or tokens < state.cache_min_tokens:
+        return 0
+    return state.cache_min_tokens + (tokens - state.cache_min_tokens) // 128 * 128
+
+
+def compact_answer(label, sentence, index_type=int):
+    index = COMPACT_LABELS.index(label) if label in COMPACT_LABELS else len(COMPACT_LABELS) - 1
+    return json.dumps({"i": index_type(index), "c": sentence})
+
+
+def truncate(content, max_tokens):
+    """(content, finished) with content cut to `max_tokens` tokens."""
+    if max_tokens is not None and count_tokens(content) > max_tokens:
+        return content[:max_tokens * 4], False
+    return content, True
+
+
+def batch_items(text):
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(items, list) and all(isinstance(i, dict) and "sentence" in i for i in items):
+        return items
+    return None
+
+
+def chat_completion(state, body):
+    messages = body.get("messages", [])
+    sentence = messages[-1]["content"] if messages else ""
+    items = batch_items(sentence)
+    if items is not None:
+        with state.lock:
+            kept = [i for i in items if state.random.random() >= state.drop_rate]
+        content = json.dumps({"results": [
+            {"id": i["id"], "label": state.label, "correction": i["sentence"]} for i in kept
+        ]})
+    elif (body.get("response_format") or {}).get("type") == "json_schema":
+        content = compact_answer(state.label, sentence)
+    else:
+        content = json.dumps({"error_type": state.label, "corrected_sentence": sentence})
+    content, finished = truncate(content, body.get("max_tokens"))
+    prompt_tokens = sum(count_tokens(m.get("content", "")) for m in messages)
+    completion_tokens = count_tokens(content)
+    state.count_usage(prompt_tokens, completion_tokens)
+    return {
+        "id": f"chatcmpl-mock-{state.requests}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop" if finished else "length",
+        }],
+        "usage": {
+            "prompt_tokens_details": {"cached_tokens": cached_prefix_tokens(state, messages)},
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def gemini_answer(state, prompt, config=None):
+    """(text, finished) for a Gemini prompt. `config` is the generation
+    config in either the batch files' snake_case or the REST camelCase."""
+    config = config or {}
+    items = batch_items(prompt.split("\n", 1)[-1]) if prompt.startswith("Input Sentences:") else None
+    match = re.search(r'Input Sentence: "(.*)"', prompt)
+    sentence = match.group(1) if match else prompt
+    if items is not None:
+        with state.lock:
+            kept = [i for i in items if state.random.random() >= state.drop_rate]
+        content = json.dumps([{"id": i["id"], "label": state.label, "correction": i["sentence"]} for i in kept])
+    elif "response_schema" in config or "responseSchema" in config:
+        content = compact_answer(state.label, sentence, str)
+    else:
+        content = json.dumps({"label": state.label, "correction": sentence})
+    return truncate(content, config.get("max_output_tokens", config.get("maxOutputTokens")))
+
+
+def gemini_response(state, request):
+    """GenerateContentResponse for one request body."""
+    prompt = request["contents"][-1]["parts"][0]["text"]
+    config = request.get("generation_config") or request.get("generationConfig")
+    instruction = request.get("system_instruction") or request.get("systemInstruction") or {"parts": [{"text": ""}]}
+    text, finished = gemini_answer(state, prompt, config)
+    prompt_tokens = count_tokens(instruction["parts"][0]["text"] + prompt)
+    state.count_usage(prompt_tokens, count_tokens(text))
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                        "finishReason": "STOP" if finished else "MAX_TOKENS"}],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": count_tokens(text),
+                          "totalTokenCount": prompt_tokens + count_tokens(text)},
+    }
+
+
+def run_openai_batch(state, batch):
+    lines = state.files[batch["input_file_id"]]["data"].decode("utf-8").splitlines()
+    out, failed = [], []
+    for n, line in enumerate(l for l in lines if l.strip()):
+        request = json.loads(line)
+        status = state.fault()
+        if status is not None:
+            # Failed requests go to the error file, as OpenAI does.
+            failed.append({
+                "id": f"batch_req_{n}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": status, "request_id": f"req_{n}",
+                             "body": {"error": {"message": "Injected failure", "type": "server_error"}}},
+                "error": None,
+            })
+            continue
+        out.append({
+            "id": f"batch_req_{n}",
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 200, "request_id": f"req_{n}",
+                         "body": chat_completion(state, request["body"])},
+            "error": None,
+        })
+    file_id = new_file(state, "batch_output.jsonl", "batch_output",
+                       "".join(json.dumps(r) + "\n" for r in out).encode("utf-8"))
+    error_file_id = None
+    if failed:
+        error_file_id = new_file(state, "batch_errors.jsonl", "batch_output",
+                                 "".join(json.dumps(r) + "\n" for r in failed).encode("utf-8"))
+    batch.update(status="completed", output_file_id=file_id, error_file_id=error_file_id,
+                 completed_at=int(time.time()),
+                 request_counts={"total": len(out) + len(failed), "completed": len(out),
+                                 "failed": len(failed)})
+
+
+def run_gemini_batch(state, batch):
+    lines = state.files[batch["_input_file"]]["data"].decode("utf-8").splitlines()
+    out = []
+    for line in (l for l in lines if l.strip()):
+        request = json.loads(line)
+        status = state.fault()
+        if status is not None:
+            out.append({"key": request["key"],
+                        "error": {"code": status, "message": "Injected failure", "status": "INTERNAL"}})
+            continue
+        out.append({"key": request["key"], "response": gemini_response(state, request["request"])})
+    file_id = new_file(state, "responses.jsonl", "batch_output",
+                       "".join(json.dumps(r) + "\n" for r in out).encode("utf-8"))
+    batch["metadata"]["state"] = "BATCH_STATE_SUCCEEDED"
+    batch["done"] = True
+    batch["response"] = {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatchOutput",
+                         "responsesFile": f"files/{file_id}"}
+
+
+def new_file(state, filename, purpose, data):
+    file_id = f"file-{next(state.ids)}"
+    state.files[file_id] = {"filename": filename, "purpose": purpose, "data": data,
+                            "created_at": int(time.time())}
+    return file_id
+
+
+def file_object(file_id, f):
+    return {"id": file_id, "object": "file", "bytes": len(f["data"]), "created_at": f["created_at"],
+            "filename": f["filename"], "purpose": f["purpose"], "status": "processed"}
+
+
+def poll_batch(state, batch, runner):
+    with state.lock:
+        if not batch.get("_finished") and time.monotonic() - batch["_started"] >= state.batch_delay:
+            runner(state, batch)
+            batch["_finished"] = True
+    return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        state = self.server.state
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self.send_json(200, state.snapshot())
+            return
+        match = re.fullmatch(r"/v1/batches/([\w-]+)", path)
+        if match and match.group(1) in state.batches:
+            self.send_json(200, poll_batch(state, state.batches[match.group(1)], run_openai_batch))
+            return
+        match = re.fullmatch(r"/v1/files/([\w-]+)/content", path)
+        if match and match.group(1) in state.files:
+            self.send_bytes(state.files[match.group(1)]["data"])
+            return
+        match = re.fullmatch(r"/v1beta/(batches/[\w-]+)", path)
+        if match and match.group(1) in state.batches:
+            self.send_json(200, poll_batch(state, state.batches[match.group(1)], run_gemini_batch))
+            return
+        match = re.fullmatch(r"/download/v1beta/files/([\w-]+):download", path)
+        if match and match.group(1) in state.files:
+            self.send_bytes(state.files[match.group(1)]["data"])
+            return
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def send_bytes(self, data):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        state = self.server.state
+        raw = self.read_body()
+        path = urlparse(self.path).path
+        if path == "/v1/files":
+            self.upload_openai_file(raw)
+        elif path == "/v1/batches":
+            self.create_openai_batch(json.loads(raw))
+        elif path == "/upload/v1beta/files":
+            self.upload_gemini_file(raw)
+        elif path.endswith(":batchGenerateContent"):
+            self.create_gemini_batch(json.loads(raw))
+        elif path.endswith(":generateContent"):
+            self.generate(state, json.loads(raw or b"{}"))
+        elif path.rstrip("/").endswith("/chat/completions"):
+            self.chat(state, json.loads(raw or b"{}"))
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def chat(self, state, body):
+        self.answer(state, chat_completion, body)
+
+    def generate(self, state, body):
+        self.answer(state, gemini_response, body)
+
+    def answer(self, state, respond, body):
+        retry_after = state.admit()
+        fault = state.fault() if retry_after is None else 429
+        if fault == 429:
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded", "code": 429}},
+                {"Retry-After": f"{retry_after if retry_after is not None else 1.0:.3f}"},
+            )
+            return
+        state.enter()
+        try:
+            time.sleep(state.delay())
+            if fault == 500:
+                self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error", "code": 500}})
+            else:
+                self.send_json(200, respond(state, body))
+        finally:
+            state.leave()
+
+    def upload_openai_file(self, raw):
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+        message = BytesParser().parsebytes(header + raw)
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.get_payload()}
+        upload = fields["file"]
+        purpose = fields["purpose"].get_payload(decode=True).decode("utf-8")
+        state = self.server.state
+        with state.lock:
+            file_id = new_file(state, upload.get_filename(), purpose, upload.get_payload(decode=True))
+            self.send_json(200, file_object(file_id, state.files[file_id]))
+
+    def create_openai_batch(self, body):
+        state = self.server.state
+        with state.lock:
+            batch_id = f"batch_{next(state.ids)}"
+            state.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                "status": "in_progress", "created_at": int(time.time()),
+                "output_file_id": None, "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "_started": time.monotonic(),
+            }
+            self.send_json(200, poll_batch(state, state.batches[batch_id], run_openai_batch))
+
+    def upload_gemini_file(self, raw):
+        state = self.server.state
+        query = urlparse(self.path).query
+        with state.lock:
+            if self.headers.get("X-Goog-Upload-Command") == "start":
+                upload_id = str(next(state.ids))
+                state.uploads[upload_id] = json.loads(raw).get("file", {}).get("display_name", "upload")
+                host, port = self.server.server_address[:2]
+                self.send_json(200, {}, {"X-Goog-Upload-URL":
+                                         f"http://{host}:{port}/upload/v1beta/files?upload_id={upload_id}"})
+                return
+            upload_id = query.split("upload_id=", 1)[1]
+            file_id = new_file(state, state.uploads.pop(upload_id), "batch", raw)
+            self.send_json(200, {"file": {"name": f"files/{file_id}", "sizeBytes": str(len(raw))}})
+
+    def create_gemini_batch(self, body):
+        state = self.server.state
+        with state.lock:
+            name = f"batches/{next(state.ids)}"
+            state.batches[name] = {
+                "name": name,
+                "metadata": {"state": "BATCH_STATE_RUNNING"},
+                "_input_file": body["batch"]["input_config"]["file_name"].split("/", 1)[1],
+                "_started": time.monotonic(),
+            }
+            batch = {k: v for k, v in state.batches[name].items() if not k.startswith("_")}
+        self.send_json(200, batch)
+
+
+def start_server(port=0, **state_kwargs):
+    """Start the mock server on a background thread and return it.
+    The bound address is server.server_address; stop it with server.shutdown()."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(**state_kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per request (mean, or median for lognormal)")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTS, default="constant")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="sigma of the lognormal latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default=CANNED_LABEL)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, default=None, help="requests allowed per --quota-window")
+    parser.add_argument("--quota-window", type=float, default=60.0)
+    parser.add_argument("--batch-delay", type=float, default=1.0)
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="system prompt size from which repeated prompts report cached tokens")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(
+        latency=args.latency, label=args.label, drop_rate=args.drop_rate, seed=args.seed,
+        quota=args.quota, quota_window=args.quota_window, batch_delay=args.batch_delay,
+        cache_min_tokens=args.cache_min_tokens, latency_dist=args.latency_dist,
+        latency_sigma=args.latency_sigma, throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+    )
+    print(f"Mock LLM server listening on {base_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from async_engine import run_concurrent
+from result_journal import ResultJournal, load_journal, completed_ids
+from response_cache import ResponseCache
+from label_matcher import LabelMatcher
+from dedup import plan_dedup
+from compact_output import OPENAI_RESPONSE_FORMAT, GEMINI_RESPONSE_SCHEMA, output_budget, parse_compact
+from rate_limiter import AdaptiveRateLimiter, estimate_tokens, is_rate_limit_error, retry_after_from_error
+from results_store import write_run, DEFAULT_STORE
+from evaluation import RESULT_COLUMNS, summarize_runs
+from script import prompt as VERBOSE_PROMPT, compact_prompt as COMPACT_PROMPT
+
+# One labeling run for several models.
+#
+# The dataset is read and deduplicated once; every configured model then
+# labels the same group representatives concurrently, each provider paced by
+# its own adaptive rate limiter. Answers land in one journal keyed by
+# "<name>/<row id>", so an interrupted run resumes per model, and are written
+# as a single long table (one row per model and dataset row) with the
+# RESULT_COLUMNS layout plus model, provider and usage columns.
+#
+# A new model is a new MODELS entry (or --config file entry); a new provider
+# is a new entry in ADAPTERS.
+
+load_dotenv()
+
+INPUT_PATH = "Grammar_Correction.csv"
+OUTPUT_PATH = "multi_model_results.csv"
+JOURNAL_PATH = "multi_model_results.journal.jsonl"
+DATASET_COLUMNS = {
+    "Serial Number": "row_id",
+    "Error Type": "true_label",
+    "Ungrammatical Statement": "source",
+    "Standard English": "reference",
+}
+
+# name: label of the model in the results (unique); provider: key of ADAPTERS;
+# prompt: key of PROMPTS.
+MODELS = [
+    {"name": "gpt-4o-mini", "provider": "openai", "model": "gpt-4o-mini",
+     "prompt": "verbose", "temperature": 0},
+    {"name": "gemini-2.5-flash", "provider": "gemini", "model": "models/gemini-2.5-flash",
+     "prompt": "verbose", "temperature": 0.1},
+]
+
+# Account limits shared by every model of a provider. Each limiter starts at
+# half of rpm and adapts to 429s like the single-model scripts.
+PROVIDER_LIMITS = {
+    "openai": {"rpm": 500, "tpm": 200000, "concurrency": 16},
+    "gemini": {"rpm": 1000, "tpm": 1000000, "concurrency": 8},
+}
+
+# The system prompt and the way its answer is read. Both are the prompts of
+# script.py; the sentence is always sent on its own after the prompt.
+PROMPTS = {
+    "verbose": {"text": VERBOSE_PROMPT, "compact": False},
+    "compact": {"text": COMPACT_PROMPT, "compact": True},
+}
+
+DEDUP_MODE = os.getenv("MULTI_DEDUP", "normalized")
+MAX_ATTEMPTS = 6
+MAX_LABEL_RETRIES = 1
+# Thinking models (Gemini 2.5) count their thinking against the output cap.
+THINKING_TOKENS = 1024
+
+label_matcher = LabelMatcher()
+
+
+class OpenAIAdapter:
+    def __init__(self):
+        from openai import AsyncOpenAI
+
+        # Retries are handled by label_row() so 429s reach the rate limiter.
+        self.client = AsyncOpenAI(api_key=os.getenv("API_KEY"), max_retries=0)
+
+    async def generate(self, config, system_prompt, sentence, compact):
+        options = {"response_format": {"type": "json_object"}}
+        if compact:
+            options = {"response_format": OPENAI_RESPONSE_FORMAT, "max_tokens": output_budget(sentence)}
+        response = await self.client.chat.completions.create(
+            model=config["model"],
+            temperature=config.get("temperature", 0),
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": sentence},
+            ],
+            **options,
+        )
+        usage = response.usage
+        details = usage.prompt_tokens_details if usage is not None else None
+        return {
+            "text": response.choices[0].message.content,
+            "input_tokens": usage.prompt_tokens if usage is not None else None,
+            "output_tokens": usage.completion_tokens if usage is not None else None,
+            "cached_tokens": details.cached_tokens if details is not None else None,
+        }
+
+
+class GeminiAdapter:
+    def __init__(self):
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.genai = genai
+        self.models = {}
+
+    async def generate(self, config, system_prompt, sentence, compact):
+        key = (config["model"], system_prompt)
+        if key not in self.models:
+            self.models[key] = self.genai.GenerativeModel(config["model"], system_instruction=system_prompt)
+        options = {}
+        if compact:
+            options = {"response_schema": GEMINI_RESPONSE_SCHEMA,
+                       "max_output_tokens": output_budget(sentence) + THINKING_TOKENS}
+        response = await self.models[key].generate_content_async(
+            sentence,
+            generation_config=self.genai.types.GenerationConfig(
+                response_mime_type="application/json",
+                temperature=config.get("temperature", 0),
+                **options,
+            ),
+        )
+        usage = getattr(response, "usage_metadata", None)
+        return {
+            "text": response.text,
+            "input_tokens": usage.prompt_token_count if usage is not None else None,
+            "output_tokens": usage.candidates_token_count if usage is not None else None,
+            "cached_tokens": usage.cached_content_token_count if usage is not None else None,
+        }
+
+
+ADAPTERS = {"openai": OpenAIAdapter, "gemini": GeminiAdapter}
+
+
+def parse_reply(text, compact):
+    """(label, correction, resolved). Compact answers are always official
+    labels; verbose labels go through the label matcher."""
+    if compact:
+        return (*parse_compact(text), True)
+    data = json.loads(text)
+    label, correction = data["error_type"], data["corrected_sentence"]
+    if not isinstance(label, str) or not isinstance(correction, str):
+        raise ValueError(f"malformed answer {text!r}")
+    resolved = label_matcher.resolve(label)
+    return resolved or label, correction, resolved is not None
+
+
+def _add(a, b):
+    return b if a is None else a + (b or 0)
+
+
+async def label_row(config, adapter, limiter, sentence, cache=None):
+    """One model's answer for one sentence as a journal record."""
+    prompt = PROMPTS[config["prompt"]]
+    key = None
+    if cache is not None:
+        # The key scheme of script.py and geminiApi.py, so a request either
+        # pipeline has already answered is a hit here too.
+        key = cache.make_key(config["provider"], config["model"], prompt["text"],
+                             config.get("temperature", 0), sentence)
+        cached = await cache.get_async(key)
+        if cached is not None:
+            return {"pred_label": cached[0], "prediction": cached[1]}
+
+    record = {"latency_s": 0.0, "input_tokens": None, "output_tokens": None, "cached_tokens": None}
+    reserved = estimate_tokens(prompt["text"] + sentence) + 100
+    label_retries = 0
+    answer = ("Error: Request failed", "Error: Request failed")
+    for attempt in range(MAX_ATTEMPTS):
+        granted_at = await limiter.acquire_async(reserved)
+        started = time.perf_counter()
+        try:
+            reply = await adapter.generate(config, prompt["text"], sentence, prompt["compact"])
+        except Exception as e:
+            if is_rate_limit_error(e):
+                limiter.on_throttle(retry_after_from_error(e), granted_at)
+            else:
+                print(f"{config['name']}: request failed for {sentence!r}: {e} (attempt {attempt + 1})")
+                await asyncio.sleep(2 ** attempt)
+            continue
+        record["latency_s"] += time.perf_counter() - started
+        for field in ("input_tokens", "output_tokens", "cached_tokens"):
+            record[field] = _add(record[field], reply[field])
+        limiter.on_success(_add(reply["input_tokens"], reply["output_tokens"]), reserved)
+
+        try:
+            label, correction, resolved = parse_reply(reply["text"], prompt["compact"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"{config['name']}: malformed answer for {sentence!r}: {e} (attempt {attempt + 1})")
+            answer = ("Error: Malformed response", "Error: Malformed response")
+            continue
+        answer = (label, correction)
+        if resolved or label_retries >= MAX_LABEL_RETRIES:
+            break
+        label_retries += 1
+        print(f"{config['name']}: unknown label {label!r} for {sentence!r} (attempt {attempt + 1})")
+
+    if cache is not None and not answer[0].startswith("Error:"):
+        await cache.put_async(key, list(answer))
+    return {"pred_label": answer[0], "prediction": answer[1], **record}
+
+
+def journal_key(name, row_id):
+    return f"{name}/{row_id}"
+
+
+async def run_models(configs, items, plan, journal, done, cache=None):
+    """Label (row_id, sentence) group representatives with every config
+    concurrently. Each answer is journaled for all rows of its group; returns
+    the journal keys written."""
+    providers = {config["provider"] for config in configs}
+    adapters = {provider: ADAPTERS[provider]() for provider in providers}
+    limiters = {
+        provider: AdaptiveRateLimiter(rpm=PROVIDER_LIMITS[provider]["rpm"] / 2,
+                                      max_rpm=PROVIDER_LIMITS[provider]["rpm"],
+                                      tpm=PROVIDER_LIMITS[provider]["tpm"])
+        for provider in providers
+    }
+    written = []
+
+    async def run_one(config):
+        name, provider = config["name"], config["provider"]
+        todo = [(row_id, sentence) for row_id, sentence in items if journal_key(name, row_id) not in done]
+        print(f"{name}: {len(todo)} requests to send")
+
+        async def worker(item):
+            row_id, sentence = item
+            return await label_row(config, adapters[provider], limiters[provider], sentence, cache)
+
+        jobs = ((row_id, (row_id, sentence)) for row_id, sentence in todo)
+        finished = 0
+        async for row_id, record in run_concurrent(jobs, worker, PROVIDER_LIMITS[provider]["concurrency"]):
+            for member_id, _ in plan.expand(row_id, None):
+                # Duplicates ride on the representative's request; only it is charged.
+                fields = record if member_id == row_id else {
+                    "pred_label": record["pred_label"], "prediction": record["prediction"]
+                }
+                journal.append(journal_key(name, member_id), model=name, provider=provider,
+                               row=member_id, **fields)
+                written.append(journal_key(name, member_id))
+            finished += 1
+            if finished % 100 == 0 or finished == len(todo):
+                print(f"{name}: {finished}/{len(todo)} requests done")
+
+    await asyncio.gather(*(run_one(config) for config in configs))
+    for provider, limiter in limiters.items():
+        print(f"{provider} {limiter.summary()}")
+    return written
+
+
+def results_table(dataset, records):
+    """Long table: one row per (model, dataset row) in `records`."""
+    answers = pd.DataFrame(list(records)).drop(columns="id").rename(columns={"row": "row_id"})
+    out = answers.merge(dataset, on="row_id", how="left")
+    front = ["model", "provider"] + RESULT_COLUMNS
+    out = out[front + [c for c in out.columns if c not in front]]
+    return out.sort_values(["model", "row_id"], kind="stable").reset_index(drop=True)
+
+
+def load_configs(path):
+    with open(path, encoding="utf-8") as f:
+        configs = json.load(f)
+    names = [config["name"] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"model names must be unique, got {names}")
+    for config in configs:
+        if config["provider"] not in ADAPTERS:
+            raise ValueError(f"unknown provider {config['provider']!r}, expected one of {list(ADAPTERS)}")
+        if config["prompt"] not in PROMPTS:
+            raise ValueError(f"unknown prompt {config['prompt']!r}, expected one of {list(PROMPTS)}")
+    return configs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Label one dataset with several models in one run.")
+    parser.add_argument("--config", help="JSON list of model entries (default: MODELS)")
+    parser.add_argument("--models", nargs="+", help="only run these model names")
+    parser.add_argument("--input", default=INPUT_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    parser.add_argument("--rows", type=int, help="only label the first N rows")
+    parser.add_argument("--dedup", default=DEDUP_MODE, help="off, normalized or near")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--no-store", action="store_true", help="do not add the runs to the results store")
+    args = parser.parse_args(argv)
+
+    configs = load_configs(args.config) if args.config else MODELS
+    if args.models:
+        configs = [config for config in configs if config["name"] in args.models]
+
+    dataset = pd.read_csv(args.input)
+    if args.rows:
+        dataset = dataset.head(args.rows)
+    dataset = dataset.rename(columns=DATASET_COLUMNS)[list(DATASET_COLUMNS.values())]
+    plan = plan_dedup(dataset["row_id"], dataset["source"], args.dedup)
+    print(plan.summary())
+    sentences = dict(zip(dataset["row_id"], dataset["source"]))
+    items = [(row_id, sentences[row_id]) for row_id in plan.representatives]
+
+    records = load_journal(args.journal)
+    done = completed_ids(records, "pred_label")
+    print(f"Found {len(done)} answers in {args.journal}.")
+
+    cache = None if args.no_cache else ResponseCache()
+    with ResultJournal(args.journal) as journal:
+        written = asyncio.run(run_models(configs, items, plan, journal, done, cache))
+    print(label_matcher.summary())
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
+
+    records = load_journal(args.journal)
+    names = {config["name"] for config in configs}
+    table = results_table(dataset, (r for r in records.values() if r["model"] in names))
+    tmp_path = args.output + ".tmp"
+    table.to_csv(tmp_path, index=False, encoding="utf-8")
+    os.replace(tmp_path, args.output)
+    print(f"wrote {len(table)} rows to {args.output}")
+
+    if not args.no_store and written:
+        written = set(written)
+        this_run = table[[journal_key(m, r) in written for m, r in zip(table["model"], table["row_id"])]]
+        for name, part in this_run.groupby("model"):
+            run_id = write_run(part, name)
+            print(f"stored run {run_id} in {DEFAULT_STORE}")
+    print(summarize_runs(table, by="model").to_string(index=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
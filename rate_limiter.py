@@ -0,0 +1,157 @@
+import re
+import time
+import asyncio
+import threading
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(e):
+    for attr in ("status_code", "code"):
+        if getattr(e, attr, None) == 429:
+            return True
+    return "429" in str(e)
+
+
+def retry_after_from_error(e):
+    """Seconds the provider asked us to wait, or None if the error carries no hint.
+
+    OpenAI errors expose the HTTP response with a Retry-After header; Gemini
+    errors only mention the delay in their text ("retry_delay { seconds: 37 }"
+    or "Please retry in 37.5s").
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            try:
+                return float(headers["retry-after"])
+            except ValueError:
+                pass
+    text = str(e)
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", text)
+    if match:
+        return float(match.group(1))
+    match = re.search(r"retry in ([\d.]+)\s*s", text, re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class _Bucket:
+    # Deficit token bucket: reservations may drive the level negative, and
+    # the caller waits until the refill brings it back to zero.
+
+    def __init__(self, rate_per_s, capacity):
+        self.rate = rate_per_s
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        self.refill(now)
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+
+class AdaptiveRateLimiter:
+    """Requests-per-minute and tokens-per-minute limiter with AIMD control.
+
+    Every call takes a slot with acquire() (threads) or acquire_async()
+    (asyncio) and reports back with on_success() or on_throttle(). Requests
+    are spaced 60/rpm seconds apart. Successes raise the rate additively (by
+    default 1% of `max_rpm` per success) up to `max_rpm`; a 429 halves it and
+    holds every caller back for the provider's retry-after hint, or one
+    request interval when there is none. Callers that were already waiting
+    for a slot when the 429 arrived queue again behind the pause instead of
+    firing all at once when it ends. One instance can be shared by all
+    workers talking to the same provider.
+
+    acquire() returns the time the slot was granted; passing it back to
+    on_throttle() stops a burst of 429s from requests that were already in
+    flight from cutting the rate more than once.
+    """
+
+    def __init__(self, rpm=60, max_rpm=None, tpm=None, min_rpm=1,
+                 increase=None, decrease=0.5):
+        self.rpm = float(rpm)
+        self.max_rpm = float(max_rpm or rpm)
+        self.min_rpm = float(min_rpm)
+        self.increase = increase if increase is not None else self.max_rpm * 0.01
+        self.decrease = decrease
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.tokens = _Bucket(tpm / 60, tpm) if tpm else None
+        self.blocked_until = 0.0
+        self.block_epoch = 0
+        self.last_decrease = 0.0
+        self.successes = 0
+        self.throttles = 0
+        self.waited = 0.0
+
+    def _reserve(self, tokens):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_slot, self.blocked_until)
+            self.next_slot = start + 60 / self.rpm
+            wait = start - now
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            return wait, self.block_epoch
+
+    def _woke(self, waited, epoch):
+        with self.lock:
+            self.waited += waited
+            return self.block_epoch == epoch
+
+    def acquire(self, tokens=0):
+        wait, epoch = self._reserve(tokens)
+        while True:
+            if wait > 0:
+                time.sleep(wait)
+            if self._woke(wait, epoch):
+                return time.monotonic()
+            wait, epoch = self._reserve(0)
+
+    async def acquire_async(self, tokens=0):
+        wait, epoch = self._reserve(tokens)
+        while True:
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if self._woke(wait, epoch):
+                return time.monotonic()
+            wait, epoch = self._reserve(0)
+
+    def on_success(self, tokens_used=None, tokens_reserved=0):
+        with self.lock:
+            self.successes += 1
+            self.rpm = min(self.max_rpm, self.rpm + self.increase)
+            if self.tokens is not None and tokens_used is not None:
+                # Settle the estimate taken in acquire() against the real usage.
+                self.tokens.level -= tokens_used - tokens_reserved
+
+    def on_throttle(self, retry_after=None, granted_at=None):
+        with self.lock:
+            now = time.monotonic()
+            self.throttles += 1
+            if granted_at is None or granted_at >= self.last_decrease:
+                self.rpm = max(self.min_rpm, self.rpm * self.decrease)
+                self.last_decrease = now
+            pause = retry_after if retry_after is not None else 60 / self.rpm
+            self.blocked_until = max(self.blocked_until, now + pause)
+            self.next_slot = self.blocked_until
+            self.block_epoch += 1
+
+    def summary(self):
+        return (
+            f"rate limiter: {self.successes} ok, {self.throttles} throttled, "
+            f"now {self.rpm:.0f} rpm, {self.waited:.1f}s spent waiting"
+        )
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import math
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from evaluation import SIMILARITY_THRESHOLD
+from streaming_eval import CHUNK_ROWS, ValueCounts, evaluate_stream
+
+# Headless report stage for the analysis figures.
+#
+# figure_data() reduces an evaluation (evaluate() or streaming_eval) to the
+# small, plot-ready aggregates each figure needs: the top of the coarse
+# confusion matrix, label counts, box plot statistics of sentence length and
+# KDE curves of the edit magnitudes computed from binned histograms. Only
+# these go to the renderers, which run in worker processes on the Agg
+# backend; each worker imports matplotlib and seaborn once.
+#
+# MANIFEST_FILE in the output directory remembers the content hash of every
+# figure's aggregates (plus RENDER_VERSION), so unchanged figures are not
+# redrawn, and the aggregates of every input file by the file's SHA-256, so
+# an unchanged results file is not evaluated again either.
+
+MANIFEST_FILE = "report_manifest.json"
+# Bump when a renderer changes, so every figure is redrawn once.
+RENDER_VERSION = 1
+FIGURES = ("confusion_matrix", "length_impact", "edit_magnitude", "label_distribution")
+KDE_BINS = 512
+KDE_GRIDSIZE = 200
+KDE_CUT = 3
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def distributions(metrics):
+    """The per-row score distributions of an evaluation: streaming_eval
+    metrics carry them, evaluate() metrics have the rows to count."""
+    if "distributions" in metrics:
+        return metrics["distributions"]
+    rows = metrics["row_metrics"]
+    found = {name: ValueCounts() for name in ("sim", "change_mag_reference", "change_mag_prediction")}
+    for name, counts in found.items():
+        counts.add(rows[name])
+    found["sent_length"] = {False: ValueCounts(), True: ValueCounts()}
+    for mapped_correct, lengths in rows.groupby("mapped_correct")["sent_length"]:
+        found["sent_length"][bool(mapped_correct)].add(lengths)
+    return found
+
+
+def box_stats(counts, label, whis=1.5):
+    """matplotlib.cbook.boxplot_stats() for the counted values, for Axes.bxp().
+    Repeated outliers are drawn once."""
+    values, _ = counts.arrays()
+    if not len(values):
+        return None
+    q1, med, q3 = (counts.quantile(q) for q in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    inside = values[(values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)]
+    whislo = inside.min() if len(inside) else q1
+    whishi = inside.max() if len(inside) else q3
+    return {
+        "label": label, "med": med, "q1": q1, "q3": q3, "whislo": float(whislo), "whishi": float(whishi),
+        "mean": counts.mean(), "fliers": values[(values < whislo) | (values > whishi)].tolist(),
+    }
+
+
+def kde_curve(counts, bins=KDE_BINS, gridsize=KDE_GRIDSIZE, cut=KDE_CUT):
+    """(grid, density) of a Gaussian KDE with Scott's bandwidth, as
+    seaborn.kdeplot draws it, evaluated on a binned histogram of the values."""
+    n, std = counts.count, counts.std()
+    if n < 2 or not std > 0:
+        return None
+    values, _ = counts.arrays()
+    bandwidth = std * n ** (-1 / 5)
+    hist, edges = counts.histogram(np.linspace(min(values[0], 0.0), max(values[-1], 1.0), bins + 1))
+    centers = (edges[:-1] + edges[1:]) / 2
+    grid = np.linspace(values[0] - cut * bandwidth, values[-1] + cut * bandwidth, gridsize)
+    z = (grid[:, None] - centers[None, :]) / bandwidth
+    density = (np.exp(-0.5 * z ** 2) * hist).sum(axis=1) / (n * bandwidth * math.sqrt(2 * math.pi))
+    return grid.tolist(), density.tolist()
+
+
+def figure_data(metrics, top_confusion=15, top_labels=10):
+    """{figure: JSON-serializable aggregates} for every name in FIGURES."""
+    model = metrics["model"]
+    found = distributions(metrics)
+    confusion = metrics["confusion_matrix"]
+    true_counts = confusion.sum(axis=1)
+    pred_counts = confusion.sum(axis=0)
+
+    # Ties are broken by label, not by where the label first occurs in the file.
+    true_counts = true_counts.sort_index().sort_values(ascending=False, kind="stable")
+    pred_counts = pred_counts.sort_index().sort_values(ascending=False, kind="stable")
+    top = true_counts[true_counts > 0].head(top_confusion).index
+    frames = []
+    for label_counts, source in ((true_counts, "Ground Truth"), (pred_counts, model)):
+        label_counts = label_counts[label_counts > 0]
+        frames.append(pd.DataFrame({"Label": label_counts.index, "Count": label_counts.to_numpy(), "Source": source}))
+    counts = pd.concat(frames)
+    top_bars = counts.groupby("Label")["Count"].sum().sort_values(ascending=False).head(top_labels).index
+    counts = counts[counts["Label"].isin(top_bars)]
+
+    return {
+        "confusion_matrix": {
+            "model": model,
+            "labels": top.tolist(),
+            "matrix": confusion.loc[top, top].to_numpy().tolist(),
+        },
+        "length_impact": {
+            "model": model,
+            "boxes": [box for box in (box_stats(found["sent_length"][key], str(key)) for key in (False, True)) if box],
+        },
+        "edit_magnitude": {
+            "model": model,
+            "reference": kde_curve(found["change_mag_reference"]),
+            "prediction": kde_curve(found["change_mag_prediction"]),
+        },
+        "label_distribution": {
+            "model": model,
+            "top": top_labels,
+            "labels": counts["Label"].tolist(),
+            "counts": counts["Count"].astype(int).tolist(),
+            "sources": counts["Source"].tolist(),
+        },
+    }
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
+
+
+def render_confusion_matrix(data, path):
+    plt, sns = _pyplot()
+    labels = data["labels"]
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(np.array(data["matrix"], dtype=int), annot=True, fmt='d', cmap='Greens',
+                xticklabels=labels, yticklabels=labels)
+    plt.xlabel(f"Predicted Label ({data['model']})")
+    plt.ylabel('True Label (Ground Truth)')
+    plt.title('Confusion Matrix (Full Dataset - Mapped)')
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def render_length_impact(data, path):
+    plt, sns = _pyplot()
+    fig, ax = plt.subplots(figsize=(10, 6))
+    # Styled like sns.boxplot: desaturated fills, dark gray lines.
+    line = {"color": ".3"}
+    boxes = ax.bxp(data["boxes"], widths=0.8, patch_artist=True, showfliers=True,
+                   boxprops={"edgecolor": ".3"}, whiskerprops=line, capprops=line, medianprops=line,
+                   flierprops={"markeredgecolor": ".3"})
+    for patch, color in zip(boxes["boxes"], sns.color_palette("Set2", desat=0.75)):
+        patch.set_facecolor(color)
+    ax.set_title('Impact of Sentence Length on Classification Accuracy')
+    ax.set_xlabel('Is Prediction Correct? (False vs True)')
+    ax.set_ylabel('Sentence Length (Words)')
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render_edit_magnitude(data, path):
+    plt, sns = _pyplot()
+    from matplotlib.colors import to_rgba
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for key, label, color in (("reference", 'Ground Truth Changes', 'blue'),
+                              ("prediction", f"{data['model']} Changes", 'orange')):
+        if data[key] is None:
+            continue
+        grid, density = data[key]
+        ax.fill_between(grid, density, facecolor=to_rgba(color, 0.3), edgecolor=color, label=label)
+    ax.set_ylim(bottom=0)
+    ax.set_title('Distribution of Correction Magnitude (Human vs AI)')
+    ax.set_xlabel('Change Magnitude (0 = No Change, 1 = Complete Rewrite)')
+    ax.set_ylabel('Density')
+    ax.legend()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render_label_distribution(data, path):
+    plt, sns = _pyplot()
+    counts = pd.DataFrame({"Label": data["labels"], "Count": data["counts"], "Source": data["sources"]})
+    plt.figure(figsize=(12, 8))
+    sns.barplot(y='Label', x='Count', hue='Source', data=counts, palette='viridis')
+    plt.title(f"Top {data['top']} Error Types: Ground Truth vs {data['model']} Distribution")
+    plt.xlabel('Count')
+    plt.ylabel('Error Type')
+    plt.legend(title='Source')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+RENDERERS = {
+    "confusion_matrix": render_confusion_matrix,
+    "length_impact": render_length_impact,
+    "edit_magnitude": render_edit_magnitude,
+    "label_distribution": render_label_distribution,
+}
+
+
+def _render(job):
+    path, figure, data = job
+    RENDERERS[figure](data, path)
+    return path
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"figures": {}, "inputs": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def render_figures(jobs, out_dir, workers=None, force=False, manifest=None):
+    """Render (filename, figure, data) jobs into out_dir, skipping figures
+    whose data hash matches the manifest and whose file exists. Returns
+    (rendered paths, skipped paths)."""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = manifest or load_manifest(out_dir)
+    todo, skipped = [], []
+    for filename, figure, data in jobs:
+        path = os.path.join(out_dir, filename)
+        digest = _digest({"figure": figure, "version": RENDER_VERSION, "data": data})
+        if not force and manifest["figures"].get(filename) == digest and os.path.exists(path):
+            skipped.append(path)
+        else:
+            todo.append(((path, figure, data), filename, digest))
+
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    if workers <= 1:
+        rendered = [_render(job) for job, _, _ in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(_render, [job for job, _, _ in todo]))
+    for _, filename, digest in todo:
+        manifest["figures"][filename] = digest
+    save_manifest(out_dir, manifest)
+    return rendered, skipped
+
+
+def source_data(path, manifest, threshold=SIMILARITY_THRESHOLD, chunksize=CHUNK_ROWS, workers=None):
+    """figure_data() for a results file, from the manifest if the file's
+    content and the threshold are unchanged, else by streaming it."""
+    key = os.path.abspath(path)
+    sha256 = file_sha256(path)
+    cached = manifest["inputs"].get(key)
+    if cached and cached["sha256"] == sha256 and cached["threshold"] == threshold \
+            and cached["version"] == RENDER_VERSION:
+        return cached["figures"]
+    figures = figure_data(evaluate_stream(path, threshold, chunksize, workers))
+    manifest["inputs"][key] = {"sha256": sha256, "threshold": threshold, "version": RENDER_VERSION,
+                               "figures": figures}
+    return figures
+
+
+def render_report(paths, out_dir, figures=FIGURES, filenames=None, threshold=SIMILARITY_THRESHOLD,
+                  chunksize=CHUNK_ROWS, workers=None, force=False):
+    """Render `figures` for every results file in `paths` into out_dir.
+    `filenames` maps a figure to its file name; "{stem}" is replaced by the
+    results file's name without extension (default "{stem}_{figure}.png")."""
+    manifest = load_manifest(out_dir) if os.path.isdir(out_dir) else {"figures": {}, "inputs": {}}
+    jobs = []
+    for path in paths:
+        data = source_data(path, manifest, threshold, chunksize, workers)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for figure in figures:
+            template = (filenames or {}).get(figure, "{stem}_" + figure + ".png")
+            jobs.append((template.format(stem=stem), figure, data[figure]))
+    return render_figures(jobs, out_dir, workers, force, manifest)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the analysis figures for one or more results files.")
+    parser.add_argument("files", nargs="+", help="results CSV files")
+    parser.add_argument("--out", default="figures", help="output directory")
+    parser.add_argument("--figures", nargs="+", choices=FIGURES, default=list(FIGURES))
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="rows per evaluation chunk")
+    parser.add_argument("--workers", type=int, help="processes for evaluation and rendering (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="redraw figures even if their data is unchanged")
+    args = parser.parse_args(argv)
+
+    missing = [path for path in args.files if not os.path.exists(path)]
+    for path in missing:
+        print(f"Error: File not found {path}")
+    paths = [path for path in args.files if path not in missing]
+    rendered, skipped = render_report(paths, args.out, args.figures, threshold=args.threshold,
+                                      chunksize=args.chunksize, workers=args.workers, force=args.force)
+    for path in rendered:
+        print(f"Saved {path}")
+    print(f"{len(rendered)} figures rendered, {len(skipped)} unchanged in {args.out}")
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Writes (inserts and last-used updates of hits) are committed in groups of
+# this many operations, and on close().
+COMMIT_EVERY = 200
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def prompt_fingerprint(prompt, labels):
+    """Identifies the prompt revision; any edit to the prompt text or the label list changes it."""
+    return _digest(prompt, list(labels))
+
+
+class ResponseCache:
+    """On-disk cache of model answers keyed by
+    (provider, model, system prompt, temperature, sentence).
+
+    The system prompt is part of the key, so answers cached under an earlier
+    prompt revision are simply never looked up again; they stay until LRU
+    eviction ages them out, and switching back to that revision finds them.
+    Once the stored values exceed `max_bytes`, the least recently used
+    entries are evicted.
+
+    Lookups and inserts are synchronous; async callers use get_async() and
+    put_async(), which run them in a worker thread.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL with synchronous=NORMAL does not fsync on every commit.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+        """)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(entries)")]
+        if "namespace" in columns:
+            # Caches written before the key alone identified the prompt revision.
+            self.db.executescript("""
+                DROP INDEX IF EXISTS entries_namespace;
+                ALTER TABLE entries DROP COLUMN namespace;
+                DROP TABLE IF EXISTS namespaces;
+            """)
+        self.db.commit()
+        # Running total of the stored bytes; recounted only when it crosses the budget.
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        # key -> last_used of the hits since the last commit.
+        self.touched = {}
+        self.pending = 0
+
+    def make_key(self, provider, model, system_prompt, temperature, sentence):
+        return _digest(provider, model, system_prompt, temperature, sentence)
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.touched[key] = time.time()
+            self._written()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+            self._written()
+
+    async def get_async(self, key):
+        return await asyncio.to_thread(self.get, key)
+
+    async def put_async(self, key, value):
+        await asyncio.to_thread(self.put, key, value)
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self._commit()
+
+    def _commit(self):
+        if self.touched:
+            self.db.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self.touched.items()],
+            )
+            self.touched.clear()
+        self.db.commit()
+        self.pending = 0
+
+    def _evict(self):
+        # The running total counts replaced entries twice; recount before evicting.
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if self.size <= self.max_bytes:
+            return
+        self._commit()
+        # Trim to 90% of the budget so eviction doesn't run on every insert.
+        target = self.max_bytes * 0.9
+        victims = []
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if self.size <= target:
+                break
+            victims.append((key,))
+            self.size -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"cache {self.path}: {self.hits} hits, {self.misses} misses "
+            f"({rate:.1%} hit rate), {self.evictions} evicted"
+        )
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.db.close()
@@ -0,0 +1,93 @@
+import os
+import json
+
+
+class ResultJournal:
+    """Append-only JSONL log of per-row results.
+
+    Every record is flushed as soon as it is written and fsync'ed every
+    `fsync_every` records (and on close), so a crash loses at most the last
+    unsynced batch instead of the whole run.
+    """
+
+    def __init__(self, path, fsync_every=50):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        self.file = open(path, "a", encoding="utf-8")
+        if self.file.tell() > 0 and not _ends_with_newline(path):
+            # Terminate a line torn by a previous crash so it stays isolated.
+            self.file.write("\n")
+
+    def append(self, row_id, **fields):
+        if hasattr(row_id, "item"):
+            row_id = row_id.item()
+        record = {"id": row_id, **fields}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def load_journal(path):
+    """Return {row_id: record} from a journal, later records winning.
+    A torn last line left by a crash is ignored."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["id"]] = record
+    return records
+
+
+def completed_ids(records, field):
+    """Row ids whose `field` holds a real answer rather than an "Error: ..." marker."""
+    return {
+        row_id for row_id, record in records.items()
+        if not str(record.get(field, "")).startswith("Error:")
+    }
+
+
+def compact(df, journal_path, output_path, id_col, columns):
+    """Materialize the journal into `output_path` in one write.
+
+    `columns` maps journal fields to output column names. The file is written
+    next to the target and renamed into place so readers never see a partial CSV.
+    """
+    records = load_journal(journal_path)
+    out = df.copy()
+    for field, column in columns.items():
+        out[column] = out[id_col].map(
+            {row_id: record.get(field) for row_id, record in records.items()}
+        )
+    tmp_path = output_path + ".tmp"
+    out.to_csv(tmp_path, index=False, encoding="utf-8")
+    os.replace(tmp_path, output_path)
+    return out
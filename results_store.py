@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import time
+import argparse
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from evaluation import RESULT_COLUMNS, OPTIONAL_RESULT_COLUMNS, load_results
+
+# Columnar history of labeling runs.
+#
+# Every run is one Parquet file under the store directory, written in a
+# single rename so readers never see half a run. All files share SCHEMA;
+# labels, models and run ids are dictionary-encoded, so reading just the
+# label columns of a large multi-model history touches a few integer pages
+# instead of parsing every CSV field.
+
+DEFAULT_STORE = os.getenv("RESULTS_STORE", "results_store")
+
+SCHEMA = pa.schema([
+    ("run_id", pa.dictionary(pa.int32(), pa.string())),
+    ("model", pa.dictionary(pa.int32(), pa.string())),
+    ("row_id", pa.int64()),
+    ("true_label", pa.dictionary(pa.int32(), pa.string())),
+    ("pred_label", pa.dictionary(pa.int32(), pa.string())),
+    ("source", pa.string()),
+    ("reference", pa.string()),
+    ("prediction", pa.string()),
+    ("latency_s", pa.float64()),
+    ("input_tokens", pa.int64()),
+    ("output_tokens", pa.int64()),
+    ("tier", pa.dictionary(pa.int32(), pa.string())),
+])
+
+LABEL_COLUMNS = ["run_id", "model", "row_id", "true_label", "pred_label"]
+OPTIONAL_COLUMNS = ["latency_s", "input_tokens", "output_tokens", "tier"]
+
+
+def new_run_id(model):
+    return f"{time.strftime('%Y%m%dT%H%M%S')}_{re.sub(r'[^A-Za-z0-9.-]+', '-', model).strip('-')}"
+
+
+def write_run(df, model, columns=None, run_id=None, root=DEFAULT_STORE):
+    """Store one run's rows and return its run id.
+
+    `columns` renames `df` into RESULT_COLUMNS (e.g. evaluation.GPT_COLUMNS).
+    latency_s/input_tokens/output_tokens/tier are optional; missing ones are null.
+    Raises ValueError if a required column is missing, and pyarrow's
+    ArrowInvalid/ArrowTypeError if a value does not fit the schema.
+    """
+    df = df.rename(columns=columns or {})
+    missing = [c for c in RESULT_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"results are missing columns: {missing}")
+
+    run_id = run_id or new_run_id(model)
+    data = {"run_id": [run_id] * len(df), "model": [model] * len(df)}
+    for column in RESULT_COLUMNS + OPTIONAL_COLUMNS:
+        values = df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+        data[column] = values.astype(object).where(values.notna(), None).tolist()
+    table = pa.Table.from_pydict(data, schema=SCHEMA)
+
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"{run_id}.parquet")
+    if os.path.exists(path):
+        raise ValueError(f"run {run_id} is already stored in {root}")
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return run_id
+
+
+def _dataset(root):
+    return ds.dataset(root, format="parquet", schema=SCHEMA, exclude_invalid_files=True)
+
+
+def read_results(root=DEFAULT_STORE, columns=None, runs=None, models=None):
+    """Rows of every stored run as a DataFrame; dictionary columns come back
+    as pandas categoricals. Only `columns` are read, and only the files whose
+    run/model match the filters are scanned."""
+    expr = None
+    for field, values in (("run_id", runs), ("model", models)):
+        if values is not None:
+            cond = ds.field(field).isin(list(values))
+            expr = cond if expr is None else expr & cond
+    return _dataset(root).to_table(columns=columns, filter=expr).to_pandas()
+
+
+def list_runs(root=DEFAULT_STORE):
+    """One row per run: run id, model and row count."""
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=["run_id", "model", "rows"])
+    df = read_results(root, columns=["run_id", "model"])
+    return (
+        df.groupby(["run_id", "model"], observed=True).size()
+        .rename("rows").reset_index()
+    )
+
+
+def load_run(run_id, root=DEFAULT_STORE):
+    """A stored run in evaluation's RESULT_COLUMNS layout, ready for evaluate()."""
+    df = read_results(root, runs=[run_id])
+    if df.empty:
+        raise KeyError(f"no run {run_id} in {root}")
+    out = df[RESULT_COLUMNS + OPTIONAL_RESULT_COLUMNS].astype({"true_label": object, "pred_label": object, "tier": object})
+    out.attrs["model"] = str(df["model"].iloc[0])
+    out.attrs["path"] = f"{root}/{run_id}"
+    return out
+
+
+def import_csv(path, model=None, run_id=None, root=DEFAULT_STORE):
+    """Store an existing results CSV (any layout load_results reads) as one run."""
+    df = load_results(path)
+    model = model or df.attrs["model"]
+    run_id = run_id or f"import_{re.sub(r'[^A-Za-z0-9.-]+', '-', os.path.splitext(os.path.basename(path))[0])}"
+    return write_run(df, model, run_id=run_id, root=root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar store of labeling runs.")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="import results CSVs, one run per file")
+    importer.add_argument("files", nargs="+")
+    importer.add_argument("--model", help="model name (default: GPT/Gemini from the file layout)")
+    commands.add_parser("runs", help="list stored runs")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        for path in args.files:
+            run_id = import_csv(path, args.model, root=args.store)
+            print(f"imported {path} as {run_id}")
+    else:
+        print(list_runs(args.store).to_string(index=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import os
+import re
+import sys
+import json
+import argparse
+
+from sharding import in_shard
+
+# Cheap deterministic detectors that run before the paid model call.
+#
+# Each detector looks for one surface pattern and, when it fires, returns the
+# label it implies and a locally fixed sentence. A detector's confidence is
+# not part of its code: `python rule_cascade.py --calibrate results.csv`
+# measures it as the share of the rows it fires on where both its label and
+# its correction are right, on the calibration half of the rows
+# (CALIBRATION_SHARD, split by row id), and reports the cascade on the other
+# half. Corrections are compared with the reference case-sensitively (only
+# whitespace is normalized): a rule answer replaces the model's whole
+# answer, so a wrong fix costs as much as a wrong label. The measured
+# confidences are kept in RULE_CONFIDENCE_FILE; a detector that fired on
+# fewer than RULE_MIN_SUPPORT calibration rows gets none. Rows whose most confident firing detector
+# reaches RULE_MIN_CONFIDENCE are answered locally and tagged with the
+# detector's tier ("rules:<name>"); every other row is sent to the model and
+# tagged LLM_TIER.
+
+RULE_MIN_CONFIDENCE = float(os.getenv("RULE_MIN_CONFIDENCE", "0.9"))
+RULE_MIN_SUPPORT = int(os.getenv("RULE_MIN_SUPPORT", "5"))
+RULE_CONFIDENCE_FILE = os.getenv(
+    "RULE_CONFIDENCE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rule_confidence.json")
+)
+# Shard (index, count) of the row ids the confidences are measured on; the
+# other shards are held out.
+CALIBRATION_SHARD = (0, 2)
+LLM_TIER = "llm"
+
+CONTRACTIONS = {
+    "dont": "don't", "cant": "can't", "wont": "won't", "isnt": "isn't", "arent": "aren't",
+    "wasnt": "wasn't", "werent": "weren't", "didnt": "didn't", "doesnt": "doesn't",
+    "couldnt": "couldn't", "shouldnt": "shouldn't", "wouldnt": "wouldn't", "havent": "haven't",
+    "hasnt": "hasn't", "youre": "you're", "theyre": "they're", "im": "I'm", "ive": "I've",
+}
+
+BAD_POSSESSIVES = {
+    "their's": "theirs", "your's": "yours", "her's": "hers", "our's": "ours", "which's": "which is",
+}
+
+
+def _word_pattern(words):
+    return re.compile(r"\b(" + "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True)) + r")\b",
+                      re.IGNORECASE)
+
+
+def _replace_words(sentence, pattern, table):
+    def fix(match):
+        word = match.group(0)
+        replacement = table[word.lower()]
+        return replacement[0].upper() + replacement[1:] if word[0].isupper() else replacement
+    return pattern.sub(fix, sentence)
+
+
+_CONTRACTION_RE = _word_pattern(CONTRACTIONS)
+_POSSESSIVE_RE = _word_pattern(BAD_POSSESSIVES)
+_LOWERCASE_I_RE = re.compile(r"(?<![^\s\"“‘(])i(?=[\s'’,.!?]|$)")
+
+
+def detect_capitalization(sentence):
+    # Only fixes the first letter and a standalone "i"; proper nouns inside
+    # the sentence stay lowercase, which calibration counts against it.
+    if re.match(r"^[a-z]", sentence) or _LOWERCASE_I_RE.search(sentence):
+        fixed = _LOWERCASE_I_RE.sub("I", sentence)
+        return "Capitalization Errors", fixed[:1].upper() + fixed[1:]
+
+
+def detect_bad_possessives(sentence):
+    """Possessive pronouns written with an apostrophe ("their's")."""
+    if _POSSESSIVE_RE.search(sentence):
+        return "Contractions Errors", _replace_words(sentence, _POSSESSIVE_RE, BAD_POSSESSIVES)
+
+
+def detect_missing_apostrophes(sentence):
+    """Contractions written without their apostrophe ("dont")."""
+    if _CONTRACTION_RE.search(sentence):
+        return "Punctuation Errors", _replace_words(sentence, _CONTRACTION_RE, CONTRACTIONS)
+
+
+DETECTORS = [
+    ("capitalization", detect_capitalization),
+    ("bad_possessives", detect_bad_possessives),
+    ("missing_apostrophes", detect_missing_apostrophes),
+]
+
+
+def load_confidence(path=RULE_CONFIDENCE_FILE):
+    """{detector name: confidence} from a calibration file; {} (no detector
+    answers) when there is none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            calibration = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {name: entry["confidence"] for name, entry in calibration["detectors"].items()
+            if entry["confidence"] is not None}
+
+
+CONFIDENCE = load_confidence()
+
+
+def classify(sentence, min_confidence=RULE_MIN_CONFIDENCE, confidence=None):
+    """(tier, label, correction) from the most confident detector that fires
+    on the sentence, if its confidence is at least `min_confidence`; else None."""
+    confidence = CONFIDENCE if confidence is None else confidence
+    sentence = str(sentence)
+    best = None
+    for name, detector in DETECTORS:
+        score = confidence.get(name)
+        if score is None or score < min_confidence:
+            continue
+        answer = detector(sentence)
+        if answer is not None and (best is None or score > best[0]):
+            best = (score, f"rules:{name}", *answer)
+    return best[1:] if best is not None else None
+
+
+def split_rows(items, min_confidence=RULE_MIN_CONFIDENCE, confidence=None):
+    """Split (row_id, sentence) pairs into ({row_id: (tier, label, correction)}
+    answered locally, [(row_id, sentence)] left for the model)."""
+    answered, remaining = {}, []
+    for row_id, sentence in items:
+        answer = classify(sentence, min_confidence, confidence)
+        if answer is None:
+            remaining.append((row_id, sentence))
+        else:
+            answered[row_id] = answer
+    return answered, remaining
+
+
+def simulate(df, min_confidence=RULE_MIN_CONFIDENCE, confidence=None):
+    """A results frame (evaluation.load_results layout) as it would have come
+    out with the cascade in front: rule answers replace the model's on the
+    rows the rules take, and every row gets its tier."""
+    answered, _ = split_rows(zip(df.index, df["source"]), min_confidence, confidence)
+    out = df.copy()
+    out["tier"] = LLM_TIER
+    for i, (tier, label, correction) in answered.items():
+        out.loc[i, ["tier", "pred_label", "prediction"]] = [tier, label, correction]
+    return out
+
+
+def _same_text(a, b):
+    return " ".join(str(a).split()) == " ".join(str(b).split())
+
+
+def calibrate(df, min_support=RULE_MIN_SUPPORT):
+    """{detector: {"fired", "label_correct", "correct", "confidence"}} over
+    the rows of `df` (evaluation.load_results layout): how often each detector
+    fires, how often its label is the true one, and how often its correction
+    also matches the reference exactly. The confidence is the share of
+    firings with both right, or None below `min_support` firings."""
+    detectors = {}
+    for name, detector in DETECTORS:
+        fired = label_correct = correct = 0
+        for sentence, true_label, reference in zip(df["source"], df["true_label"], df["reference"]):
+            answer = detector(str(sentence))
+            if answer is not None:
+                fired += 1
+                label_correct += answer[0] == true_label
+                correct += answer[0] == true_label and _same_text(answer[1], reference)
+        detectors[name] = {
+            "fired": fired, "label_correct": label_correct, "correct": correct,
+            "confidence": round(correct / fired, 4) if fired and fired >= min_support else None,
+        }
+    return detectors
+
+
+def save_calibration(df, path=RULE_CONFIDENCE_FILE, min_support=RULE_MIN_SUPPORT):
+    """Calibrate on the CALIBRATION_SHARD rows of `df`, write `path` and
+    return (calibration, held-out rows)."""
+    mask = in_shard(df["row_id"], *CALIBRATION_SHARD)
+    calibration = {
+        "source": df.attrs.get("path"),
+        "shard": list(CALIBRATION_SHARD),
+        "rows": int(sum(mask)),
+        "min_support": min_support,
+        "detectors": calibrate(df[mask], min_support),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=2)
+        f.write("\n")
+    return calibration, df[[not m for m in mask]]
+
+
+def main(argv=None):
+    from evaluation import load_results, tier_report
+
+    parser = argparse.ArgumentParser(
+        description="Replay the rule cascade over a results file and report the per-tier trade-off."
+    )
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--min-confidence", type=float, default=RULE_MIN_CONFIDENCE)
+    parser.add_argument("--errant", action="store_true", help="also compute ERRANT F0.5 per tier")
+    parser.add_argument("--calibrate", action="store_true",
+                        help=f"measure the detectors' confidence on half of the rows, write {RULE_CONFIDENCE_FILE} "
+                             "and replay the cascade on the held-out half")
+    args = parser.parse_args(argv)
+    if args.calibrate and len(args.files) != 1:
+        parser.error("--calibrate takes one results file")
+
+    confidence = None
+    for path in args.files:
+        df = load_results(path)
+        model = df.attrs["model"]
+        if args.calibrate:
+            calibration, df = save_calibration(df)
+            held_out = calibrate(df, min_support=0)
+            print(f"=== Calibrated on {calibration['rows']} rows of {path}, wrote {RULE_CONFIDENCE_FILE} ===")
+            print(f"{'detector':<21}{'fired':>7}{'label ok':>10}{'fix ok':>8}{'confidence':>12}{'held-out':>10}")
+            for name, entry in calibration["detectors"].items():
+                measured = "-" if entry["confidence"] is None else f"{entry['confidence']:.3f}"
+                check = f"{held_out[name]['correct']}/{held_out[name]['fired']}"
+                print(f"{name:<21}{entry['fired']:>7}{entry['label_correct']:>10}{entry['correct']:>8}"
+                      f"{measured:>12}{check:>10}")
+            print()
+            confidence = {name: entry["confidence"] for name, entry in calibration["detectors"].items()
+                          if entry["confidence"] is not None}
+            path = f"{path} (held-out half, {len(df)} rows)"
+        replayed = simulate(df, args.min_confidence, confidence)
+        print(f"=== {model}: {path} with rules at confidence >= {args.min_confidence} ===")
+        print(tier_report(replayed, errant=args.errant).to_string())
+        print(f"\n--- {model} alone on the rows the rules took ---")
+        print(tier_report(df.assign(tier=replayed["tier"].where(replayed["tier"] == LLM_TIER, "rules (model answer)")),
+                          errant=args.errant).to_string())
+        print()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
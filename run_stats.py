@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from collections import defaultdict
+
+DEFAULT_HISTORY_PATH = "run_stats.jsonl"
+
+
+class RunStats:
+    """Row, request and token counters for one labeling run. Safe to update
+    from several worker threads. cached_tokens counts the input tokens the
+    provider served from its prompt cache; `phases` adds up the seconds
+    spent in each phase() (e.g. "io", "parse") over all workers; `truncated`
+    counts answers cut off by their output token budget."""
+
+    def __init__(self, pipeline, mode):
+        self.pipeline = pipeline
+        self.mode = mode
+        self.rows = 0
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.request_seconds = 0.0
+        self.timed_requests = 0
+        self.errors = 0
+        self.truncated = 0
+        self.phases = defaultdict(float)
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.lock = threading.Lock()
+
+    def record_request(self, input_tokens=0, output_tokens=0, cached_tokens=0, seconds=None,
+                       ttfb=None, attempt=0):
+        """One successful API call; `ttfb` (time to the response headers) and
+        `attempt` (0 for the first try) are kept by telemetry.Telemetry."""
+        with self.lock:
+            self.requests += 1
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+            self.cached_tokens += cached_tokens or 0
+            if seconds is not None:
+                self.request_seconds += seconds
+                self.timed_requests += 1
+
+    def record_error(self, error, seconds=None, attempt=0):
+        """One API call that raised `error` (it may be retried)."""
+        with self.lock:
+            self.errors += 1
+
+    def record_truncation(self):
+        """One answer cut off at its output token limit."""
+        with self.lock:
+            self.truncated += 1
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_rows(self, n=1):
+        with self.lock:
+            self.rows += n
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        rows = max(self.rows, 1)
+        return {
+            "pipeline": self.pipeline,
+            "mode": self.mode,
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "rows": self.rows,
+            "requests": self.requests,
+            "errors": self.errors,
+            "truncated": self.truncated,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_share": round(self.cached_tokens / self.input_tokens, 3) if self.input_tokens else 0.0,
+            "mean_request_s": round(self.request_seconds / self.timed_requests, 3) if self.timed_requests else None,
+            "elapsed_s": round(elapsed, 3),
+            "tokens_per_row": round((self.input_tokens + self.output_tokens) / rows, 1),
+            "output_tokens_per_row": round(self.output_tokens / rows, 1),
+            "rows_per_s": round(self.rows / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+def phase(stats, name):
+    """stats.phase(name), or a no-op when there are no stats."""
+    return stats.phase(name) if stats is not None else contextlib.nullcontext()
+
+
+def save_run(stats, path=DEFAULT_HISTORY_PATH):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(stats.as_dict()) + "\n")
+
+
+def load_runs(path=DEFAULT_HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def format_comparison(runs, pipeline):
+    """Table of the latest run per mode for `pipeline`, e.g. single vs batch=20."""
+    latest = {}
+    for run in runs:
+        if run["pipeline"] == pipeline and run["rows"]:
+            latest[run["mode"]] = run
+    if not latest:
+        return f"No recorded runs for {pipeline}."
+    width = max(12, max(len(mode) for mode in latest) + 2)
+    lines = [
+        f"{'mode':<{width}}{'rows':>8}{'requests':>10}{'tokens/row':>12}{'output/row':>12}"
+        f"{'cached':>8}{'s/request':>11}{'rows/s':>10}"
+    ]
+    for mode, run in sorted(latest.items()):
+        # Runs recorded before these fields existed.
+        output_per_row = run.get("output_tokens_per_row", round(run["output_tokens"] / run["rows"], 1))
+        cached = f"{run.get('cached_share', 0.0):.0%}"
+        latency = run.get("mean_request_s")
+        lines.append(
+            f"{mode:<{width}}{run['rows']:>8}{run['requests']:>10}"
+            f"{run['tokens_per_row']:>12}{output_per_row:>12}"
+            f"{cached:>8}{latency if latency is not None else '-':>11}{run['rows_per_s']:>10}"
+        )
+    return "\n".join(lines)
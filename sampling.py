@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+# Label a stratified sample in rounds and stop once the accuracy estimate is
+# precise enough.
+#
+# stratified_order() puts the rows in one seeded order in which every prefix
+# holds each stratum (error type) in close to its share of the dataset, so
+# round k simply labels the next rows of that order. After each round,
+# estimate_accuracy() weights the per-type accuracies by the types' shares
+# of the dataset; the run stops when the half-width of its confidence
+# interval reaches the target. The interval is not corrected for looking
+# at it after every round, so pick a target a little tighter than needed.
+
+Z_95 = 1.959964
+
+
+def wilson_interval(successes, n, z=Z_95):
+    """(low, high) Wilson score interval for successes out of n; arrays work too."""
+    successes = np.asarray(successes, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = successes / n
+        denominator = 1 + z ** 2 / n
+        center = (p + z ** 2 / (2 * n)) / denominator
+        margin = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denominator
+    return np.clip(center - margin, 0, 1), np.clip(center + margin, 0, 1)
+
+
+def stratified_order(strata, seed=0):
+    """Positions of `strata` ordered so that every prefix is (up to one row
+    per stratum) a proportional stratified sample.
+
+    Rows are shuffled within their stratum; the i-th of a stratum's n rows
+    is placed at (i + u) / n, with u uniform per stratum, and the rows are
+    sorted by that position.
+    """
+    strata = pd.Series(np.asarray(strata))
+    rng = np.random.default_rng(seed)
+    codes, uniques = pd.factorize(strata)
+    shuffled = rng.permutation(len(strata))
+    rank = pd.Series(codes[shuffled]).groupby(codes[shuffled]).cumcount().to_numpy()
+    sizes = np.bincount(codes)
+    offsets = rng.random(len(uniques))
+    keys = np.empty(len(strata))
+    keys[shuffled] = (rank + offsets[codes[shuffled]]) / sizes[codes[shuffled]]
+    return np.argsort(keys, kind="stable")
+
+
+class AccuracyEstimate:
+    """Stratified accuracy of a labeled sample.
+
+    `per_type` has one row per sampled type: rows labeled, rows in the
+    dataset, accuracy and its Wilson interval. `accuracy` weights those
+    accuracies by the types' dataset shares (renormalized over the sampled
+    types); `half_width` is the half-width of its normal interval, using
+    Agresti-Coull adjusted per-type rates so a type with all rows right (or
+    wrong) still adds variance, and the finite population correction.
+    """
+
+    def __init__(self, per_type, accuracy, half_width, rows, population):
+        self.per_type = per_type
+        self.accuracy = accuracy
+        self.half_width = half_width
+        self.rows = rows
+        self.population = population
+
+    @property
+    def interval(self):
+        return max(0.0, self.accuracy - self.half_width), min(1.0, self.accuracy + self.half_width)
+
+    def summary(self):
+        low, high = self.interval
+        return (
+            f"{self.rows} rows ({self.rows / self.population:.1%} of {self.population}), "
+            f"accuracy {self.accuracy:.3f} ± {self.half_width:.3f} (95% CI {low:.3f}-{high:.3f})"
+        )
+
+    def format_per_type(self):
+        lines = [f"{'Error Type':<45}{'rows':>6}{'of':>6}{'accuracy':>10}{'95% CI':>16}"]
+        for label, row in self.per_type.sort_values("accuracy", ascending=False).iterrows():
+            lines.append(
+                f"{str(label)[:44]:<45}{int(row['n']):>6}{int(row['N']):>6}{row['accuracy']:>10.3f}"
+                f"{row['low']:>8.3f}-{row['high']:.3f}"
+            )
+        return "\n".join(lines)
+
+
+def estimate_accuracy(strata, correct, population_sizes, z=Z_95):
+    """AccuracyEstimate for labeled rows with stratum `strata` and boolean
+    `correct`; `population_sizes` maps each stratum to its size in the dataset."""
+    population_sizes = pd.Series(population_sizes)
+    sample = pd.DataFrame({"stratum": np.asarray(strata), "correct": np.asarray(correct, dtype=bool)})
+    per_type = sample.groupby("stratum")["correct"].agg(n="size", x="sum")
+    per_type["N"] = population_sizes.reindex(per_type.index).fillna(per_type["n"]).to_numpy()
+    per_type["accuracy"] = per_type["x"] / per_type["n"]
+    per_type["low"], per_type["high"] = wilson_interval(per_type["x"], per_type["n"], z)
+
+    weights = per_type["N"] / per_type["N"].sum()
+    accuracy = float((weights * per_type["accuracy"]).sum())
+    adjusted = (per_type["x"] + z ** 2 / 2) / (per_type["n"] + z ** 2)
+    fpc = (1 - per_type["n"] / per_type["N"]).clip(lower=0)
+    variance = float((weights ** 2 * adjusted * (1 - adjusted) / per_type["n"] * fpc).sum())
+    return AccuracyEstimate(per_type, accuracy, z * variance ** 0.5, len(sample), int(population_sizes.sum()))
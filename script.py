@@ -1,95 +1,484 @@
 import os
-import time
 import json
-import glob
+import time
+import asyncio
+import functools
 import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
+
+from async_engine import run_concurrent
+from result_journal import ResultJournal, load_journal, completed_ids, compact
+from response_cache import ResponseCache, prompt_fingerprint
+from labels import OFFICIAL_ERROR_TYPES
+from compact_output import OPENAI_RESPONSE_FORMAT, numbered_labels, output_budget, parse_compact
+from label_matcher import LabelMatcher
+from rule_cascade import split_rows, LLM_TIER
+from dedup import plan_dedup
+from batching import chunked, build_batch_input, parse_batch_response
+from run_stats import save_run, load_runs, format_comparison, phase
+from telemetry import Telemetry, ttfb_hooks, request_timing
+from results_store import write_run, DEFAULT_STORE
+from evaluation import GPT_COLUMNS
+from rate_limiter import AdaptiveRateLimiter, estimate_tokens, is_rate_limit_error, retry_after_from_error
+from batch_api import (
+    write_jsonl, load_job, save_job, openai_requests,
+    submit_openai_batch, wait_for_openai_batch, read_openai_results,
+)
 
 load_dotenv()
-api_key = os.getenv("API_KEY")
-client = OpenAI(api_key=api_key)
 
 read_file_path = "Grammar_Correction.csv"
 output_path = "Grammar_Correction_with_GPT.csv"
-df = pd.read_csv(read_file_path)
+journal_path = "Grammar_Correction_with_GPT.journal.jsonl"
+id_col = "Serial Number"
+model = "gpt-4o-mini"
+temperature = 0
+output_columns = {
+    "error_type": "GPT_Error_Type",
+    "corrected_sentence": "GPT_Correction",
+    "tier": "GPT_Tier",
+    "output_tokens": "GPT_Output_Tokens",
+    "input_tokens": "GPT_Input_Tokens",
+    "latency_s": "GPT_Latency_S",
+}
+
+# Answer rows the local rule detectors are sure about (rule_cascade.py)
+# without calling the API.
+use_rules = os.getenv("GPT_USE_RULES", "1") == "1"
+
+# Rows whose sentences match after normalization ("normalized": whitespace,
+# case, trailing punctuation; "near": also MinHash near-duplicates) share
+# one request. "off" sends every row.
+dedup_mode = os.getenv("GPT_DEDUP", "normalized")
+
+# Ask for {"i": <label number>, "c": "<correction>"} enforced by a strict JSON
+# schema, with max_tokens capped per row (compact_output.py), instead of the
+# verbose JSON with the label text. Applies to one-sentence requests and to the
+# Batch API; batched prompts keep their format.
+use_compact_output = os.getenv("GPT_COMPACT", "0") == "1"
+
+# OpenAI caches prompt prefixes of 1024+ tokens automatically; the system
+# prompt is sent first and never varies, so every request shares that prefix.
+# A prompt_cache_key routes requests with the same prefix to the same cache.
+use_prompt_cache_key = os.getenv("GPT_PROMPT_CACHE_KEY", "1") == "1"
+
+# Number of requests kept in flight at once. The OpenAI client honours
+# OPENAI_BASE_URL, so the same run can be pointed at mock_llm_server.py.
+default_concurrency = int(os.getenv("GPT_CONCURRENCY", "16"))
+
+# Sentences packed into one request. 1 keeps the original one-sentence prompt.
+default_batch_size = int(os.getenv("GPT_BATCH_SIZE", "1"))
 
-prompt = (
+# Account limits for the model. The limiter starts at half of max_rpm and
+# adapts: it speeds up while calls succeed and backs off on 429s.
+max_rpm = int(os.getenv("GPT_MAX_RPM", "500"))
+max_tpm = int(os.getenv("GPT_MAX_TPM", "200000"))
+max_attempts = 6
+
+# Answers whose label cannot be matched to an official one are asked again
+# this many times; near-misses ("Spelling", "Article Errors") are repaired
+# locally instead.
+max_label_retries = 1
+label_matcher = LabelMatcher()
+
+# Submit the remaining rows as one OpenAI Batch API job (about half the price,
+# results within 24h) instead of calling the chat endpoint row by row.
+use_batch_api = os.getenv("GPT_USE_BATCH_API", "0") == "1"
+batch_requests_path = "Grammar_Correction_with_GPT.batch_requests.jsonl"
+batch_job_path = "Grammar_Correction_with_GPT.batch_job.json"
+batch_poll_interval = int(os.getenv("GPT_BATCH_POLL_INTERVAL", "30"))
+
+instructions = (
     "You are a professional English teacher grading students' sentences.\n"
     "Each input sentence contains exactly one main grammar or usage error "
     "(it may also include a spelling mistake).\n\n"
     "Your tasks:\n"
     "1) Identify the single most appropriate error type from the following 36 labels "
     "(copy the label text exactly):\n"
-    "   - Capitalization Errors\n"
-    "   - Preposition Usage\n"
-    "   - Infinitive Errors\n"
-    "   - Faulty Comparisons\n"
-    "   - Mixed Conditionals\n"
-    "   - Contractions Errors\n"
-    "   - Incorrect Auxiliaries\n"
-    "   - Clichés\n"
-    "   - Ambiguity\n"
-    "   - Relative Clause Errors\n"
-    "   - Conjunction Misuse\n"
-    "   - Verb Tense Errors\n"
-    "   - Ellipsis Errors\n"
-    "   - Quantifier Errors\n"
-    "   - Spelling Mistakes\n"
-    "   - Passive Voice Overuse\n"
-    "   - Agreement in Comparative and Superlative Forms\n"
-    "   - Lack of Parallelism in Lists or Series\n"
-    "   - Abbreviation Errors\n"
-    "   - Modifiers Misplacement\n"
-    "   - Punctuation Errors\n"
-    "   - Tautology\n"
-    "   - Parallelism Errors\n"
-    "   - Run-on Sentences\n"
-    "   - Negation Errors\n"
-    "   - Word Choice/Usage\n"
-    "   - Pronoun Errors\n"
-    "   - Inappropriate Register\n"
-    "   - Sentence Fragments\n"
-    "   - Article Usage\n"
-    "   - Subject-Verb Agreement\n"
-    "   - Mixed Metaphors/Idioms\n"
-    "   - Redundancy/Repetition\n"
-    "   - Sentence Structure Errors\n"
-    "   - Slang, Jargon, and Colloquialisms\n"
-    "   - Gerund and Participle Errors\n\n"
+    + "".join(f"   - {label}\n" for label in OFFICIAL_ERROR_TYPES)
+    + "\n"
     "2) Rewrite the sentence as a grammatically correct, natural-sounding English sentence "
     "while preserving the original meaning.\n\n"
+)
+
+prompt = instructions + (
     "Return ONLY a JSON object (no explanation, no extra text). "
     "The JSON must have exactly this structure:\n"
     "{ \"error_type\": \"...\", \"corrected_sentence\": \"...\" }"
 )
 
-gpt_error_types = []
-gpt_corrections = []
-
-for i, sentence in enumerate(df["Ungrammatical Statement"]):
-    print("processing "f"{i}: {sentence}")
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": sentence},
-        ],
-    )
-    content = response.choices[0].message.content
+compact_prompt = (
+    "You are a professional English teacher grading students' sentences.\n"
+    "Each input sentence contains exactly one main grammar or usage error "
+    "(it may also include a spelling mistake).\n\n"
+    "1) Pick the single most appropriate error type and answer with its number:\n"
+    + numbered_labels()
+    + "\n\n"
+    "2) Rewrite the sentence as a grammatically correct, natural-sounding English sentence "
+    "while preserving the original meaning.\n\n"
+    "Return ONLY {\"i\": <number>, \"c\": \"<corrected sentence>\"}."
+)
+
+batch_prompt = instructions + (
+    "The input is a JSON array of {\"id\", \"sentence\"} objects. "
+    "Grade every sentence independently and return one result per id.\n"
+    "Return ONLY a JSON object (no explanation, no extra text). "
+    "The JSON must have exactly this structure:\n"
+    "{ \"results\": [ { \"id\": 0, \"label\": \"...\", \"correction\": \"...\" } ] }"
+)
+
+
+async def complete(client, messages, limiter=None, stats=None, response_format=None, max_tokens=None, usage=None):
+    """One chat completion, paced by the shared limiter. 429s are fed back to
+    the limiter and retried; other errors are retried with a short backoff.
+    The answered request is added to `usage` (see new_usage) if given."""
+    reserved = estimate_tokens("".join(m["content"] for m in messages)) + (max_tokens or 100)
+    options = {"max_tokens": max_tokens} if max_tokens is not None else {}
+    if use_prompt_cache_key:
+        options["prompt_cache_key"] = prompt_cache_key(messages[0]["content"])
+    for attempt in range(max_attempts):
+        granted_at = None
+        if limiter is not None:
+            granted_at = await limiter.acquire_async(reserved)
+        started = time.perf_counter()
+        try:
+            with request_timing() as timing:
+                response = await client.chat.completions.create(
+                    model=model,
+                    temperature=temperature,
+                    response_format=response_format or {"type": "json_object"},
+                    messages=messages,
+                    **options,
+                )
+        except Exception as e:
+            if stats is not None:
+                stats.record_error(e, time.perf_counter() - started, attempt)
+            if attempt == max_attempts - 1:
+                raise
+            if is_rate_limit_error(e) and limiter is not None:
+                limiter.on_throttle(retry_after_from_error(e), granted_at)
+            else:
+                if stats is not None:
+                    stats.add_time("sleep", 2 ** attempt)
+                await asyncio.sleep(2 ** attempt)
+            continue
+        if limiter is not None:
+            used = response.usage.total_tokens if response.usage is not None else None
+            limiter.on_success(used, reserved)
+        seconds = time.perf_counter() - started
+        record_usage(stats, response, seconds, timing.get("ttfb"), attempt)
+        if usage is not None:
+            add_usage(usage, response, seconds)
+        return response
+
+
+@functools.lru_cache(maxsize=None)
+def prompt_cache_key(system_prompt):
+    return f"grammar-{prompt_fingerprint(system_prompt, OFFICIAL_ERROR_TYPES)[:16]}"
+
+
+def new_usage():
+    """Per-row usage record: latency and tokens of the requests behind an answer."""
+    return {"latency_s": 0.0, "input_tokens": 0, "output_tokens": 0}
+
+
+def add_usage(usage, response, seconds):
+    usage["latency_s"] += seconds
+    if response.usage is not None:
+        usage["input_tokens"] += response.usage.prompt_tokens
+        usage["output_tokens"] += response.usage.completion_tokens
+
+
+def share_usage(usage, count):
+    """One row's part of a batch request: the tokens are split evenly, the
+    latency is the request's."""
+    return {"latency_s": usage["latency_s"], "input_tokens": round(usage["input_tokens"] / count),
+            "output_tokens": round(usage["output_tokens"] / count)}
+
+
+def usage_fields(usage):
+    """Journal fields for a usage record; all None for rows that sent no request."""
+    usage = usage or {}
+    return {field: usage.get(field) for field in ("output_tokens", "input_tokens", "latency_s")}
+
+
+def parse_answer(content):
     data = json.loads(content)
+    return data["error_type"], data["corrected_sentence"]
+
+
+def repair_answer(answer):
+    """(official label, correction), or None if the label cannot be resolved."""
+    label = label_matcher.resolve(answer[0])
+    return (label, answer[1]) if label is not None else None
+
+
+async def label_sentence(client, sentence, cache=None, stats=None, limiter=None):
+    """((label, correction), usage) for one sentence. The usage record covers
+    every attempt and is None when the answer came from the cache."""
+    system_prompt = compact_prompt if use_compact_output else prompt
+    key = None
+    if cache is not None:
+        key = cache.make_key("openai", model, system_prompt, temperature, sentence)
+        cached = await cache.get_async(key)
+        if cached is not None:
+            return tuple(cached), None
+    usage = new_usage()
+    budget = output_budget(sentence)
+    try:
+        for attempt in range(max_label_retries + 1):
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": sentence},
+            ]
+            if use_compact_output:
+                response = await complete(client, messages, limiter, stats,
+                                          OPENAI_RESPONSE_FORMAT, budget, usage)
+            else:
+                response = await complete(client, messages, limiter, stats, usage=usage)
+            content = response.choices[0].message.content
+            if use_compact_output:
+                try:
+                    with phase(stats, "parse"):
+                        result = parse_compact(content)
+                    break
+                except ValueError as e:
+                    if response.choices[0].finish_reason == "length":
+                        # At temperature 0 the same budget would be cut off again.
+                        budget *= 2
+                        if stats is not None:
+                            stats.record_truncation()
+                        print(f"answer truncated for {sentence!r} (attempt {attempt + 1}), "
+                              f"retrying with max_tokens={budget}")
+                    else:
+                        print(f"malformed answer for {sentence!r} (attempt {attempt + 1}): {e}")
+                    answer = ("Error: Malformed response", "Error: Malformed response")
+                    continue
+            with phase(stats, "parse"):
+                answer = parse_answer(content)
+                result = repair_answer(answer)
+            if result is not None:
+                break
+            print(f"unknown label {answer[0]!r} for {sentence!r} (attempt {attempt + 1})")
+        else:
+            result = answer
+    except Exception as e:
+        print(f"request failed for {sentence!r}: {e}")
+        return ("Error: Request failed", "Error: Request failed"), usage if usage["latency_s"] else None
+    if cache is not None and not result[0].startswith("Error:"):
+        await cache.put_async(key, result)
+    return result, usage
+
+
+async def label_batch(client, items, cache=None, stats=None, limiter=None):
+    """Label a list of (row_id, sentence) with one request, retrying only the
+    sentences whose result is missing or malformed one at a time. Returns
+    (row_id, answer, usage) triples; the batch's tokens are split evenly over
+    the answers it produced (share_usage)."""
+    results = {}
+    spent = {}
+    todo = []
+    for row_id, sentence in items:
+        cached = None
+        if cache is not None:
+            cached = await cache.get_async(cache.make_key("openai", model, batch_prompt, temperature, sentence))
+        if cached is not None:
+            results[row_id] = tuple(cached)
+            spent[row_id] = None
+        else:
+            todo.append((row_id, sentence))
+
+    if todo:
+        batch_usage = new_usage()
+        try:
+            response = await complete(client, [
+                {"role": "system", "content": batch_prompt},
+                {"role": "user", "content": build_batch_input([sentence for _, sentence in todo])},
+            ], limiter, stats, usage=batch_usage)
+            with phase(stats, "parse"):
+                parsed, missing = parse_batch_response(response.choices[0].message.content, len(todo))
+        except Exception as e:
+            print(f"batch request failed for {len(todo)} sentences: {e}")
+            parsed, missing = {}, list(range(len(todo)))
+        with phase(stats, "parse"):
+            for i, answer in list(parsed.items()):
+                parsed[i] = repair_answer(answer)
+                if parsed[i] is None:
+                    del parsed[i]
+                    missing.append(i)
+
+        for i, result in parsed.items():
+            row_id, sentence = todo[i]
+            results[row_id] = result
+            spent[row_id] = share_usage(batch_usage, len(parsed))
+            if cache is not None:
+                await cache.put_async(cache.make_key("openai", model, batch_prompt, temperature, sentence), result)
+
+        if missing:
+            print(f"retrying {len(missing)} of {len(todo)} batch items individually")
+            retried = await asyncio.gather(
+                *(label_sentence(client, todo[i][1], cache, stats, limiter) for i in missing)
+            )
+            for i, (result, usage) in zip(missing, retried):
+                results[todo[i][0]] = result
+                spent[todo[i][0]] = usage
+
+    return [(row_id, results[row_id], spent[row_id]) for row_id, _ in items]
+
+
+def record_usage(stats, response, seconds=None, ttfb=None, attempt=0):
+    if stats is not None and response.usage is not None:
+        details = response.usage.prompt_tokens_details
+        stats.record_request(response.usage.prompt_tokens, response.usage.completion_tokens,
+                             details.cached_tokens if details is not None else 0, seconds, ttfb, attempt)
+
+
+async def label_dataframe(df, client, journal, cache=None, stats=None, limiter=None,
+                          concurrency=None, batch_size=None, plan=None):
+    """Label every row of `df`. With a dedup.DedupPlan, `df` holds the group
+    representatives and each answer is journaled for the whole group."""
+    concurrency = concurrency or default_concurrency
+    batch_size = batch_size or default_batch_size
+    items = list(zip(df[id_col], df["Ungrammatical Statement"]))
+
+    if batch_size > 1:
+        jobs = enumerate(chunked(items, batch_size))
+
+        async def worker(batch):
+            return await label_batch(client, batch, cache, stats, limiter)
+    else:
+        jobs = ((row_id, [(row_id, sentence)]) for row_id, sentence in items)
+
+        async def worker(batch):
+            row_id, sentence = batch[0]
+            answer, usage = await label_sentence(client, sentence, cache, stats, limiter)
+            return [(row_id, answer, usage)]
+
+    done = 0
+    total = plan.rows if plan is not None else len(df)
+    async for _, batch_results in run_concurrent(jobs, worker, concurrency):
+        with phase(stats, "io"):
+            for row_id, answer, usage in batch_results:
+                for member_id, (error_type, corrected) in fan_out(plan, row_id, answer):
+                    # Duplicates ride on the representative's request; only it is charged.
+                    journal.append(member_id, error_type=error_type, corrected_sentence=corrected, tier=LLM_TIER,
+                                   **usage_fields(usage if member_id == row_id else None))
+                    if stats is not None:
+                        stats.add_rows()
+                    done += 1
+        print(f"saved {done}/{total} rows to {journal.path}")
+
+
+def fan_out(plan, row_id, answer):
+    return plan.expand(row_id, answer) if plan is not None else [(row_id, answer)]
+
+
+def repair_batch_answer(answer):
+    # Batch API results cannot be re-asked; keep an unresolved label as returned.
+    return repair_answer(answer) or answer
+
+
+def run_batch_api(queue, journal, plan=None):
+    client = OpenAI(api_key=os.getenv("API_KEY"))
+    job = load_job(batch_job_path)
+    if job is None:
+        items = zip(queue[id_col], queue["Ungrammatical Statement"])
+        if use_compact_output:
+            requests = openai_requests(items, model, temperature, compact_prompt,
+                                       OPENAI_RESPONSE_FORMAT, output_budget)
+        else:
+            requests = openai_requests(items, model, temperature, prompt)
+        write_jsonl(batch_requests_path, requests)
+        job = submit_openai_batch(client, batch_requests_path)
+        save_job(batch_job_path, job)
+        print(f"submitted {len(queue)} rows as batch {job['id']}")
+    else:
+        print(f"resuming batch {job['id']} from {batch_job_path}")
+
+    batch = wait_for_openai_batch(client, job["id"], batch_poll_interval)
+    parse = parse_compact if use_compact_output else lambda content: repair_batch_answer(parse_answer(content))
+    usage = {}
+    results = read_openai_results(client, batch, parse, usage)
+    for row_id, answer in results.items():
+        for member_id, (error_type, corrected) in fan_out(plan, row_id, answer):
+            journal.append(member_id, error_type=error_type, corrected_sentence=corrected, tier=LLM_TIER,
+                           **usage_fields(usage.get(row_id) if member_id == row_id else None))
+    os.remove(batch_job_path)
+    print(f"batch {job['id']} {batch.status}: {len(results)} results ingested")
+
+
+def answer_locally(queue, journal):
+    """Journal the rows the rule cascade answers and return the rest."""
+    answered, _ = split_rows(zip(queue[id_col], queue["Ungrammatical Statement"]))
+    for row_id, (tier, error_type, corrected) in answered.items():
+        journal.append(row_id, error_type=error_type, corrected_sentence=corrected, tier=tier)
+    if len(queue):
+        print(f"answered {len(answered)}/{len(queue)} rows locally "
+              f"({len(answered) / len(queue):.1%} of API calls saved)")
+    return queue[~queue[id_col].isin(answered)]
+
+
+def store_run(out, queue):
+    """Add the rows labeled by this run to the results store."""
+    if len(queue):
+        run_id = write_run(out[out[id_col].isin(queue[id_col])], model, GPT_COLUMNS)
+        print(f"stored run {run_id} in {DEFAULT_STORE}")
+
+
+def main():
+    df = pd.read_csv(read_file_path)
+
+    done_ids = completed_ids(load_journal(journal_path), "error_type")
+    queue = df[~df[id_col].isin(done_ids)]
+    print(f"Found {len(done_ids)} rows in {journal_path}, {len(queue)} left to label.")
+
+    if use_rules:
+        with ResultJournal(journal_path) as journal:
+            llm_queue = answer_locally(queue, journal)
+    else:
+        llm_queue = queue
+
+    plan = plan_dedup(llm_queue[id_col], llm_queue["Ungrammatical Statement"], dedup_mode)
+    print(plan.summary())
+    llm_queue = llm_queue[llm_queue[id_col].isin(plan.representatives)]
+
+    if use_batch_api:
+        if len(llm_queue):
+            with ResultJournal(journal_path) as journal:
+                run_batch_api(llm_queue, journal, plan)
+        out = compact(df, journal_path, output_path, id_col, output_columns)
+        print(f"wrote {output_path}")
+        store_run(out, queue)
+        return
+
+    # Retries are handled in complete() so 429s reach the rate limiter.
+    client = AsyncOpenAI(api_key=os.getenv("API_KEY"), max_retries=0,
+                         http_client=DefaultAsyncHttpxClient(event_hooks=ttfb_hooks()))
 
-    gpt_error_types.append(data["error_type"])
-    gpt_corrections.append(data["corrected_sentence"])
+    cache = ResponseCache()
+    mode = "single" if default_batch_size <= 1 else f"batch={default_batch_size}"
+    if use_compact_output and default_batch_size <= 1:
+        mode = "compact"
+    stats = Telemetry("gpt", mode, model)
+    limiter = AdaptiveRateLimiter(rpm=max_rpm / 2, max_rpm=max_rpm, tpm=max_tpm)
+    with ResultJournal(journal_path) as journal:
+        asyncio.run(label_dataframe(llm_queue, client, journal, cache, stats, limiter, plan=plan))
+    stats.add_time("sleep", limiter.waited)
+    print(limiter.summary())
+    print(label_matcher.summary())
+    print(cache.summary())
+    cache.close()
 
-    error_type = data["error_type"]
-    corrected = data["corrected_sentence"]
+    save_run(stats.finish())
+    print(format_comparison(load_runs(), "gpt"))
+    print(stats.report())
+    stats.close()
 
-    df.loc[i, "GPT_Error_Type"] = error_type
-    df.loc[i, "GPT_Correction"] = corrected
+    out = compact(df, journal_path, output_path, id_col, output_columns)
+    print(f"wrote {output_path}")
+    store_run(out, queue)
 
-    df.to_csv(output_path, index=False, encoding="utf-8")
-    print(f"saved row {i} to {output_path}")
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import re
+import zlib
+
+import pandas as pd
+
+# Split one labeling run over N processes or hosts.
+#
+# A row belongs to shard crc32(str(row_id)) % N, which depends on nothing but
+# the row id and N, so every process computes the same partition without
+# coordinating, and re-running a shard after a crash picks up exactly the
+# rows it owns. Shard i of N writes its results to its own file (see
+# shard_path); merge_shards() then checks the shard files against the rows
+# the run was meant to cover and writes the canonical results file.
+
+
+def parse_shard(text):
+    """(index, count) from "i/N", with 0 <= i < N."""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", str(text))
+    if not match:
+        raise ValueError(f"expected a shard as i/N, got {text!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 0 <= index < count:
+        raise ValueError(f"shard index must be in 0..{count - 1}, got {text!r}")
+    return index, count
+
+
+def shard_of(row_id, count):
+    return zlib.crc32(str(row_id).encode("utf-8")) % count
+
+
+def in_shard(row_ids, index, count):
+    """Boolean mask of the row ids that belong to shard `index` of `count`."""
+    return [shard_of(row_id, count) == index for row_id in row_ids]
+
+
+def shard_path(path, index, count):
+    """results.csv -> results.shard-0-of-4.csv"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{index}-of-{count}{ext}"
+
+
+class MergeReport:
+    """What merge_shards() found. `missing` and `unexpected` are row ids
+    absent from / not asked for by the run, `misplaced` rows sit in a shard
+    file that does not own them (the shards were run with a different N),
+    and `conflicts` are row ids answered differently by two shards.
+    `absent` lists the shards whose file was not found."""
+
+    def __init__(self, shards, absent, rows, repeated, duplicates, conflicts, missing, unexpected, misplaced):
+        self.shards = shards
+        self.absent = absent
+        self.rows = rows
+        self.repeated = repeated
+        self.duplicates = duplicates
+        self.conflicts = conflicts
+        self.missing = missing
+        self.unexpected = unexpected
+        self.misplaced = misplaced
+
+    @property
+    def ok(self):
+        return not (self.absent or self.conflicts or self.missing or self.unexpected or self.misplaced)
+
+    def summary(self):
+        lines = [
+            f"merge: {self.shards} shards, {self.rows} rows "
+            f"({self.repeated} re-labeled after a resume, {self.duplicates} duplicated across shards)"
+        ]
+        if self.absent:
+            lines.append(f"  no output file for shards {', '.join(str(i) for i in self.absent)}")
+        for name in ("missing", "unexpected", "misplaced", "conflicts"):
+            ids = getattr(self, name)
+            if ids:
+                shown = ", ".join(str(i) for i in ids[:10]) + (" ..." if len(ids) > 10 else "")
+                lines.append(f"  {len(ids)} {name}: {shown}")
+        return "\n".join(lines)
+
+
+def merge_shards(paths, key, answer_columns, expected=None):
+    """(merged DataFrame sorted by `key`, MergeReport) for the shard files
+    `paths`, where paths[i] holds shard i of len(paths).
+
+    Within one shard file the last answer for a row wins: a shard that was
+    stopped between writing a row and recording its progress labels the row
+    again on resume. Across shard files, rows with the same `answer_columns`
+    are duplicates and collapse to one; different answers are conflicts.
+    `expected` is the collection of row ids the run had to cover.
+    """
+    count = len(paths)
+    frames, absent = [], []
+    for index, path in enumerate(paths):
+        if not os.path.exists(path):
+            absent.append(index)
+            continue
+        df = pd.read_csv(path)
+        df["_shard"] = index
+        frames.append(df)
+    if not frames:
+        raise FileNotFoundError(f"none of the {count} shard files exist, e.g. {paths[0]}")
+    rows = pd.concat(frames, ignore_index=True)
+
+    latest = rows.drop_duplicates([key, "_shard"], keep="last")
+    repeated = len(rows) - len(latest)
+    misplaced = sorted(latest.loc[[shard_of(i, count) != s for i, s in zip(latest[key], latest["_shard"])], key])
+    distinct = latest.drop_duplicates([key] + list(answer_columns))
+    conflicts = sorted(distinct.loc[distinct.duplicated(key), key].unique())
+    merged = distinct.drop_duplicates(key).sort_values(key).drop(columns="_shard").reset_index(drop=True)
+    duplicates = len(latest) - len(distinct)
+
+    missing, unexpected = [], []
+    if expected is not None:
+        expected, found = set(expected), set(merged[key])
+        missing = sorted(expected - found)
+        unexpected = sorted(found - expected)
+
+    report = MergeReport(count, absent, len(merged), repeated, duplicates, conflicts, missing, unexpected, misplaced)
+    return merged, report
+
+
+def write_merged(df, path):
+    """Write the canonical results file in one step, so readers never see
+    a half-written file."""
+    tmp = f"{path}.tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import difflib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Column-wise correction similarity.
+#
+# ratio() returns exactly difflib.SequenceMatcher(None, a, b).ratio() for
+# every pair, but skips identical pairs, scores each distinct pair once and
+# spreads large inputs over a process pool. Edit distances are computed with
+# a Levenshtein DP that is vectorized across a chunk of similar-length pairs:
+# each DP row is one numpy expression, so the Python-level loop runs once per
+# character (or token) of the longest string rather than once per cell.
+
+PARALLEL_THRESHOLD = 20000
+CHUNK_SIZE = 5000
+
+
+def _ratio_chunk(pairs):
+    return [difflib.SequenceMatcher(None, a, b).ratio() for a, b in pairs]
+
+
+def _map_chunks(func, items, workers):
+    chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+    if workers == 1 or len(items) < PARALLEL_THRESHOLD:
+        return [x for chunk in chunks for x in func(chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [x for part in executor.map(func, chunks) for x in part]
+
+
+def ratio(a, b, workers=None):
+    """difflib ratio for each (a[i], b[i]); sequences may be strings or token lists."""
+    a, b = list(a), list(b)
+    out = np.ones(len(a))
+    distinct = {}
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            key = (tuple(x), tuple(y)) if isinstance(x, list) else (x, y)
+            distinct.setdefault(key, []).append(i)
+    if distinct:
+        keys = list(distinct)
+        scores = _map_chunks(_ratio_chunk, keys, workers or os.cpu_count())
+        for key, score in zip(keys, scores):
+            out[distinct[key]] = score
+    return out
+
+
+def _encode(seqs, vocab):
+    if vocab is None:
+        return [np.frombuffer(s.encode("utf-32-le"), dtype=np.uint32) for s in seqs]
+    return [np.array([vocab.setdefault(t, len(vocab) + 1) for t in seq], dtype=np.uint32) for seq in seqs]
+
+
+def _levenshtein_chunk(pairs):
+    n = len(pairs)
+    la = np.array([len(x) for x, _ in pairs])
+    lb = np.array([len(y) for _, y in pairs])
+    A = np.zeros((n, la.max(initial=0)), dtype=np.uint32)
+    B = np.zeros((n, lb.max(initial=0)), dtype=np.uint32)
+    for k, (x, y) in enumerate(pairs):
+        A[k, :la[k]] = x
+        B[k, :lb[k]] = y
+
+    width = B.shape[1]
+    cols = np.arange(width + 1)
+    prev = np.broadcast_to(cols, (n, width + 1)).astype(np.int32)
+    result = np.where(la == 0, lb, 0)
+    rows = np.arange(n)
+    for i in range(A.shape[1]):
+        cost = (A[:, i:i + 1] != B).astype(np.int32)
+        # Deletion/substitution candidates, then close the insertion chain
+        # cur[j] = min(t[j], cur[j-1] + 1) with a running minimum.
+        t = np.empty_like(prev)
+        t[:, 0] = i + 1
+        t[:, 1:] = np.minimum(prev[:, 1:] + 1, prev[:, :-1] + cost)
+        cur = np.minimum.accumulate(t - cols, axis=1) + cols
+        done = la == i + 1
+        result[done] = cur[rows[done], lb[done]]
+        prev = cur
+    return result.tolist()
+
+
+def levenshtein(a, b, tokens=False, workers=None):
+    """Edit distance for each pair, on characters or (tokens=True) on token lists."""
+    vocab = {} if tokens else None
+    a_codes = _encode(a, vocab)
+    b_codes = _encode(b, vocab)
+    out = np.zeros(len(a_codes), dtype=np.int64)
+    distinct = {}
+    for i, (x, y) in enumerate(zip(a_codes, b_codes)):
+        if len(x) != len(y) or (x != y).any():
+            distinct.setdefault((x.tobytes(), y.tobytes()), []).append(i)
+    if distinct:
+        # Sort by length so each chunk pads its pairs to similar widths.
+        keys = sorted(distinct, key=lambda k: len(k[0]) + len(k[1]))
+        pairs = [(np.frombuffer(x, dtype=np.uint32), np.frombuffer(y, dtype=np.uint32)) for x, y in keys]
+        distances = _map_chunks(_levenshtein_chunk, pairs, workers or os.cpu_count())
+        for key, distance in zip(keys, distances):
+            out[distinct[key]] = distance
+    return out
+
+
+def score_pairs(references, hypotheses, workers=None):
+    """Character and token level distance/ratio plus word error rate for two
+    aligned text columns, as a DataFrame with one row per pair."""
+    refs = [str(x) for x in references]
+    hyps = [str(x) for x in hypotheses]
+    ref_tokens = [r.split() for r in refs]
+    hyp_tokens = [h.split() for h in hyps]
+    token_distance = levenshtein(ref_tokens, hyp_tokens, tokens=True, workers=workers)
+    ref_len = np.array([len(t) for t in ref_tokens])
+    return pd.DataFrame({
+        "char_distance": levenshtein(refs, hyps, workers=workers),
+        "char_ratio": ratio(refs, hyps, workers),
+        "token_distance": token_distance,
+        "token_ratio": ratio(ref_tokens, hyp_tokens, workers),
+        "wer": token_distance / np.maximum(ref_len, 1),
+    }, index=references.index if isinstance(references, pd.Series) else None)
+
+
+def benchmark(path, rows, workers=None):
+    """Time the old DataFrame.apply(difflib) path against ratio() on `rows`
+    pairs drawn from a results file's reference/prediction columns."""
+    from evaluation import load_results, normalize_text
+
+    df = load_results(path)
+    df = df.sample(rows, replace=rows > len(df), random_state=0).reset_index(drop=True)
+    # Tag repeated draws so the corpus has no more duplicate pairs than the file.
+    copy = df.groupby(["reference", "prediction"], dropna=False).cumcount().astype(str)
+    pairs = pd.DataFrame({
+        "reference": df["reference"].map(normalize_text) + " " + copy,
+        "prediction": df["prediction"].map(normalize_text) + " " + copy,
+    })
+
+    started = time.perf_counter()
+    expected = pairs.apply(
+        lambda r: difflib.SequenceMatcher(None, r["reference"], r["prediction"]).ratio(), axis=1
+    )
+    apply_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    got = ratio(pairs["reference"], pairs["prediction"], workers)
+    ratio_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    score_pairs(pairs["reference"], pairs["prediction"], workers)
+    full_s = time.perf_counter() - started
+
+    print(f"{rows} pairs from {path}")
+    print(f"{'apply(difflib)':<24}{apply_s:>8.2f}s")
+    print(f"{'similarity.ratio':<24}{ratio_s:>8.2f}s  ({apply_s / ratio_s:.1f}x)")
+    print(f"{'similarity.score_pairs':<24}{full_s:>8.2f}s  (char+token distance, ratio, WER)")
+    print("identical to difflib:", bool((expected.to_numpy() == got).all()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark column-wise correction similarity.")
+    parser.add_argument("file", nargs="?", default="Grammar_Correction_with_GPT.csv")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--workers", type=int, help="process pool size (default: all cores)")
+    args = parser.parse_args(argv)
+    benchmark(args.file, args.rows, args.workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+import os
+import math
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from evaluation import SIMILARITY_THRESHOLD, LABEL_INDEX, iter_results, row_scores
+
+# Constant-memory evaluation of results files of any size.
+#
+# The file is read in chunks (evaluation.iter_results); each chunk is scored
+# with the same evaluation.row_scores() that evaluate() uses, folded into an
+# Accumulator and dropped. Accumulators only hold counts: the fine confusion
+# matrix (the coarse one and both classification reports are derived from
+# it), match counts, per-type counts and the distribution of every per-row
+# score. Two accumulators merge by adding their counts, so chunks can be
+# scored in worker processes in any order and merged at the end.
+#
+# Similarity ratios, change magnitudes and sentence lengths take few distinct
+# values (a difflib ratio is 2 * matches / total length), so ValueCounts keeps
+# their exact distribution and the quantiles come out the same as pandas'.
+# Only past MAX_DISTINCT_VALUES distinct values does it round to a grid and
+# become an approximate sketch.
+
+CHUNK_ROWS = 10000
+MAX_DISTINCT_VALUES = 200000
+SKETCH_DECIMALS = 4
+
+
+class ValueCounts:
+    """Mergeable distribution of a numeric column: exact value -> count,
+    rounded to SKETCH_DECIMALS once it holds too many distinct values."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.exact = True
+
+    def add(self, values):
+        values = pd.Series(values, dtype=float).dropna()
+        if not self.exact:
+            values = values.round(SKETCH_DECIMALS)
+        self.counts.update(dict(values.value_counts(sort=False)))
+        self._compact()
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.exact = self.exact and other.exact
+        if not self.exact:
+            self.counts = Counter(_rounded(self.counts))
+        self._compact()
+        return self
+
+    def _compact(self):
+        if self.exact and len(self.counts) > MAX_DISTINCT_VALUES:
+            self.exact = False
+            self.counts = Counter(_rounded(self.counts))
+
+    def arrays(self):
+        """(sorted distinct values, their counts)."""
+        values = np.array(sorted(self.counts), dtype=float)
+        return values, np.array([self.counts[v] for v in values], dtype=np.int64)
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def mean(self):
+        values, counts = self.arrays()
+        return math.fsum(values * counts) / counts.sum() if len(values) else np.nan
+
+    def std(self):
+        """Sample standard deviation (ddof=1), as pandas computes it."""
+        values, counts = self.arrays()
+        n = counts.sum()
+        if n < 2:
+            return np.nan
+        mean = math.fsum(values * counts) / n
+        return math.sqrt(math.fsum(counts * (values - mean) ** 2) / (n - 1))
+
+    def quantile(self, q):
+        """Linearly interpolated quantile, as numpy / pandas compute it."""
+        values, counts = self.arrays()
+        if not len(values):
+            return np.nan
+        cumulative = np.cumsum(counts)
+        position = (cumulative[-1] - 1) * q
+        low, high = math.floor(position), math.ceil(position)
+        below = values[np.searchsorted(cumulative, low, side="right")]
+        above = values[np.searchsorted(cumulative, high, side="right")]
+        weight = position - low
+        # numpy's _lerp, so the result matches np.quantile to the last bit.
+        return below + (above - below) * weight if weight < 0.5 else above - (above - below) * (1 - weight)
+
+    def describe(self, name=None):
+        """pandas Series.describe() of the counted values."""
+        values, _ = self.arrays()
+        return pd.Series({
+            "count": float(self.count),
+            "mean": self.mean(),
+            "std": self.std(),
+            "min": values[0] if len(values) else np.nan,
+            "25%": self.quantile(0.25),
+            "50%": self.quantile(0.5),
+            "75%": self.quantile(0.75),
+            "max": values[-1] if len(values) else np.nan,
+        }, name=name)
+
+    def histogram(self, bins):
+        """(counts, edges) as np.histogram(values, bins) would give."""
+        values, counts = self.arrays()
+        return np.histogram(values, bins=bins, weights=counts)
+
+
+def _rounded(counts):
+    rounded = Counter()
+    for value, count in counts.items():
+        rounded[round(value, SKETCH_DECIMALS)] += count
+    return rounded
+
+
+class Accumulator:
+    """Everything evaluate() reports, as mergeable counts."""
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, tiers=True):
+        size = len(LABEL_INDEX.fine)
+        self.threshold = threshold
+        self.rows = 0
+        self.failed = 0
+        self.correct = 0
+        self.exact = 0
+        self.high_quality = 0
+        self.fine_cm = np.zeros((size, size), dtype=np.int64)
+        self.type_rows = Counter()
+        self.type_correct = Counter()
+        self.sim = ValueCounts()
+        self.change_mag_reference = ValueCounts()
+        self.change_mag_prediction = ValueCounts()
+        # Sentence lengths of the rows whose mapped label was wrong / right.
+        self.sent_length = {False: ValueCounts(), True: ValueCounts()}
+        self.output_tokens = 0.0
+        self.output_token_rows = 0
+        self.tier_rows = 0
+        self.tiers = {} if tiers else None
+
+    def add(self, df, workers=1):
+        """Fold a canonical results chunk into the counts."""
+        df = df[df["true_label"].notna()]
+        rows = row_scores(df, workers)
+        self._add_rows(df, rows)
+        if self.tiers is not None and "tier" in df.columns:
+            self.tier_rows += int(df["tier"].notna().sum())
+            for tier, part in df.groupby(df["tier"].fillna("llm")):
+                self.tiers.setdefault(tier, Accumulator(self.threshold, tiers=False))._add_rows(
+                    part, rows.loc[part.index])
+        return self
+
+    def _add_rows(self, df, rows):
+        self.rows += len(rows)
+        self.failed += int(rows["failed"].sum())
+        self.correct += int(rows["correct"].sum())
+        self.exact += int(rows["exact"].sum())
+        self.high_quality += int((rows["sim"] >= self.threshold).sum())
+        self.fine_cm += LABEL_INDEX.confusion(rows["true_code"].to_numpy(), rows["pred_code"].to_numpy())
+        self.type_rows.update(dict(rows["true_label"].value_counts(sort=False)))
+        self.type_correct.update(dict(rows.loc[rows["correct"], "true_label"].value_counts(sort=False)))
+        self.sim.add(rows["sim"])
+        self.change_mag_reference.add(rows["change_mag_reference"])
+        self.change_mag_prediction.add(rows["change_mag_prediction"])
+        for mapped_correct, lengths in rows.groupby("mapped_correct")["sent_length"]:
+            self.sent_length[bool(mapped_correct)].add(lengths)
+        if "output_tokens" in df.columns:
+            tokens = pd.to_numeric(df["output_tokens"]).dropna()
+            self.output_tokens += float(tokens.sum())
+            self.output_token_rows += len(tokens)
+
+    def merge(self, other):
+        for name in ("rows", "failed", "correct", "exact", "high_quality", "output_tokens", "output_token_rows",
+                     "tier_rows"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.fine_cm += other.fine_cm
+        self.type_rows.update(other.type_rows)
+        self.type_correct.update(other.type_correct)
+        self.sim.merge(other.sim)
+        self.change_mag_reference.merge(other.change_mag_reference)
+        self.change_mag_prediction.merge(other.change_mag_prediction)
+        for key in self.sent_length:
+            self.sent_length[key].merge(other.sent_length[key])
+        if self.tiers is not None and other.tiers is not None:
+            for tier, part in other.tiers.items():
+                if tier in self.tiers:
+                    self.tiers[tier].merge(part)
+                else:
+                    self.tiers[tier] = part
+        return self
+
+    @property
+    def mapped_correct(self):
+        return int(np.trace(LABEL_INDEX.roll_up(self.fine_cm)))
+
+    def metrics(self, model=""):
+        """evaluate()'s metrics without "row_metrics"; the per-row score
+        distributions are under "distributions" instead."""
+        index = LABEL_INDEX
+        coarse_cm = index.roll_up(self.fine_cm)
+        labels = sorted(self.type_rows)
+        per_type = pd.Series(
+            [self.type_correct[label] / self.type_rows[label] for label in labels],
+            index=pd.Index(labels, name="Error Type"), name="correct",
+        )
+        metrics = {
+            "model": model,
+            "rows": self.rows,
+            "failed": self.failed,
+            "strict_accuracy": self.correct / self.rows if self.rows else np.nan,
+            "mapped_accuracy": self.mapped_correct / self.rows if self.rows else np.nan,
+            "per_type_accuracy": per_type.sort_values(ascending=False),
+            "classification_report": index.report(coarse_cm, "coarse").sort_index(),
+            "confusion_matrix": index.frame(coarse_cm, "coarse"),
+            "fine_classification_report": index.report(self.fine_cm, "fine").sort_index(),
+            "fine_confusion_matrix": index.frame(self.fine_cm, "fine"),
+            "exact_match": self.exact / self.rows if self.rows else np.nan,
+            "high_quality_ratio": self.high_quality / self.rows if self.rows else np.nan,
+            "similarity": self.sim.describe(),
+            "distributions": {
+                "sim": self.sim,
+                "change_mag_reference": self.change_mag_reference,
+                "change_mag_prediction": self.change_mag_prediction,
+                "sent_length": self.sent_length,
+            },
+        }
+        if self.output_token_rows:
+            metrics["output_tokens_per_request"] = self.output_tokens / self.output_token_rows
+        if self.tiers and self.tier_rows:
+            metrics["tiers"] = self.tier_report()
+        return metrics
+
+    def tier_report(self):
+        """evaluation.tier_report() from the per-tier accumulators."""
+        groups = dict(sorted(self.tiers.items()))
+        rules = [part for tier, part in groups.items() if tier.startswith("rules")]
+        if rules and len(groups) > 2:
+            combined = Accumulator(self.threshold, tiers=False)
+            for part in rules:
+                combined.merge(part)
+            groups["rules (all)"] = combined
+        groups["total"] = self
+
+        rows = {}
+        for tier, part in groups.items():
+            rows[tier] = {
+                "rows": part.rows,
+                "share": part.rows / self.rows,
+                "strict_accuracy": part.correct / part.rows,
+                "mapped_accuracy": part.mapped_correct / part.rows,
+                "exact_match": part.exact / part.rows,
+                "mean_similarity": part.sim.mean(),
+            }
+        return pd.DataFrame.from_dict(rows, orient="index").rename_axis("tier")
+
+
+def _score_chunk(chunk, threshold):
+    return Accumulator(threshold).add(chunk)
+
+
+def evaluate_stream(path, threshold=SIMILARITY_THRESHOLD, chunksize=CHUNK_ROWS, workers=None):
+    """evaluate()'s metrics for the results file at `path`, reading
+    `chunksize` rows at a time and scoring chunks in `workers` processes
+    (default: all cores). At most two chunks per worker are in flight."""
+    workers = workers or os.cpu_count() or 1
+    total = Accumulator(threshold)
+    model = ""
+    chunks = iter_results(path, chunksize)
+    if workers == 1:
+        for chunk in chunks:
+            model = chunk.attrs["model"]
+            total.merge(_score_chunk(chunk, threshold))
+        return total.metrics(model)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for chunk in chunks:
+            model = chunk.attrs["model"]
+            pending.append(executor.submit(_score_chunk, chunk, threshold))
+            if len(pending) >= 2 * workers:
+                total.merge(pending.pop(0).result())
+        for future in pending:
+            total.merge(future.result())
+    return total.metrics(model)
@@ -0,0 +1,191 @@
+import json
+import time
+import contextlib
+import contextvars
+from collections import Counter
+
+import numpy as np
+
+from run_stats import RunStats
+
+# Per-request telemetry for the labeling pipelines.
+#
+# Telemetry is a RunStats that also writes one JSON line per API call to
+# DEFAULT_METRICS_PATH: wall time, time to the response headers (ttfb), the
+# attempt number, the error class of a failed call and its input, output and
+# cached tokens. report() turns those into latency percentiles, throughput,
+# a cost estimate and the share of worker time spent in each phase:
+#
+#   network  API calls, from sending the request to the parsed response object
+#   sleep    rate limiter waits and retry backoff
+#   parse    JSON parsing and label matching
+#   io       journal / CSV writes
+#
+# Phases are summed over all workers, so with 16 requests in flight the
+# network share can be far larger than the wall time of the run.
+
+DEFAULT_METRICS_PATH = "metrics.jsonl"
+
+# USD per 1M tokens: (input, cached input, output). Interactive list prices;
+# Batch API jobs are billed at about half of these.
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 0.03, 2.50),
+    "gemini-2.5-pro": (1.25, 0.125, 10.00),
+}
+
+_timing = contextvars.ContextVar("request_timing", default=None)
+
+
+async def _on_request(request):
+    timing = _timing.get()
+    if timing is not None:
+        timing["sent"] = time.perf_counter()
+
+
+async def _on_response(response):
+    timing = _timing.get()
+    if timing is not None and "sent" in timing:
+        timing["ttfb"] = time.perf_counter() - timing["sent"]
+
+
+def ttfb_hooks():
+    """httpx event hooks for the async client handed to AsyncOpenAI. The
+    response hook runs once the headers are in, before the body is read."""
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+@contextlib.contextmanager
+def request_timing():
+    """Yield a dict that holds "ttfb" once a request made inside the block
+    (through a client with ttfb_hooks()) has received its headers."""
+    timing = {}
+    token = _timing.set(timing)
+    try:
+        yield timing
+    finally:
+        _timing.reset(token)
+
+
+def estimate_cost(model, input_tokens, output_tokens, cached_tokens=0):
+    """USD for the given usage, or None for a model missing from PRICES."""
+    prices = PRICES.get(model.split("/")[-1])
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + output_tokens * output_price) / 1e6
+
+
+def percentiles(values, qs=(50, 95, 99)):
+    if not values:
+        return {q: None for q in qs}
+    return dict(zip(qs, np.percentile(np.asarray(values), qs).round(3).tolist()))
+
+
+class Telemetry(RunStats):
+    """RunStats plus the per-request metrics file and report()."""
+
+    def __init__(self, pipeline, mode, model, path=DEFAULT_METRICS_PATH):
+        super().__init__(pipeline, mode)
+        self.model = model
+        self.path = path
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+        self.latencies = []
+        self.ttfbs = []
+        self.retries = 0
+        self.error_classes = Counter()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _write(self, record):
+        # Called with the lock held, so lines from several workers never interleave.
+        self.file.write(json.dumps(record) + "\n")
+
+    def record_request(self, input_tokens=0, output_tokens=0, cached_tokens=0, seconds=None,
+                       ttfb=None, attempt=0):
+        super().record_request(input_tokens, output_tokens, cached_tokens, seconds)
+        with self.lock:
+            if seconds is not None:
+                self.latencies.append(seconds)
+                self.phases["network"] += seconds
+            if ttfb is not None:
+                self.ttfbs.append(ttfb)
+            if attempt:
+                self.retries += 1
+            self._write({
+                "run": self.run_id, "pipeline": self.pipeline, "model": self.model,
+                "t": round(time.perf_counter() - self.started, 3), "attempt": attempt,
+                "seconds": _round(seconds), "ttfb": _round(ttfb), "error": None,
+                "input_tokens": input_tokens or 0, "output_tokens": output_tokens or 0,
+                "cached_tokens": cached_tokens or 0,
+            })
+
+    def record_error(self, error, seconds=None, attempt=0):
+        super().record_error(error, seconds, attempt)
+        with self.lock:
+            if seconds is not None:
+                self.phases["network"] += seconds
+            if attempt:
+                self.retries += 1
+            self.error_classes[type(error).__name__] += 1
+            self._write({
+                "run": self.run_id, "pipeline": self.pipeline, "model": self.model,
+                "t": round(time.perf_counter() - self.started, 3), "attempt": attempt,
+                "seconds": _round(seconds), "ttfb": None, "error": type(error).__name__,
+                "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0,
+            })
+
+    def profile(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        return {
+            "run": self.run_id,
+            "requests": self.requests,
+            "error_classes": dict(self.error_classes),
+            "retries": self.retries,
+            "requests_per_s": round(self.requests / elapsed, 2) if elapsed > 0 else 0.0,
+            "latency_s": percentiles(self.latencies),
+            "ttfb_s": percentiles(self.ttfbs),
+            "cost_usd": estimate_cost(self.model, self.input_tokens, self.output_tokens, self.cached_tokens),
+            "phases_s": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        }
+
+    def report(self):
+        profile = self.profile()
+        stats = self.as_dict()
+        errors = ", ".join(f"{n} {name}" for name, n in self.error_classes.most_common()) or "none"
+        lines = [
+            f"telemetry ({self.path}): {self.requests} requests ok, errors: {errors}, "
+            f"{self.retries} retries, {self.truncated} truncated; "
+            f"{profile['requests_per_s']} requests/s, {stats['rows_per_s']} rows/s",
+            "latency " + (_format_percentiles(profile["latency_s"]) if self.latencies else "- (no requests)")
+            + "; ttfb " + (_format_percentiles(profile["ttfb_s"]) if self.ttfbs else "not reported by this client"),
+        ]
+        cost = profile["cost_usd"]
+        lines.append(
+            f"tokens: {self.input_tokens} input ({stats['cached_share']:.0%} cached), {self.output_tokens} output; "
+            + (f"estimated cost ${cost:.4f}" if cost is not None else f"no price for {self.model}")
+        )
+        total = sum(self.phases.values())
+        if total:
+            lines.append("worker time: " + ", ".join(
+                f"{name} {seconds:.1f}s ({seconds / total:.0%})"
+                for name, seconds in sorted(self.phases.items(), key=lambda item: -item[1])
+            ))
+        return "\n".join(lines)
+
+    def close(self):
+        """Write the run's profile as the last line of the metrics file."""
+        with self.lock:
+            if not self.file.closed:
+                self._write({"run": self.run_id, "pipeline": self.pipeline, "model": self.model,
+                             "summary": {**self.as_dict(), **self.profile()}})
+                self.file.close()
+
+
+def _round(seconds):
+    return round(seconds, 4) if seconds is not None else None
+
+
+def _format_percentiles(values):
+    return " ".join(f"p{q} {v:.3f}s" for q, v in values.items())
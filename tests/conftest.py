@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from mock_llm_server import start_server, base_url
+
+
+@pytest.fixture
+def mock_server():
+    """start(**MockState options) -> a running mock_llm_server; every server
+    started by a test is shut down after it."""
+    servers = []
+
+    def start(**options):
+        options.setdefault("latency", 0.0)
+        server = start_server(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def openai_url(server):
+    return base_url(server)
+
+
+def gemini_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
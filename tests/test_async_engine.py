@@ -0,0 +1,104 @@
+import asyncio
+
+import pandas as pd
+import pytest
+from openai import AsyncOpenAI
+
+import script
+from async_engine import run_concurrent
+from result_journal import ResultJournal, load_journal, completed_ids
+from conftest import openai_url
+
+
+def sentences(n):
+    return pd.DataFrame({
+        "Serial Number": range(1, n + 1),
+        "Ungrammatical Statement": [f"Sentence number {i} have an error." for i in range(1, n + 1)],
+    })
+
+
+def label(df, server, journal_path, concurrency=8):
+    client = AsyncOpenAI(api_key="test", base_url=openai_url(server), max_retries=0)
+    with ResultJournal(journal_path) as journal:
+        asyncio.run(script.label_dataframe(df, client, journal, concurrency=concurrency, batch_size=1))
+    return load_journal(journal_path)
+
+
+def test_run_concurrent_yields_every_key_and_caps_concurrency():
+    in_flight, peak = 0, 0
+
+    async def worker(n):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep((n * 7 % 5) / 1000)
+        in_flight -= 1
+        return n * n
+
+    async def collect():
+        return [item async for item in run_concurrent(((i, i) for i in range(50)), worker, concurrency=4)]
+
+    results = asyncio.run(collect())
+    assert sorted(results) == [(i, i * i) for i in range(50)]
+    assert [key for key, _ in results] != list(range(50))
+    assert peak == 4
+
+
+def test_run_concurrent_reraises_worker_errors():
+    async def worker(n):
+        if n == 3:
+            raise ValueError("boom")
+        await asyncio.sleep(0.01)
+        return n
+
+    async def collect():
+        return [item async for item in run_concurrent(((i, i) for i in range(20)), worker, concurrency=4)]
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(collect())
+
+
+def test_answers_land_on_their_rows_in_any_completion_order(mock_server, tmp_path):
+    server = mock_server(latency=0.02, latency_dist="uniform")
+    df = sentences(40)
+    records = label(df, server, tmp_path / "journal.jsonl", concurrency=8)
+
+    assert set(records) == set(df["Serial Number"])
+    for row_id, sentence in zip(df["Serial Number"], df["Ungrammatical Statement"]):
+        # The mock answers with the sentence it was sent.
+        assert records[row_id]["corrected_sentence"] == sentence
+        assert records[row_id]["tier"] == script.LLM_TIER
+    stats = server.state.snapshot()
+    assert stats["requests"] == 40
+    assert 1 < stats["max_in_flight"] <= 8
+
+
+def test_resume_sends_only_the_rows_left(mock_server, tmp_path):
+    server = mock_server()
+    df = sentences(30)
+    journal_path = tmp_path / "journal.jsonl"
+    label(df.head(12), server, journal_path)
+
+    done = completed_ids(load_journal(journal_path), "error_type")
+    records = label(df[~df["Serial Number"].isin(done)], server, journal_path)
+
+    assert set(records) == set(df["Serial Number"])
+    assert server.state.snapshot()["requests"] == 30
+
+
+def test_failed_rows_are_marked_and_retried_on_resume(mock_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(script, "max_attempts", 1)
+    server = mock_server(error_rate=0.3, seed=1)
+    df = sentences(40)
+    journal_path = tmp_path / "journal.jsonl"
+    records = label(df, server, journal_path)
+
+    failed = set(df["Serial Number"]) - completed_ids(records, "error_type")
+    assert len(failed) == server.state.snapshot()["errors"] > 0
+    assert all(records[row_id]["error_type"] == "Error: Request failed" for row_id in failed)
+    assert all(records[row_id]["output_tokens"] is None for row_id in failed)
+
+    server.state.error_rate = 0.0
+    records = label(df[df["Serial Number"].isin(failed)], server, journal_path)
+    assert completed_ids(records, "error_type") == set(df["Serial Number"])
+    assert server.state.snapshot()["requests"] == 40 + len(failed)
@@ -0,0 +1,86 @@
+from openai import OpenAI
+
+from batch_api import (
+    write_jsonl, openai_requests, gemini_requests,
+    submit_openai_batch, wait_for_openai_batch, read_openai_results,
+    submit_gemini_batch, wait_for_gemini_batch, read_gemini_results,
+)
+from compact_output import OPENAI_RESPONSE_FORMAT, GEMINI_RESPONSE_SCHEMA, output_budget, parse_compact
+from mock_llm_server import CANNED_LABEL
+from conftest import openai_url, gemini_url
+
+FAILED = ("Error: Batch request failed", "Error: Batch request failed")
+MALFORMED = ("Error: Malformed response", "Error: Malformed response")
+TRUNCATED = "This sentence gets an answer cut off by its budget."
+ITEMS = [(1, "She go to school."), (2, "They was late."), (3, TRUNCATED), ("a-7", "Me and him went.")]
+
+
+def budget(sentence):
+    # Too few tokens for the JSON around the correction: the answer is cut off.
+    return 3 if sentence == TRUNCATED else output_budget(sentence)
+
+
+def run_openai(server, tmp_path, items=ITEMS):
+    client = OpenAI(api_key="test", base_url=openai_url(server))
+    path = write_jsonl(tmp_path / "requests.jsonl",
+                       openai_requests(items, "gpt-4o-mini", 0, "Label it.", OPENAI_RESPONSE_FORMAT, budget))
+    job = submit_openai_batch(client, path)
+    batch = wait_for_openai_batch(client, job["id"], poll_interval=0.01)
+    usage = {}
+    return batch, read_openai_results(client, batch, parse_compact, usage), usage
+
+
+def run_gemini(server, tmp_path, items=ITEMS):
+    path = write_jsonl(tmp_path / "requests.jsonl",
+                       gemini_requests(items, lambda s: f'Input Sentence: "{s}"', 0, GEMINI_RESPONSE_SCHEMA, budget,
+                                       system_instruction="Label it."))
+    job = submit_gemini_batch("test", "gemini-2.0-flash", str(path), base_url=gemini_url(server))
+    batch = wait_for_gemini_batch("test", job["id"], poll_interval=0.01, base_url=gemini_url(server))
+    usage = {}
+    return batch, read_gemini_results("test", batch, parse_compact, base_url=gemini_url(server), usage=usage), usage
+
+
+def test_openai_batch_round_trip(mock_server, tmp_path):
+    server = mock_server(batch_delay=0)
+    batch, results, usage = run_openai(server, tmp_path)
+
+    assert batch.status == "completed"
+    assert results == {
+        1: (CANNED_LABEL, "She go to school."),
+        2: (CANNED_LABEL, "They was late."),
+        3: MALFORMED,
+        "a-7": (CANNED_LABEL, "Me and him went."),
+    }
+    assert set(usage) == {1, 2, 3, "a-7"}
+    assert usage[3]["output_tokens"] == 3
+    assert all(u["input_tokens"] > 0 for u in usage.values())
+
+
+def test_gemini_batch_round_trip(mock_server, tmp_path):
+    server = mock_server(batch_delay=0)
+    batch, results, usage = run_gemini(server, tmp_path)
+
+    assert batch["metadata"]["state"] == "BATCH_STATE_SUCCEEDED"
+    assert results == {
+        1: (CANNED_LABEL, "She go to school."),
+        2: (CANNED_LABEL, "They was late."),
+        3: MALFORMED,
+        "a-7": (CANNED_LABEL, "Me and him went."),
+    }
+    assert usage[3]["output_tokens"] == 3
+    assert all(u["input_tokens"] > 0 for u in usage.values())
+
+
+def test_failed_request_lines_are_marked(mock_server, tmp_path):
+    items = [(n, f"Sentence {n} have an error.") for n in range(20)]
+    for provider, run in (("openai", run_openai), ("gemini", run_gemini)):
+        server = mock_server(batch_delay=0, error_rate=0.3, seed=2)
+        batch, results, usage = run(server, tmp_path, items)
+
+        failed = {row_id for row_id, answer in results.items() if answer == FAILED}
+        assert set(results) == {row_id for row_id, _ in items}, provider
+        assert len(failed) == server.state.snapshot()["errors"] > 0, provider
+        assert not failed & set(usage), provider
+        if provider == "openai":
+            assert batch.request_counts.failed == len(failed)
+            assert batch.error_file_id is not None
@@ -0,0 +1,69 @@
+import asyncio
+
+from openai import AsyncOpenAI
+
+import script
+from async_engine import run_concurrent
+from rate_limiter import AdaptiveRateLimiter, retry_after_from_error
+from conftest import openai_url
+
+
+def send(server, limiter, count, concurrency=6):
+    client = AsyncOpenAI(api_key="test", base_url=openai_url(server), max_retries=0)
+    messages = [{"role": "system", "content": script.prompt}]
+
+    async def worker(n):
+        return await script.complete(client, messages + [{"role": "user", "content": f"Sentence {n}."}], limiter)
+
+    async def collect():
+        return [item async for item in run_concurrent(((n, n) for n in range(count)), worker, concurrency)]
+
+    return asyncio.run(collect())
+
+
+def test_backs_off_on_quota_429s_and_recovers(mock_server):
+    # 10 requests per half second is 1200 rpm; the limiter starts at twice that.
+    server = mock_server(quota=10, quota_window=0.5)
+    limiter = AdaptiveRateLimiter(rpm=2400, max_rpm=2400, increase=60)
+
+    assert len(send(server, limiter, 30)) == 30
+    throttled = server.state.snapshot()["throttled"]
+    assert throttled > 0
+    assert limiter.throttles == throttled
+    assert limiter.successes == 30
+    assert limiter.rpm < 2400
+    # The Retry-After pauses are waited out, not retried into.
+    assert limiter.waited > 0
+
+    backed_off = limiter.rpm
+    server.state.quota = None
+    send(server, limiter, 20)
+    assert limiter.rpm == min(2400, backed_off + 20 * 60)
+    assert server.state.snapshot()["throttled"] == throttled
+    assert limiter.summary().startswith(
+        f"rate limiter: 50 ok, {throttled} throttled, now {limiter.rpm:.0f} rpm, "
+    )
+
+
+def test_a_burst_of_429s_halves_the_rate_once():
+    limiter = AdaptiveRateLimiter(rpm=600)
+    granted = [limiter.acquire() for _ in range(3)]
+    for granted_at in granted:
+        limiter.on_throttle(0.0, granted_at)
+    assert limiter.rpm == 300
+    assert limiter.throttles == 3
+
+
+def test_retry_after_is_read_from_the_mock_429(mock_server):
+    server = mock_server(quota=1, quota_window=30.0)
+    client = AsyncOpenAI(api_key="test", base_url=openai_url(server), max_retries=0)
+
+    async def twice():
+        await client.chat.completions.create(model="m", messages=[{"role": "user", "content": "a"}])
+        try:
+            await client.chat.completions.create(model="m", messages=[{"role": "user", "content": "b"}])
+        except Exception as e:
+            return e
+
+    error = asyncio.run(twice())
+    assert 29 < retry_after_from_error(error) <= 30
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+from conftest import REPO
+
+sys.path.insert(0, os.path.join(REPO, "gemini"))
+import geminiApi
+
+
+@pytest.fixture
+def rows():
+    return pd.DataFrame({
+        "original_index": range(6),
+        geminiApi.COL_ERROR_TYPE: ["Verb Tense Errors", "Spelling Errors"] * 3,
+        geminiApi.COL_INCORRECT: [f"Sentence {i}." for i in range(6)],
+    })
+
+
+@pytest.mark.parametrize("max_rows, round_size", [(0, 2), (-1, 2), (None, 0)])
+def test_label_sample_with_nothing_to_draw_labels_nothing(rows, monkeypatch, max_rows, round_size):
+    monkeypatch.setattr(geminiApi, "SAMPLE_MAX_ROWS", max_rows)
+    monkeypatch.setattr(geminiApi, "SAMPLE_ROUND_SIZE", round_size)
+    monkeypatch.setattr(geminiApi, "label_queue", pytest.fail)
+    assert geminiApi.label_sample(rows, set(), session=None) == []
+
+
+def test_label_sample_keeps_drawing_while_no_row_is_labeled(rows, monkeypatch, tmp_path):
+    output = tmp_path / "out.csv"
+    rounds = []
+
+    def label_queue(df_queue, session):
+        # The first round's rows all fail before anything is written.
+        rounds.append(len(df_queue))
+        if len(rounds) > 1:
+            df_queue.assign(api_label=df_queue[geminiApi.COL_ERROR_TYPE]).to_csv(
+                output, mode="a", header=not output.exists(), index=False)
+        return [df_queue]
+
+    monkeypatch.setattr(geminiApi, "OUTPUT_FILE", str(output))
+    monkeypatch.setattr(geminiApi, "SAMPLE_MAX_ROWS", None)
+    monkeypatch.setattr(geminiApi, "SAMPLE_ROUND_SIZE", 2)
+    monkeypatch.setattr(geminiApi, "SAMPLE_TARGET_HALF_WIDTH", 0.6)
+    monkeypatch.setattr(geminiApi, "label_queue", label_queue)
+    assert len(geminiApi.label_sample(rows, set(), session=None)) == 2
+    assert rounds == [2, 2]
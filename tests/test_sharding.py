@@ -0,0 +1,71 @@
+import os
+import sys
+import subprocess
+
+import pandas as pd
+import pytest
+
+from conftest import REPO, gemini_url
+
+SCRIPT = os.path.join(REPO, "gemini", "geminiApi.py")
+OUTPUT = "gemini_evaluation_results_v2.csv"
+
+
+@pytest.fixture
+def run_dir(tmp_path):
+    rows = pd.read_csv(os.path.join(REPO, "gemini", "Grammar Correction.csv"), encoding="utf-8-sig").head(30)
+    rows.to_csv(tmp_path / "Grammar Correction.csv", index=False)
+    return tmp_path
+
+
+def gemini(run_dir, server, *args):
+    env = dict(os.environ, GOOGLE_API_KEY="test", GEMINI_BASE_URL=gemini_url(server),
+               LLM_CACHE_PATH=str(run_dir / "cache.sqlite"), RESULTS_STORE=str(run_dir / "store"))
+    done = subprocess.run([sys.executable, SCRIPT, *args], cwd=run_dir, env=env,
+                          capture_output=True, text=True, timeout=120)
+    assert done.returncode == 0, done.stderr
+    return done.stdout
+
+
+def shard_file(run_dir, index, count=3):
+    return run_dir / f"gemini_evaluation_results_v2.shard-{index}-of-{count}.csv"
+
+
+def test_merge_accepts_only_a_complete_consistent_set_of_shards(mock_server, run_dir):
+    server = mock_server()
+    for index in (0, 1):
+        gemini(run_dir, server, "--shard", f"{index}/3")
+    shard_rows = [pd.read_csv(shard_file(run_dir, i)) for i in (0, 1)]
+    assert all(len(rows) for rows in shard_rows)
+    assert not set(shard_rows[0]["original_index"]) & set(shard_rows[1]["original_index"])
+
+    out = gemini(run_dir, server, "--merge", "3")
+    assert "no output file for shards 2" in out
+    assert " missing: " in out
+    assert not (run_dir / OUTPUT).exists()
+
+    gemini(run_dir, server, "--shard", "2/3")
+    first = pd.read_csv(shard_file(run_dir, 0))
+    second = shard_file(run_dir, 1)
+    original = second.read_bytes()
+    rows = pd.read_csv(second)
+
+    # A row of shard 0 also written by shard 1, with the same answer.
+    pd.concat([rows, first.head(1)]).to_csv(second, index=False)
+    out = gemini(run_dir, server, "--merge", "3")
+    assert "1 duplicated across shards" in out and " misplaced: " in out
+    assert not (run_dir / OUTPUT).exists()
+
+    # The same row answered differently by shard 1.
+    pd.concat([rows, first.head(1).assign(api_label="Spelling Errors")]).to_csv(second, index=False)
+    out = gemini(run_dir, server, "--merge", "3")
+    assert "1 conflicts: " in out
+    assert not (run_dir / OUTPUT).exists()
+
+    second.write_bytes(original)
+    out = gemini(run_dir, server, "--merge", "3")
+    merged = pd.read_csv(run_dir / OUTPUT)
+    assert f"Merged {len(merged)} rows" in out
+    assert sorted(merged["original_index"]) == list(range(30))
+    assert merged["api_label"].notna().all()
+    assert server.state.snapshot()["requests"] == 30